@@ -1,63 +1,413 @@
+import asyncio
 import json
 import os
 import shutil
-from typing import TypedDict, Annotated, List, Dict, Any
+import threading
+from dataclasses import astuple
+from typing import TypedDict, Annotated, List, Dict, Any, Literal, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
+import numpy as np
 from langchain_core.documents import Document
-from langgraph.graph import StateGraph, END
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from pydantic import ValidationError
 import re
 
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
-from . import models
 
+# Before the local imports: cache and vector store modules read their settings at import time.
 load_dotenv()
 
-llm = ChatGroq(
-    temperature=0.6, 
-    model_name="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY")
+from . import models, schemas
+from .llm_gateway import LLMGateway, Provider, build_providers
+from .llm_cache import llm_cache
+from .prompt_registry import prompt_registry, PromptSnapshot
+from .preclassifier import preclassifier
+from .dedup import near_duplicates, NearDuplicate
+from .context_budget import (
+    CONTEXT_TOKEN_BUDGET, EMAIL_BODY_TOKENS, RAG_SNIPPET_TOKENS, ContextReport,
+    message_tokens, truncate_tokens, relevant_passages, fit_history
 )
+from .vectorstore import build_embeddings, build_vector_store, delete_vectors, export_vectors, tenant_collection
+from .search import (
+    SearchFilters, RetrievalMode, lexical_search, reciprocal_rank_fusion, chunk_text, collapse_by_email
+)
+from .retrieval_cache import retrieval_result_cache, index_generation, normalize_query
+from . import metrics, tenants
+from .metrics import span, traced_node, current_node
 
-# --- SETUP RAG (VECTOR DATABASE) ---
-VECTOR_DB_PATH = "./chroma_db"
-embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+# USD per million tokens, for the llm_cost_usd_total metric (defaults: Groq llama-3.3-70b-versatile).
+LLM_PRICE_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", "0.59"))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", "0.79"))
 
-vector_store = Chroma(
-    collection_name="email_inbox",
-    embedding_function=embeddings,
-    persist_directory=VECTOR_DB_PATH
-)
+_usage_lock = threading.Lock()
+llm_usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+
+def usage_snapshot() -> Dict[str, int]:
+    with _usage_lock:
+        return dict(llm_usage)
+
+def _record_usage(provider: Provider, usage: Dict[str, int], node: str):
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    with _usage_lock:
+        llm_usage["calls"] += 1
+        llm_usage["input_tokens"] += input_tokens
+        llm_usage["output_tokens"] += output_tokens
+    metrics.LLM_TOKENS.inc(input_tokens, node=node, kind="input")
+    metrics.LLM_TOKENS.inc(output_tokens, node=node, kind="output")
+    cost = (input_tokens * LLM_PRICE_INPUT_PER_MTOK + output_tokens * LLM_PRICE_OUTPUT_PER_MTOK) / 1_000_000
+    metrics.LLM_COST_USD.inc(cost, model=provider.model_name)
+
+# Groq first, then the configured fallbacks; quotas (GROQ_RPM/GROQ_TPM...), concurrency caps,
+# timeouts, retries and hedging live in the gateway.
+llm_gateway = LLMGateway(build_providers(), on_usage=_record_usage)
+metrics.CallbackMetric("llm_provider_up", "1 while a provider's circuit breaker is closed.", "gauge", ["provider"],
+                       lambda: {(provider.name,): float(provider.available()) for provider in llm_gateway.providers})
+
+def call_llm_answered(messages, node: Optional[str] = None) -> Tuple[Any, str]:
+    """
+    Single entry point for LLM calls so every request goes through the gateway. Returns the
+    response and the model that answered, which is a fallback's after a failover or hedge.
+    `node` labels the latency/token metrics; by default it's the triage node being run.
+    """
+    node = node or current_node.get()
+    try:
+        with span("llm.invoke", metrics.LLM_REQUEST_SECONDS, node=node, operation="invoke"):
+            provider, response = llm_gateway.invoke(messages, node)
+    except Exception:
+        metrics.LLM_ERRORS.inc(node=node)
+        raise
+    return response, provider.model_name
+
+def call_llm(messages, node: Optional[str] = None):
+    return call_llm_answered(messages, node)[0]
+
+async def acall_llm_answered(messages, node: Optional[str] = None) -> Tuple[Any, str]:
+    """Async call_llm_answered: waits for quota and the response without holding a worker thread."""
+    node = node or current_node.get()
+    try:
+        with span("llm.ainvoke", metrics.LLM_REQUEST_SECONDS, node=node, operation="ainvoke"):
+            provider, response = await llm_gateway.ainvoke(messages, node)
+    except Exception:
+        metrics.LLM_ERRORS.inc(node=node)
+        raise
+    return response, provider.model_name
+
+async def acall_llm(messages, node: Optional[str] = None):
+    return (await acall_llm_answered(messages, node))[0]
+
+async def astream_llm(messages, node: Optional[str] = None, answered: Optional[Dict] = None):
+    """
+    Streaming counterpart of acall_llm: yields content tokens as they arrive. `answered` is
+    filled in as by LLMGateway.astream.
+    """
+    node = node or current_node.get()
+    tokens = llm_gateway.astream(messages, node, answered)
+    try:
+        # Latency covers the whole stream, first token to last.
+        with span("llm.stream", metrics.LLM_REQUEST_SECONDS, node=node, operation="stream"):
+            async for token in tokens:
+                yield token
+    except Exception:
+        metrics.LLM_ERRORS.inc(node=node)
+        raise
+    finally:
+        # Closed here, not by the garbage collector, so a disconnect frees the provider slot.
+        await tokens.aclose()
+
+def llm_cache_key(node: str, messages, model: Optional[str] = None) -> str:
+    """
+    Cache key for a node call: the first message is the prompt, the rest is the email payload.
+    Lookups use the primary provider's model.
+    """
+    payload = "\n".join(m.content for m in messages[1:])
+    return llm_cache.make_key(node, model or llm_gateway.model_name, messages[0].content, payload)
+
+def cache_answer(node: str, messages, key: str, model: str, value):
+    """
+    Stores a result under the model that produced it, so a fallback provider's answer is
+    never served later as the primary's.
+    """
+    if model != llm_gateway.model_name:
+        key = llm_cache_key(node, messages, model)
+    llm_cache.put(key, node, model, value)
+
+def cache_lookup(node: str, key: str):
+    """llm_cache.get, counted per node in llm_cache_lookups_total."""
+    cached = llm_cache.get(key)
+    metrics.LLM_CACHE_LOOKUPS.inc(node=node, result="miss" if cached is None else "hit")
+    return cached
+
+def cached_llm_text(node: str, messages) -> str:
+    """call_llm for plain-text nodes, answered from the result cache when already seen."""
+    key = llm_cache_key(node, messages)
+    cached = cache_lookup(node, key)
+    if cached is not None:
+        return cached
+    response, model = call_llm_answered(messages, node)
+    text = response.content.strip()
+    cache_answer(node, messages, key, model, text)
+    return text
+
+async def acached_llm_text(node: str, messages) -> str:
+    key = llm_cache_key(node, messages)
+    cached = await asyncio.to_thread(cache_lookup, node, key)
+    if cached is not None:
+        return cached
+    response, model = await acall_llm_answered(messages, node)
+    text = response.content.strip()
+    await asyncio.to_thread(cache_answer, node, messages, key, model, text)
+    return text
+
+def parse_json_object(content: str) -> Optional[Dict[str, Any]]:
+    """Parses a JSON object from an LLM reply, tolerating prose or markdown fences around it."""
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        match = re.search(r"\{.*\}", content, re.DOTALL)
+        if not match:
+            return None
+        try:
+            parsed = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+# --- SETUP RAG (VECTOR DATABASE) ---
+# Backends are chosen by EMBEDDING_BACKEND / VECTOR_BACKEND (see vectorstore.py).
+VECTOR_BATCH_SIZE = int(os.getenv("VECTOR_BATCH_SIZE", "64"))
+embeddings = build_embeddings()
+# Each mailbox has its own collection, opened on first use and closed with the tenant.
+vector_store = tenants.TenantLocal(lambda tenant: build_vector_store(embeddings, tenant_collection(tenant)))
 
 def clear_vector_db():
     """Wipes the vector database for a clean reset."""
-    global vector_store
+    ingestion_buffer.clear()
+    index_generation.bump()
     try:
         vector_store.delete_collection() 
-        vector_store = Chroma(
-            collection_name="email_inbox",
-            embedding_function=embeddings,
-            persist_directory=VECTOR_DB_PATH
-        )
     except:
         pass
+    vector_store.forget()
+
+# Bodies longer than RAG_CHUNK_CHARS are indexed as overlapping chunks, so retrieval returns
+# the relevant part of a long email instead of all of it.
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "800"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+
+def email_documents(email: models.Email) -> List[Tuple[str, Document]]:
+    """(vector id, document) per body chunk. Each chunk repeats the sender/subject header."""
+    # The date lives in metadata, not in the embedded text: mock emails get fresh timestamps on
+    # every reset and the embedding cache is keyed by the exact text.
+    header = f"From: {email.sender}\nSubject: {email.subject}\nBody: "
+    metadata = {
+        "email_id": email.id, "category": email.category, "sender": email.sender,
+        "timestamp": str(email.timestamp),
+        # Numeric copy of the date for range filters
+        "ts": email.timestamp.timestamp() if email.timestamp else 0.0,
+    }
+    chunks = chunk_text(email.body or "", RAG_CHUNK_CHARS, RAG_CHUNK_OVERLAP)
+    # A short email keeps the id and text it had before chunking, and with them its cached embedding.
+    return [
+        (f"email-{email.id}" if i == 0 else f"email-{email.id}-{i}",
+         Document(page_content=header + chunk, metadata={**metadata, "chunk": i}))
+        for i, chunk in enumerate(chunks)
+    ]
+
+def format_context_doc(doc: Document, content: Optional[str] = None) -> str:
+    """Renders a retrieved document for a prompt, restoring the date line. `content` replaces a trimmed body."""
+    timestamp = doc.metadata.get("timestamp")
+    content = doc.page_content if content is None else content
+    return f"Date: {timestamp}\n{content}" if timestamp else content
+
+def fit_context_docs(docs: List[Document], query: str, report: ContextReport) -> Tuple[List[str], List[str]]:
+    """(full, trimmed) renderings of retrieved documents; trimmed keeps the passages relevant to the query."""
+    full, trimmed = [], []
+    for doc in docs:
+        passages = relevant_passages(doc.page_content, query, RAG_SNIPPET_TOKENS)
+        report.trimmed_snippets += passages != doc.page_content
+        full.append(format_context_doc(doc))
+        trimmed.append(format_context_doc(doc, passages))
+    return full, trimmed
+
+def record_context(prompt: str, report: ContextReport, messages) -> ContextReport:
+    report.tokens_after = sum(message_tokens(m.content) for m in messages)
+    metrics.CONTEXT_TOKENS.inc(report.tokens_after, prompt=prompt, kind="sent")
+    metrics.CONTEXT_TOKENS.inc(report.tokens_saved, prompt=prompt, kind="saved")
+    return report
+
+def _write_documents(docs: List[Document], ids: List[str], batch_size: int):
+    # Stable ids make re-ingesting a reprocessed email an upsert instead of a duplicate.
+    for start in range(0, len(docs), batch_size):
+        with span("vector.upsert", metrics.VECTOR_STORE_SECONDS, operation="upsert"):
+            vector_store.add_documents(docs[start:start + batch_size], ids=ids[start:start + batch_size])
+    index_generation.bump()
+
+def ingest_emails(emails: List[models.Email], batch_size: Optional[int] = None) -> int:
+    """Bulk ingestion: embeds and stores many emails in a few batched round trips."""
+    pairs = [pair for email in emails for pair in email_documents(email)]
+    _write_documents([doc for _, doc in pairs], [doc_id for doc_id, _ in pairs], batch_size or VECTOR_BATCH_SIZE)
+    return len(emails)
+
+class VectorIngestBuffer:
+    """
+    Collects documents from individual email updates and writes them in batches.
+    Retrieval flushes it first, so pending emails are always searchable.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._pending: Dict[str, Document] = {}
+        self._lock = threading.Lock()
+
+    def add(self, email: models.Email):
+        with self._lock:
+            self._pending.update(email_documents(email))
+            full = len(self._pending) >= self.batch_size
+        # The email row already changed (category etc.), which lexical results reflect right away.
+        index_generation.bump()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            _write_documents(list(pending.values()), list(pending.keys()), self.batch_size)
+        return len(pending)
+
+    def discard(self, email_id: int):
+        with self._lock:
+            self._pending = {doc_id: doc for doc_id, doc in self._pending.items()
+                             if doc.metadata["email_id"] != email_id}
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+# Flushed when its tenant is evicted, so no pending document is lost.
+ingestion_buffer = tenants.TenantLocal(lambda tenant: VectorIngestBuffer(VECTOR_BATCH_SIZE),
+                                       close=VectorIngestBuffer.flush)
 
 def add_email_to_vector_db(email: models.Email):
     """
-    Ingestion Step: Converts an email into a vector document and saves it.
+    Ingestion Step: Converts an email into a vector document and queues it.
     This creates the 'Knowledge Base'.
     """
-    content = f"From: {email.sender}\nSubject: {email.subject}\nDate: {email.timestamp}\nBody: {email.body}"
-    
-    doc = Document(
-        page_content=content,
-        metadata={"email_id": email.id, "category": email.category, "sender": email.sender}
-    )
-    
-    vector_store.add_documents([doc])
+    ingestion_buffer.add(email)
+
+def remove_email_from_vector_db(email_id: int):
+    """Drops a deleted email's chunks, queued or stored, so retrieval stops returning them."""
+    ingestion_buffer.discard(email_id)
+    with span("vector.delete", metrics.VECTOR_STORE_SECONDS, operation="delete"):
+        delete_vectors(vector_store, {"email_id": email_id})
+
+# "hybrid" fuses BM25 (emails_fts) and vector ranks, "lexical" skips the embedding call entirely.
+RETRIEVAL_MODE: RetrievalMode = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RAG_CHUNK_FANOUT = 4  # chunks fetched per wanted email before collapsing to one per email
+# Maximal Marginal Relevance over MMR_FETCH_K candidates, so the context isn't k near-copies.
+RAG_MMR = os.getenv("RAG_MMR", "1") == "1"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "8"))
+
+def _lexical(query: str, k: int, filters: SearchFilters) -> List[Tuple[Document, float]]:
+    with span("retrieval.lexical", metrics.LEXICAL_SEARCH_SECONDS):
+        return lexical_search(query, k, filters)
+
+def _vector(query: str, k: int, filters: SearchFilters) -> List[Tuple[Document, float]]:
+    """Best chunk of each of the top `k` emails."""
+    # Includes the query embedding, which embedding_duration_seconds also reports on its own.
+    with span("retrieval.vector", metrics.VECTOR_STORE_SECONDS, operation="search"):
+        chunks = vector_store.similarity_search_with_score(query, k=k * RAG_CHUNK_FANOUT, filter=filters.vector_where())
+    return collapse_by_email(chunks, k)
+
+def _search(query: str, k: int, filters: SearchFilters, mode: RetrievalMode) -> List[Tuple[Document, float]]:
+    if mode == "lexical":
+        return _lexical(query, k, filters)
+    if mode == "vector":
+        return _vector(query, k, filters)
+
+    candidates = max(k, HYBRID_CANDIDATES)
+    lexical = [doc for doc, _ in _lexical(query, candidates, filters)]
+    semantic = [doc for doc, _ in _vector(query, candidates, filters)]
+    # Semantic first: an email found by both is represented by its matching chunk, not its whole body.
+    return reciprocal_rank_fusion([semantic, lexical], k)
+
+def search_emails(query: str, k: int = 2, filters: Optional[SearchFilters] = None,
+                  mode: Optional[RetrievalMode] = None) -> List[Tuple[Document, float]]:
+    """
+    (document, score) pairs, best first. Scores are BM25 for "lexical", RRF for "hybrid"
+    and the vector backend's own score for "vector". Results are cached until the index changes.
+    """
+    mode = mode or RETRIEVAL_MODE
+    filters = filters or SearchFilters()
+    if mode != "lexical":
+        ingestion_buffer.flush()
+    # Generation is read before searching: a write racing with the search leaves an entry nobody asks for.
+    key = (tenants.current_tenant.get(), index_generation.value, mode, k, normalize_query(query), astuple(filters))
+    results = retrieval_result_cache.get(key)
+    if results is None:
+        results = _search(query, k, filters, mode)
+        retrieval_result_cache.put(key, results)
+    return results
+
+def stored_candidate_vectors(candidates: List[Document], query_vector: np.ndarray
+                             ) -> Tuple[List[Document], List[np.ndarray]]:
+    """
+    The indexed vector of each candidate, read from the vector store instead of re-embedded.
+    A lexical hit carries the whole body, which was never embedded as one text, so it is
+    replaced by its chunk closest to the query.
+    """
+    email_ids = list({doc.metadata["email_id"] for doc in candidates})
+    _, vectors, texts, metadatas = export_vectors(vector_store, {"email_id": {"$in": email_ids}})
+    chunks: Dict[int, List[Tuple[np.ndarray, str, dict]]] = {}
+    for vector, text, metadata in zip(vectors, texts, metadatas):
+        chunks.setdefault(metadata["email_id"], []).append((np.asarray(vector), text, metadata))
+
+    query_unit = query_vector / (np.linalg.norm(query_vector) or 1.0)
+    docs, chosen, unindexed = [], [], []
+    for doc in candidates:
+        stored = chunks.get(doc.metadata["email_id"])
+        if not stored:
+            unindexed.append(len(docs))
+            docs.append(doc)
+            chosen.append(None)
+            continue
+        match = next((chunk for chunk in stored if chunk[1] == doc.page_content), None)
+        if match is None:
+            match = max(stored, key=lambda chunk: float(chunk[0] @ query_unit) / (np.linalg.norm(chunk[0]) or 1.0))
+            doc = Document(page_content=match[1], metadata=match[2])
+        docs.append(doc)
+        chosen.append(match[0])
+    # Only an email missing from the index (written after the flush) is embedded here.
+    if unindexed:
+        for i, vector in zip(unindexed, embeddings.embed_documents([docs[i].page_content for i in unindexed])):
+            chosen[i] = np.asarray(vector)
+    return docs, chosen
+
+def retrieve(query: str, k: int = 2, filters: Optional[SearchFilters] = None,
+             mode: Optional[RetrievalMode] = None, diverse: Optional[bool] = None) -> List[Document]:
+    """
+    Context retrieval for the chat and compose prompts: one passage per email, picked by MMR
+    among the top candidates (default RAG_MMR). Lexical mode skips MMR, which needs embeddings.
+    """
+    mode = mode or RETRIEVAL_MODE
+    diverse = RAG_MMR if diverse is None else diverse
+    if not diverse or mode == "lexical":
+        return [doc for doc, _ in search_emails(query, k, filters, mode)]
+
+    candidates = [doc for doc, _ in search_emails(query, max(k, MMR_FETCH_K), filters, mode)]
+    if len(candidates) <= k:
+        return candidates
+    with span("retrieval.mmr"):
+        query_vector = np.array(embeddings.embed_query(query))
+        candidates, vectors = stored_candidate_vectors(candidates, query_vector)
+        chosen = maximal_marginal_relevance(query_vector, vectors, MMR_LAMBDA, k)
+    return [candidates[i] for i in chosen]
 
 class AgentState(TypedDict):
     email_body: str
@@ -70,6 +420,7 @@ class AgentState(TypedDict):
     reply_prompt: str
 
 
+@traced_node("categorize")
 def categorize_node(state: AgentState):
     """Determine the category."""
     prompt = state["categorize_prompt"]
@@ -79,9 +430,9 @@ def categorize_node(state: AgentState):
         SystemMessage(content=prompt),
         HumanMessage(content=email_text)
     ]
-    response = llm.invoke(messages)
-    return {"category": response.content.strip()}
+    return {"category": cached_llm_text("categorize", messages)}
 
+@traced_node("extract_actions")
 def extract_actions_node(state: AgentState):
     """Extract tasks and suggestions into JSON using strict formatting."""
     prompt = state["action_prompt"]
@@ -105,34 +456,28 @@ def extract_actions_node(state: AgentState):
         SystemMessage(content=strict_prompt),
         HumanMessage(content=f"Email: {email_text}")
     ]
-    response = llm.invoke(messages)
-    
-    content = response.content.strip()
+    key = llm_cache_key("extract_actions", messages)
+    cached = cache_lookup("extract_actions", key)
+    if cached is not None:
+        return {"action_items": cached}
+
+    response, model = call_llm_answered(messages)
     
-    final_actions = {"tasks": [], "suggestions": []}
+    parsed = parse_json_object(response.content.strip())
+    if parsed is not None:
+        cache_answer("extract_actions", messages, key, model, parsed)
+    final_actions = parsed if parsed is not None else {"tasks": [], "suggestions": []}
 
-    try:
-        parsed = json.loads(content)
-        if isinstance(parsed, dict):
-            final_actions = parsed
-    except json.JSONDecodeError:
-        match = re.search(r"\{.*\}", content, re.DOTALL)
-        if match:
-            try:
-                json_str = match.group(0)
-                parsed = json.loads(json_str)
-                if isinstance(parsed, dict):
-                    final_actions = parsed
-            except:
-                pass
-            
     return {"action_items": final_actions}
 
+def needs_reply(category: str) -> bool:
+    category = category.lower()
+    return not ("spam" in category or "newsletter" in category)
+
+@traced_node("draft_reply")
 def draft_reply_node(state: AgentState):
     """Write a reply if necessary."""
-    category = state.get("category", "").lower()
-    
-    if "spam" in category or "newsletter" in category:
+    if not needs_reply(state.get("category", "")):
         return {"draft": "NO_REPLY_NEEDED"}
 
     prompt = state["reply_prompt"]
@@ -142,32 +487,90 @@ def draft_reply_node(state: AgentState):
         SystemMessage(content=prompt),
         HumanMessage(content=email_text)
     ]
-    response = llm.invoke(messages)
-    return {"draft": response.content.strip()}
-
-workflow = StateGraph(AgentState)
-workflow.add_node("categorize", categorize_node)
-workflow.add_node("extract_actions", extract_actions_node)
-workflow.add_node("draft_reply", draft_reply_node)
-workflow.set_entry_point("categorize")
-workflow.add_edge("categorize", "extract_actions")
-workflow.add_edge("extract_actions", "draft_reply")
-workflow.add_edge("draft_reply", END)
+    return {"draft": cached_llm_text("draft_reply", messages)}
 
-app_graph = workflow.compile()
+def build_graph(parallel: bool = True):
+    """
+    Builds the triage workflow. extract_actions doesn't read the category, so in parallel
+    mode it runs alongside categorize and both join before draft_reply.
+    parallel=False keeps the original linear chain (used for latency comparisons).
+    """
+    workflow = StateGraph(AgentState)
+    workflow.add_node("categorize", categorize_node)
+    workflow.add_node("extract_actions", extract_actions_node)
+    workflow.add_node("draft_reply", draft_reply_node)
+    if parallel:
+        workflow.add_edge(START, "categorize")
+        workflow.add_edge(START, "extract_actions")
+        workflow.add_edge(["categorize", "extract_actions"], "draft_reply")
+    else:
+        workflow.set_entry_point("categorize")
+        workflow.add_edge("categorize", "extract_actions")
+        workflow.add_edge("extract_actions", "draft_reply")
+    workflow.add_edge("draft_reply", END)
+    return workflow.compile()
 
-def generate_new_email(recipient: str, subject: str, instructions: str, db: Session):
-    """Generates a new email. Includes RAG context if available."""
-    
-    relevant_docs = vector_store.similarity_search(f"{recipient} {subject} {instructions}", k=2)
-    context_str = ""
-    if relevant_docs:
-        context_str = "\n\n--- RELEVANT CONTEXT FROM PAST EMAILS ---\n" + "\n\n".join([d.page_content for d in relevant_docs])
+app_graph = build_graph()
 
-    style_prompt = db.query(models.Prompt).filter_by(prompt_type="auto_reply").first()
-    style_content = style_prompt.content if style_prompt else "Be professional and concise."
+PipelineMode = Literal["graph", "fused"]
 
+@traced_node("fused")
+def fused_triage(state: AgentState) -> Optional[Dict[str, Any]]:
+    """
+    Category, actions and draft from a single LLM call, using the same three user prompts.
+    Returns None when the reply doesn't validate, so the caller can fall back to the graph.
+    """
     system_prompt = (
+        "You triage emails. Apply the three instructions below to the email and answer with ONE JSON OBJECT.\n\n"
+        f"--- CATEGORIZATION ---\n{state['categorize_prompt']}\n\n"
+        f"--- ACTION EXTRACTION ---\n{state['action_prompt']}\n\n"
+        f"--- REPLY STYLE ---\n{state['reply_prompt']}\n\n"
+        "The JSON OBJECT must have exactly these keys:\n"
+        "1. 'category': the single category name.\n"
+        "2. 'tasks': A list of concise strings of things the user needs to do.\n"
+        "3. 'suggestions': A list of strings representing AI suggested follow-ups.\n"
+        "4. 'draft': the reply text, or \"NO_REPLY_NEEDED\" for spam and newsletters.\n"
+        "Return ONLY the JSON. No markdown."
+    )
+    messages = [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=f"Sender: {state['sender']}\nBody: {state['email_body']}")
+    ]
+    key = llm_cache_key("fused", messages)
+    cached = cache_lookup("fused", key)
+    if cached is not None:
+        return cached
+
+    response, model = call_llm_answered(messages)
+
+    parsed = parse_json_object(response.content.strip())
+    if parsed is None:
+        return None
+    try:
+        triage = schemas.TriageResult.model_validate(parsed)
+    except ValidationError:
+        return None
+
+    result = {
+        "category": triage.category.strip(),
+        "action_items": {"tasks": triage.tasks, "suggestions": triage.suggestions},
+        "draft": triage.draft.strip() if needs_reply(triage.category) else "NO_REPLY_NEEDED",
+    }
+    cache_answer("fused", messages, key, model, result)
+    return result
+
+DEFAULT_STYLE = "Be professional and concise."
+
+def get_style_content(db: Optional[Session] = None) -> str:
+    style_prompt = prompt_registry.snapshot(db).get("auto_reply")
+    return style_prompt.content if style_prompt else DEFAULT_STYLE
+
+def generate_prompt(recipient: str, subject: str, instructions: str, style_content: str, snippets: List[str]) -> str:
+    context_str = ""
+    if snippets:
+        context_str = "\n\n--- RELEVANT CONTEXT FROM PAST EMAILS ---\n" + "\n\n".join(snippets)
+
+    return (
         f"You are an AI Email Assistant. Your task is to write a new email.\n"
         f"Style Guide/Tone: {style_content}\n"
         f"Recipient: {recipient}\n"
@@ -176,35 +579,217 @@ def generate_new_email(recipient: str, subject: str, instructions: str, db: Sess
         f"{context_str}\n\n"
         f"Output ONLY the email body. Do not include the subject line, greeting, or signature unless implicit in the style."
     )
-    
+
+def build_generate_messages(recipient: str, subject: str, instructions: str, style_content: str,
+                            retrieval: Optional[RetrievalMode] = None) -> Tuple[list, ContextReport]:
+    """RAG retrieval + prompt assembly for composing a new email, within the context token budget."""
+    query = f"{recipient} {subject} {instructions}"
+    relevant_docs = retrieve(query, k=2, mode=retrieval)
+    report = ContextReport(budget=CONTEXT_TOKEN_BUDGET)
+    full, snippets = fit_context_docs(relevant_docs, query, report)
+    report.tokens_before = message_tokens(generate_prompt(recipient, subject, instructions, style_content, full))
+
+    system_prompt = generate_prompt(recipient, subject, instructions, style_content, snippets)
+    while snippets and message_tokens(system_prompt) > CONTEXT_TOKEN_BUDGET:
+        snippets.pop()
+        report.dropped_snippets += 1
+        system_prompt = generate_prompt(recipient, subject, instructions, style_content, snippets)
+
     messages = [HumanMessage(content=system_prompt)]
-    response = llm.invoke(messages)
-    return response.content.strip()
+    return messages, record_context("generate", report, messages)
+
+def generate_new_email(recipient: str, subject: str, instructions: str, db: Session,
+                       retrieval: Optional[RetrievalMode] = None) -> Tuple[str, ContextReport]:
+    """Generates a new email. Includes RAG context if available."""
+    messages, report = build_generate_messages(recipient, subject, instructions, get_style_content(db), retrieval)
+    return cached_llm_text("generate_new_email", messages), report
+
+async def agenerate_new_email(recipient: str, subject: str, instructions: str, style_content: str,
+                              retrieval: Optional[RetrievalMode] = None) -> Tuple[str, ContextReport]:
+    """Async generate_new_email. Retrieval is blocking I/O, so it runs in a worker thread."""
+    messages, report = await asyncio.to_thread(build_generate_messages, recipient, subject, instructions, style_content, retrieval)
+    return await acached_llm_text("generate_new_email", messages), report
+
+async def astream_new_email(recipient: str, subject: str, instructions: str, style_content: str,
+                            retrieval: Optional[RetrievalMode] = None):
+    """
+    Streaming variant of generate_new_email. Retrieval finishes before this returns, so the
+    async generator yields LLM tokens only. The full text is cached once the stream completes.
+    Returns (token generator, context report).
+    """
+    messages, report = await asyncio.to_thread(build_generate_messages, recipient, subject, instructions, style_content, retrieval)
+    key = llm_cache_key("generate_new_email", messages)
+    cached = await asyncio.to_thread(cache_lookup, "generate_new_email", key)
+
+    async def tokens():
+        if cached is not None:
+            yield cached
+            return
+        parts, answered = [], {}
+        async for token in astream_llm(messages, "generate_new_email", answered):
+            parts.append(token)
+            yield token
+        await asyncio.to_thread(cache_answer, "generate_new_email", messages, key,
+                                answered["provider"].model_name, "".join(parts).strip())
+
+    return tokens(), report
+
+# Each stage records the version of the prompt that produced its output on the Email row.
+STAGE_PROMPTS = {
+    "categorize": "categorize",
+    "extract_actions": "extract_actions",
+    "draft_reply": "auto_reply",
+}
+STAGE_VERSION_COLUMNS = {
+    "categorize": "categorize_prompt_version",
+    "extract_actions": "extract_actions_prompt_version",
+    "draft_reply": "auto_reply_prompt_version",
+}
+STAGE_NODES = {
+    "categorize": categorize_node,
+    "extract_actions": extract_actions_node,
+    "draft_reply": draft_reply_node,
+}
+
+def stale_stages(email: models.Email, prompts: PromptSnapshot) -> List[str]:
+    """
+    Stages whose output was produced by an older prompt version (or never produced).
+    The draft depends on the category, so a stale category also invalidates the draft.
+    """
+    stale = [
+        stage for stage, prompt_type in STAGE_PROMPTS.items()
+        if getattr(email, STAGE_VERSION_COLUMNS[stage]) != prompts[prompt_type].version
+    ]
+    if email.category == "Uncategorized" and "categorize" not in stale:
+        stale.insert(0, "categorize")
+    if "categorize" in stale and "draft_reply" not in stale:
+        stale.append("draft_reply")
+    return stale
+
+def stale_emails_filter(prompts: PromptSnapshot):
+    """SQL counterpart of stale_stages(): matches emails with at least one stale stage."""
+    conditions = [models.Email.category == "Uncategorized"]
+    for stage, prompt_type in STAGE_PROMPTS.items():
+        column = getattr(models.Email, STAGE_VERSION_COLUMNS[stage])
+        conditions.append(column.is_(None))
+        conditions.append(column != prompts[prompt_type].version)
+    return or_(*conditions)
+
+def preclassified_triage(state: AgentState, stages: List[str], category: str) -> Dict[str, Any]:
+    """
+    The remaining stages for an email the pre-classifier already categorized, run by the same
+    nodes as the LLM path; only the categorize call is saved.
+    """
+    state["category"] = category
+    result = {"category": category}
+    for stage in ("extract_actions", "draft_reply"):
+        if stage not in stages:
+            continue
+        update = STAGE_NODES[stage](state)
+        state.update(update)
+        result.update(update)
+    return result
+
+def duplicate_triage(state: AgentState, stages: List[str], duplicate: NearDuplicate) -> Dict[str, Any]:
+    """
+    Outputs inherited from a near-duplicate email. When its numbers differ only the category is
+    inherited: action items and the draft are produced again for this email.
+    """
+    state["category"] = duplicate.category
+    result = {}
+    if "categorize" in stages:
+        result["category"] = duplicate.category
+    if "extract_actions" in stages:
+        update = ({"action_items": duplicate.action_items} if duplicate.action_items is not None
+                  else extract_actions_node(state))
+        state.update(update)
+        result.update(update)
+    if "draft_reply" in stages:
+        result.update({"draft": duplicate.draft} if duplicate.draft is not None else draft_reply_node(state))
+    return result
 
-def process_single_email(email: models.Email, db: Session):
-    cat_prompt = db.query(models.Prompt).filter_by(prompt_type="categorize").first()
-    act_prompt = db.query(models.Prompt).filter_by(prompt_type="extract_actions").first()
-    rep_prompt = db.query(models.Prompt).filter_by(prompt_type="auto_reply").first()
+def process_single_email(
+    email: models.Email,
+    db: Session,
+    mode: PipelineMode = "graph",
+    stages: Optional[List[str]] = None,
+    prompts: Optional[PromptSnapshot] = None,
+):
+    """
+    Runs the triage stages for one email. By default only the stale stages are rerun;
+    an email that is already up to date costs no LLM call.
+    """
+    prompts = prompts if prompts is not None else prompt_registry.snapshot(db)
 
-    if not cat_prompt or not act_prompt or not rep_prompt:
+    if any(prompt_type not in prompts for prompt_type in STAGE_PROMPTS.values()):
         print("Error: Prompts missing in DB. Run seed.py again.")
         return email
 
-    initial_state = {
+    if stages is None:
+        stages = stale_stages(email, prompts)
+    if not stages:
+        return email
+
+    state = {
         "email_body": email.body,
         "sender": email.sender,
-        "category": "",
-        "action_items": {"tasks": [], "suggestions": []},
-        "draft": "",
-        "categorize_prompt": cat_prompt.content,
-        "action_prompt": act_prompt.content,
-        "reply_prompt": rep_prompt.content
+        "category": email.category or "",
+        "action_items": email.action_items or {"tasks": [], "suggestions": []},
+        "draft": email.suggested_reply or "",
+        "categorize_prompt": prompts["categorize"].content,
+        "action_prompt": prompts["extract_actions"].content,
+        "reply_prompt": prompts["auto_reply"].content
     }
 
-    result = app_graph.invoke(initial_state)
-    email.category = result["category"]
-    email.action_items = result["action_items"]
-    email.suggested_reply = result["draft"]
+    # A near-duplicate of an email triaged with the same prompts answers for this one. Failing
+    # that, a confident local classification replaces the categorize call.
+    duplicate = prediction = None
+    if "categorize" in stages:
+        duplicate = near_duplicates.find(email, prompts, db)
+        metrics.NEAR_DUPLICATE_LOOKUPS.inc(result="miss" if duplicate is None else "hit")
+    if "categorize" in stages and duplicate is None:
+        prediction = preclassifier.predict(email, prompts["categorize"].version, db)
+    preclassified = prediction is not None and prediction.confident and not prediction.audit
+
+    if duplicate is not None:
+        result = duplicate_triage(state, stages, duplicate)
+    elif preclassified:
+        metrics.PRECLASSIFIER_DECISIONS.inc(result="hit")
+        result = preclassified_triage(state, stages, prediction.category)
+    elif len(stages) == len(STAGE_NODES):
+        result = None
+        if mode == "fused":
+            result = fused_triage(state)
+            if result is None:
+                print(f"Fused triage output invalid for email {email.id}, falling back to graph.")
+                metrics.LLM_RETRIES.inc(node="fused", reason="invalid_output")
+        if result is None:
+            result = app_graph.invoke(state)
+    else:
+        # Partial rerun: call only the invalidated nodes, in graph order.
+        result = {}
+        for stage in STAGE_NODES:
+            if stage in stages:
+                update = STAGE_NODES[stage](state)
+                state.update(update)
+                result.update(update)
+
+    if prediction is not None and not preclassified:
+        metrics.PRECLASSIFIER_DECISIONS.inc(result="audit" if prediction.audit else "low_confidence")
+    if "categorize" in stages and duplicate is None and not preclassified:
+        preclassifier.learn(email, result.get("category"), prompts["categorize"].version, prediction)
+
+    if "category" in result:
+        email.category = result["category"]
+        # The pre-classifier trains only on "llm" categories, never on its own or inherited ones.
+        email.category_source = ("near_duplicate" if duplicate is not None
+                                 else "preclassifier" if preclassified else "llm")
+    if "action_items" in result:
+        email.action_items = result["action_items"]
+    if "draft" in result:
+        email.suggested_reply = result["draft"]
+    for stage in stages:
+        setattr(email, STAGE_VERSION_COLUMNS[stage], prompts[STAGE_PROMPTS[stage]].version)
     
     db.commit()
     db.refresh(email)
@@ -214,18 +799,23 @@ def process_single_email(email: models.Email, db: Session):
 
     return email
 
-def chat_with_single_email(email_body: str, user_query: str, sender: str, history: list = []):
-    """
-    Chat Agent with Security Scope + RAG Memory.
-    """
-    
-    # 1. RAG Retrieval
-    related_docs = vector_store.similarity_search(user_query, k=2)
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize this part of a conversation between a user and an email assistant in 2-3 sentences. "
+    "Keep names, dates, decisions and open questions. Output only the summary."
+)
+
+def summarize_turns(turns) -> str:
+    """Summary of a block of older chat turns; cached by content, so each block is summarized once."""
+    transcript = "\n".join(f"{role}: {content}" for role, content in turns)
+    messages = [SystemMessage(content=HISTORY_SUMMARY_PROMPT), HumanMessage(content=transcript)]
+    return cached_llm_text("summarize_history", messages)
+
+def chat_system_prompt(sender: str, email_body: str, snippets: List[str]) -> str:
     rag_context = ""
-    if related_docs:
-        rag_context = "\n\n--- RELEVANT INFO FROM OTHER EMAILS ---\n" + "\n".join([d.page_content for d in related_docs])
+    if snippets:
+        rag_context = "\n\n--- RELEVANT INFO FROM OTHER EMAILS ---\n" + "\n".join(snippets)
 
-    system_prompt = (
+    return (
         f"You are an intelligent Email Assistant. "
         f"You are discussing an email sent by '{sender}'. "
         f"\n\n--- SECURITY & SCOPE ---\n"
@@ -236,16 +826,71 @@ def chat_with_single_email(email_body: str, user_query: str, sender: str, histor
         f"\n\n--- EMAIL CONTENT ---\n{email_body}"
         f"{rag_context}" 
     )
-    
+
+def build_chat_messages(email_body: str, user_query: str, sender: str, history: list = [],
+                        email_id: Optional[int] = None,
+                        retrieval: Optional[RetrievalMode] = None) -> Tuple[list, ContextReport]:
+    """
+    RAG retrieval + prompt assembly for the per-email chat, within the context token budget:
+    the email and retrieved snippets are trimmed first, history gets what is left.
+    """
+
+    # 1. RAG Retrieval (the email under discussion is already in the prompt, so it is excluded)
+    related_docs = retrieve(user_query, k=2, filters=SearchFilters(exclude_email_id=email_id), mode=retrieval)
+    report = ContextReport(budget=CONTEXT_TOKEN_BUDGET)
+    full, snippets = fit_context_docs(related_docs, user_query, report)
+    turns = [(msg.role, msg.content) for msg in history if msg.role in ("user", "assistant")]
+    report.tokens_before = (
+        message_tokens(chat_system_prompt(sender, email_body, full))
+        + sum(message_tokens(content) for _, content in turns)
+        + message_tokens(user_query)
+    )
+
+    # 2. Fixed part: instructions, the (capped) email and the snippets that fit
+    email_body = truncate_tokens(email_body, EMAIL_BODY_TOKENS)
+    system_prompt = chat_system_prompt(sender, email_body, snippets)
+    while snippets and message_tokens(system_prompt) + message_tokens(user_query) > CONTEXT_TOKEN_BUDGET:
+        snippets.pop()
+        report.dropped_snippets += 1
+        system_prompt = chat_system_prompt(sender, email_body, snippets)
+
+    # 3. History: recent turns verbatim, older ones summarized or dropped
+    history_budget = max(0, CONTEXT_TOKEN_BUDGET - message_tokens(system_prompt) - message_tokens(user_query))
+    summaries, kept, report.summarized_messages, report.dropped_messages = fit_history(
+        turns, history_budget, summarize_turns
+    )
+    if summaries:
+        system_prompt += "\n\n--- EARLIER IN THIS CONVERSATION ---\n" + "\n".join(summaries)
+
     messages = [SystemMessage(content=system_prompt)]
-    
-    for msg in history:
-        if msg.role == "user":
-            messages.append(HumanMessage(content=msg.content))
-        elif msg.role == "assistant":
-            messages.append(AIMessage(content=msg.content))
-            
+    for role, content in kept:
+        messages.append(HumanMessage(content=content) if role == "user" else AIMessage(content=content))
     messages.append(HumanMessage(content=user_query))
-    
-    response = llm.invoke(messages)
-    return response.content
\ No newline at end of file
+    return messages, record_context("chat", report, messages)
+
+def chat_with_single_email(email_body: str, user_query: str, sender: str, history: list = [],
+                           email_id: Optional[int] = None,
+                           retrieval: Optional[RetrievalMode] = None) -> Tuple[str, ContextReport]:
+    """
+    Chat Agent with Security Scope + RAG Memory.
+    """
+    messages, report = build_chat_messages(email_body, user_query, sender, history, email_id, retrieval)
+    response = call_llm(messages, "chat")
+    return response.content, report
+
+async def achat_with_single_email(email_body: str, user_query: str, sender: str, history: list = [],
+                                  email_id: Optional[int] = None,
+                                  retrieval: Optional[RetrievalMode] = None) -> Tuple[str, ContextReport]:
+    """Async chat_with_single_email. Retrieval is blocking I/O, so it runs in a worker thread."""
+    messages, report = await asyncio.to_thread(build_chat_messages, email_body, user_query, sender, history, email_id, retrieval)
+    response = await acall_llm(messages, "chat")
+    return response.content, report
+
+async def astream_chat_with_single_email(email_body: str, user_query: str, sender: str, history: list = [],
+                                         email_id: Optional[int] = None, retrieval: Optional[RetrievalMode] = None):
+    """
+    Streaming chat: retrieval finishes before this returns, the generator yields LLM tokens.
+    Returns (token generator, context report).
+    """
+    messages, report = await asyncio.to_thread(build_chat_messages, email_body, user_query, sender, history, email_id, retrieval)
+    return astream_llm(messages, "chat"), report
@@ -0,0 +1,95 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+from . import models, database
+from .agent import process_single_email, stale_stages, usage_snapshot, ingestion_buffer, PipelineMode
+from .prompt_registry import prompt_registry, PromptSnapshot
+from .preclassifier import preclassifier
+from .dedup import near_duplicates
+
+DEFAULT_MAX_WORKERS = int(os.getenv("PROCESS_MAX_WORKERS", "4"))
+
+
+def process_email_by_id(email_id: int, mode: PipelineMode, prompts: Optional[PromptSnapshot] = None) -> bool:
+    """
+    Worker: processes one email in its own DB session so commits don't contend on a shared session.
+    Returns False when the email is gone or already up to date with `prompts` (default: current).
+    """
+    db = database.SessionLocal()
+    try:
+        email = db.query(models.Email).filter(models.Email.id == email_id).first()
+        if not email:
+            return False
+        prompts = prompts or prompt_registry.snapshot(db)
+        stages = stale_stages(email, prompts)
+        if not stages:
+            return False
+        process_single_email(email, db, mode=mode, stages=stages, prompts=prompts)
+        return True
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def process_emails_concurrently(
+    email_ids: List[int], max_workers: Optional[int] = None, mode: PipelineMode = "graph",
+    prompts: Optional[PromptSnapshot] = None
+):
+    """
+    Runs the agent over `email_ids` with bounded parallelism.
+    A failing email is recorded and never aborts the rest of the batch. The whole batch uses
+    one prompt snapshot, so a prompt edited mid-run applies to the next run, not half of this one.
+    """
+    workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    prompts = prompts or prompt_registry.snapshot()
+    processed = 0
+    skipped = 0
+    errors = []
+    usage_before = usage_snapshot()
+    preclassified_before = preclassifier.snapshot()["hits"]
+    duplicates_before = near_duplicates.snapshot()["hits"]
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each worker runs in a copy of this context, i.e. against the caller's tenant.
+        futures = {
+            pool.submit(contextvars.copy_context().run, process_email_by_id, email_id, mode, prompts): email_id
+            for email_id in email_ids
+        }
+        for future in as_completed(futures):
+            email_id = futures[future]
+            try:
+                if future.result():
+                    processed += 1
+                else:
+                    skipped += 1
+            except Exception as e:
+                print(f"Error processing {email_id}: {e}")
+                errors.append({"email_id": email_id, "error": str(e)})
+
+    # Embed whatever the workers queued in one batched pass.
+    ingestion_buffer.flush()
+
+    elapsed = time.perf_counter() - started
+    usage_after = usage_snapshot()
+    return {
+        "mode": mode,
+        "prompt_versions": {prompt_type: entry.version for prompt_type, entry in prompts.prompts.items()},
+        "processed": processed,
+        "skipped": skipped,
+        "failed": len(errors),
+        "errors": errors,
+        "workers": workers,
+        "elapsed_seconds": round(elapsed, 3),
+        "emails_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+        # Process-wide counters: concurrent batches or chats overlap in these deltas.
+        "llm_usage": {key: usage_after[key] - usage_before[key] for key in usage_after},
+        "preclassified": preclassifier.snapshot()["hits"] - preclassified_before,
+        # Emails that inherited the triage of a near-duplicate instead of calling the LLM.
+        "near_duplicates": near_duplicates.snapshot()["hits"] - duplicates_before,
+    }
@@ -0,0 +1,170 @@
+"""
+Token budgeting for the chat and compose prompts.
+
+Tokens are counted with tiktoken when its encoding can be loaded, otherwise estimated at
+~4 characters per token. Retrieved emails are cut down to the passages most relevant to the
+query, and conversation history is fitted newest first: older turns are replaced by
+summaries of fixed-size blocks (so each block is summarized once and then served from the
+LLM cache), and dropped once even the summaries don't fit.
+"""
+import os
+import re
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# Prompt tokens allowed per chat/compose request, history and retrieved context included.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Caps on the email under discussion and on each retrieved email.
+EMAIL_BODY_TOKENS = int(os.getenv("EMAIL_BODY_TOKENS", "2500"))
+RAG_SNIPPET_TOKENS = int(os.getenv("RAG_SNIPPET_TOKENS", "200"))
+# Older turns are summarized this many messages at a time; 0 drops them instead.
+HISTORY_SUMMARY_BLOCK = int(os.getenv("HISTORY_SUMMARY_BLOCK", "6"))
+# Tokens held back from verbatim turns for block summaries once the history overflows, and
+# the size a single summary (2-3 sentences) is assumed to need before it is requested.
+HISTORY_SUMMARY_RESERVE = int(os.getenv("HISTORY_SUMMARY_RESERVE", "300"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "100"))
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+MESSAGE_OVERHEAD = 4  # role and separators per chat message
+ELLIPSIS = " [...]"
+_WORD = re.compile(r"[a-z0-9]+")
+_PASSAGE_SPLIT = re.compile(r"\n\s*\n|(?<=[.!?])\s+(?=[A-Z0-9])")
+_STOPWORDS = {"the", "and", "for", "are", "was", "what", "when", "who", "how", "did", "does", "this",
+              "that", "with", "from", "you", "about", "have", "has", "any", "can", "there", "their"}
+
+_encoding = None
+_encoding_checked = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_checked
+    if not _encoding_checked:
+        _encoding_checked = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:  # not installed, or the encoding file can't be downloaded
+            print(f"Token counting falls back to a character estimate: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The head of `text` within `max_tokens`, marked with an ellipsis when cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    keep = max(0, max_tokens - count_tokens(ELLIPSIS))
+    if encoding is None:
+        return text[:keep * 4].rstrip() + ELLIPSIS
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:keep]).rstrip() + ELLIPSIS
+
+
+def _terms(text: str) -> set:
+    return {word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in _STOPWORDS}
+
+
+def relevant_passages(text: str, query: str, max_tokens: int) -> str:
+    """
+    Paragraphs/sentences of `text` sharing the most terms with `query`, in document order,
+    within `max_tokens`. Text that already fits is returned unchanged.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    passages = [passage.strip() for passage in _PASSAGE_SPLIT.split(text) if passage.strip()]
+    query_terms = _terms(query)
+    ranked = sorted(range(len(passages)), key=lambda i: (-len(query_terms & _terms(passages[i])), i))
+    chosen, used = [], 0
+    for i in ranked:
+        cost = count_tokens(passages[i]) + 2
+        if used + cost > max_tokens:
+            continue
+        chosen.append(i)
+        used += cost
+    if not chosen:
+        return truncate_tokens(passages[ranked[0]], max_tokens)
+    return " ... ".join(passages[i] for i in sorted(chosen))
+
+
+Turn = Tuple[str, str]  # (role, content)
+
+
+def message_tokens(content: str) -> int:
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+def fit_history(turns: Sequence[Turn], budget: int,
+                summarize: Optional[Callable[[Sequence[Turn]], str]] = None) -> Tuple[List[str], List[Turn], int, int]:
+    """
+    Fits a conversation into `budget` tokens. Returns (summaries of older blocks, oldest first;
+    the turns kept verbatim; messages summarized; messages dropped). Only complete blocks of
+    HISTORY_SUMMARY_BLOCK messages, counted from the start of the conversation, are summarized,
+    so a block's summary never changes. What is sent is always a contiguous tail of the
+    conversation: anything dropped is older than everything kept or summarized.
+    """
+    costs = [message_tokens(content) for _, content in turns]
+    if sum(costs) <= budget:
+        return [], list(turns), 0, 0
+    summarizing = summarize is not None and HISTORY_SUMMARY_BLOCK > 0
+    # Once the history overflows, part of the budget is held back for the summaries.
+    reserve = min(HISTORY_SUMMARY_RESERVE, budget // 2) if summarizing else 0
+
+    start, used = len(turns), 0
+    while start > 0 and used + costs[start - 1] <= budget - reserve:
+        start -= 1
+        used += costs[start]
+    if summarizing:
+        # Turns between the last complete block and the kept ones go verbatim when they fit,
+        # otherwise the oldest kept turns join them to complete the block. When neither works,
+        # nothing is summarized: a summary must end right where the kept turns begin.
+        leftover = start % HISTORY_SUMMARY_BLOCK
+        end = start - leftover + HISTORY_SUMMARY_BLOCK
+        if leftover and used + sum(costs[start - leftover:start]) <= budget:
+            used += sum(costs[start - leftover:start])
+            start -= leftover
+        elif leftover and end <= len(turns):
+            used -= sum(costs[start:end])
+            start = end
+
+    summaries: List[str] = []
+    summarized = 0
+    if summarizing and start % HISTORY_SUMMARY_BLOCK == 0:
+        for block in reversed(range(start // HISTORY_SUMMARY_BLOCK)):  # newest block first
+            # Checked before the call, so a block that can't fit costs no summarization.
+            if used + HISTORY_SUMMARY_TOKENS > budget:
+                break
+            first = block * HISTORY_SUMMARY_BLOCK
+            summary = summarize(turns[first:first + HISTORY_SUMMARY_BLOCK])
+            cost = count_tokens(summary) + 2
+            if used + cost > budget:
+                break
+            summaries.insert(0, summary)
+            summarized += HISTORY_SUMMARY_BLOCK
+            used += cost
+    return summaries, list(turns[start:]), summarized, start - summarized
+
+
+@dataclass
+class ContextReport:
+    """Per-request accounting: what the untrimmed prompt would have cost vs. what was sent."""
+    budget: int
+    tokens_before: int = 0
+    tokens_after: int = 0
+    trimmed_snippets: int = 0
+    dropped_snippets: int = 0
+    summarized_messages: int = 0
+    dropped_messages: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_before - self.tokens_after)
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "tokens_saved": self.tokens_saved}
@@ -0,0 +1,166 @@
+"""
+Near-duplicate detection, so recurring newsletters, alerts and mass notices reuse an earlier triage.
+
+Each email gets a 64-bit SimHash of its word 3-shingles (digits folded to 0, so dates and
+reference numbers don't count). The hash is split into four 16-bit bands stored in indexed
+columns: two hashes within 3 bits of each other always share a band, so candidates come
+from an index lookup instead of a scan. Emails with fewer than SIMHASH_MIN_SHINGLES shingles
+get no fingerprint: a handful of shingles collides too easily.
+
+An email close enough to one already triaged with the current prompts inherits its category.
+Action items and drafts quote dates, times and amounts, so they are inherited (and the draft
+optionally reused) only when both emails carry the same numbers.
+"""
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .prompt_registry import PromptSnapshot
+
+NEAR_DUPLICATES_ENABLED = os.getenv("NEAR_DUPLICATES_ENABLED", "1") == "1"
+# Max differing bits; above BANDS - 1 some matches can be missed by the band lookup.
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))
+# Reuse the duplicate's draft as well (same template), instead of drafting a fresh reply.
+NEAR_DUPLICATE_REUSE_DRAFT = os.getenv("NEAR_DUPLICATE_REUSE_DRAFT", "0") == "1"
+# Distinct shingles needed before an email is fingerprinted at all.
+SIMHASH_MIN_SHINGLES = int(os.getenv("SIMHASH_MIN_SHINGLES", "8"))
+MAX_CANDIDATES = 50
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+SHINGLE_SIZE = 3
+_MASK = (1 << BITS) - 1
+_WORD = re.compile(r"[a-z0-9]+")
+_DIGIT = re.compile(r"\d")
+_NUMBER = re.compile(r"\d+")
+_BIT_POSITIONS = np.arange(BITS, dtype=np.uint64)
+
+
+def simhash(text: str, min_shingles: int = SIMHASH_MIN_SHINGLES) -> Optional[int]:
+    """Unsigned 64-bit SimHash of the text's distinct word 3-shingles; None below `min_shingles`."""
+    words = _WORD.findall(_DIGIT.sub("0", (text or "").lower()))
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    shingles.discard("")
+    if not shingles or len(shingles) < min_shingles:
+        return None
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    hashes = np.frombuffer(digests, dtype="<u8")
+    ones = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).sum(axis=0).astype(np.int64)
+    value = 0
+    for bit in np.nonzero(ones * 2 > len(hashes))[0]:
+        value |= 1 << int(bit)
+    return value
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK).count("1")
+
+
+def numbers(subject: Optional[str], body: Optional[str]) -> List[str]:
+    """The digit runs SimHash folds away, in order."""
+    return _NUMBER.findall(f"{subject or ''}\n{body or ''}")
+
+
+def fingerprint_columns(subject: Optional[str], body: Optional[str]) -> Dict[str, Optional[int]]:
+    """Email column values: the SimHash and its LSH bands, all None for a too short email."""
+    value = simhash(f"{subject or ''}\n{body or ''}")
+    if value is None:
+        return {"simhash": None, **{f"simhash_band_{band}": None for band in range(BANDS)}}
+    columns = {"simhash": _signed(value)}
+    for band in range(BANDS):
+        columns[f"simhash_band_{band}"] = (value >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)
+    return columns
+
+
+@dataclass(frozen=True)
+class NearDuplicate:
+    email_id: int
+    distance: int
+    category: str
+    action_items: Optional[Dict[str, Any]]  # None when the numbers differ: extract_actions reruns
+    draft: Optional[str]  # None unless the numbers match, draft reuse is on and the draft is current
+
+
+class NearDuplicateFinder:
+    """Band lookup plus exact Hamming check, with lookup/hit counters."""
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE, reuse_draft: bool = NEAR_DUPLICATE_REUSE_DRAFT,
+                 enabled: bool = NEAR_DUPLICATES_ENABLED):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.reuse_draft = reuse_draft
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "category_only": 0, "reused_drafts": 0}
+
+    def find(self, email: models.Email, prompts: PromptSnapshot, db: Session) -> Optional[NearDuplicate]:
+        """
+        The closest email already categorized and action-extracted with the current prompt
+        versions, if within `max_distance` bits. Fingerprints `email` first when needed.
+        """
+        if not self.enabled:
+            return None
+        if email.simhash is None:
+            for column, value in fingerprint_columns(email.subject, email.body).items():
+                setattr(email, column, value)
+        if email.simhash is None:
+            with self._lock:
+                self.stats["lookups"] += 1
+            return None
+
+        bands = [getattr(models.Email, f"simhash_band_{band}") == getattr(email, f"simhash_band_{band}")
+                 for band in range(BANDS)]
+        rows = db.execute(
+            select(models.Email.id, models.Email.simhash, models.Email.subject, models.Email.body,
+                   models.Email.category, models.Email.action_items, models.Email.suggested_reply,
+                   models.Email.auto_reply_prompt_version)
+            .where(or_(*bands))
+            .where(models.Email.id != email.id)
+            .where(models.Email.categorize_prompt_version == prompts["categorize"].version)
+            .where(models.Email.extract_actions_prompt_version == prompts["extract_actions"].version)
+            .order_by(models.Email.id.desc())
+            .limit(MAX_CANDIDATES)
+        ).all()
+
+        best = None
+        for row in rows:
+            distance = hamming(email.simhash, row.simhash)
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, row)
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            if best is None:
+                return None
+            self.stats["hits"] += 1
+            distance, row = best
+            if numbers(email.subject, email.body) != numbers(row.subject, row.body):
+                self.stats["category_only"] += 1
+                return NearDuplicate(row.id, distance, row.category, None, None)
+            draft_current = row.auto_reply_prompt_version == prompts["auto_reply"].version
+            draft = row.suggested_reply if self.reuse_draft and draft_current else None
+            if draft is not None:
+                self.stats["reused_drafts"] += 1
+        return NearDuplicate(row.id, distance, row.category, row.action_items or {}, draft)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        return {**stats, "hit_rate": round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0,
+                "max_distance": self.max_distance, "reuse_draft": self.reuse_draft}
+
+
+near_duplicates = NearDuplicateFinder()
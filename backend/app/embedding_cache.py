@@ -0,0 +1,62 @@
+import hashlib
+import threading
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from . import models, database
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent cache keyed by content hash, so text that was
+    embedded once (e.g. an unchanged email after a reprocess or reset) is never sent again.
+    Queries are passed through untouched.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str):
+        self.underlying = underlying
+        self.model = model
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()  # batches are embedded from worker threads
+        database.CacheBase.metadata.create_all(bind=database.cache_engine)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}|{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = {}
+        db = database.CacheSessionLocal()
+        try:
+            for entry in db.query(models.EmbeddingCacheEntry).filter(models.EmbeddingCacheEntry.key.in_(set(keys))):
+                found[entry.key] = array("f", entry.vector).tolist()
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            if missing:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+                rows = []
+                for key, vector in zip(missing.keys(), vectors):
+                    found[key] = vector
+                    rows.append({"key": key, "model": self.model, "vector": array("f", vector).tobytes()})
+                # Another batch may have stored the same text meanwhile; the vectors are identical.
+                db.execute(database.dialect_insert(models.EmbeddingCacheEntry, database.cache_engine).on_conflict_do_nothing(), rows)
+                db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            self.stats["misses"] += len(missing)
+            self.stats["hits"] += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
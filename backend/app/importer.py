@@ -0,0 +1,244 @@
+"""
+Streaming mbox / .eml importer.
+
+Messages are parsed one at a time from a generator and inserted in chunks with a Core
+executemany, so memory stays flat however large the export is. Emails are deduplicated by
+Message-ID (a content hash stands in when the header is missing). From the backend directory:
+
+    python -m app.importer ~/exports/inbox.mbox --chunk-size 2000 --ingest --process
+"""
+import argparse
+import hashlib
+import html
+import os
+import re
+import time
+from datetime import datetime, timezone
+from email import policy
+from email.header import decode_header, make_header
+from email.message import Message
+from email.parser import BytesParser
+from email.utils import parseaddr, parsedate_to_datetime
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+
+from . import models, database, migrations, tenants
+from .dedup import fingerprint_columns
+from .retrieval_cache import index_generation
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+_ESCAPED_FROM = re.compile(rb"^>+From ")
+_TAG = re.compile(r"<[^>]+>")
+# compat32 parses headers lazily; the default policy's header registry costs most of the import time.
+_parser = BytesParser(policy=policy.compat32)
+
+
+def iter_mbox(fileobj: BinaryIO) -> Iterator[bytes]:
+    """Yields the raw bytes of each message in an mbox stream, reading line by line."""
+    lines: List[bytes] = []
+    previous_blank = True
+    for line in fileobj:
+        blank = not line.strip()
+        if previous_blank and line.startswith(b"From "):
+            if lines:
+                yield b"".join(lines)
+            lines = []
+        else:
+            if _ESCAPED_FROM.match(line):  # mboxrd quoting of body lines starting with "From "
+                line = line[1:]
+            lines.append(line)
+        previous_blank = blank
+    if lines:
+        yield b"".join(lines)
+
+
+def iter_path(path: str) -> Iterator[bytes]:
+    """Raw messages from an .eml file, an mbox file, or a directory tree of either."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield from iter_path(os.path.join(root, name))
+        return
+    with open(path, "rb") as f:
+        if path.lower().endswith(".eml"):
+            yield f.read()
+        else:
+            yield from iter_mbox(f)
+
+
+def _header(message: Message, name: str) -> str:
+    value = message.get(name)
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value))).strip()
+    except Exception:
+        return str(value).strip()
+
+
+def _decode_part(part: Message) -> str:
+    payload = part.get_payload(decode=True) or b""
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _body_text(message: Message) -> str:
+    """First text/plain part, else the first text/html part with tags stripped."""
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_maintype() != "text":
+            continue
+        if part.get_content_subtype() == "plain":
+            return _decode_part(part).strip()
+        if part.get_content_subtype() == "html" and html_part is None:
+            html_part = part
+    if html_part is None:
+        return ""
+    return html.unescape(_TAG.sub(" ", _decode_part(html_part))).strip()
+
+
+def _timestamp(message: Message) -> datetime:
+    try:
+        parsed = parsedate_to_datetime(message.get("Date", ""))
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_message(raw: bytes) -> Optional[Dict]:
+    """Row values for the emails table, or None if the bytes are not a usable message."""
+    try:
+        message = _parser.parsebytes(raw)
+        sender = _header(message, "From")
+        subject = _header(message, "Subject")
+        body = _body_text(message)
+        timestamp = _timestamp(message)
+        message_id = _header(message, "Message-ID")
+    except Exception as e:
+        print(f"Import: skipping unparsable message: {e}")
+        return None
+    if not (sender or subject or body):
+        return None
+    if not message_id:
+        message_id = "<" + hashlib.sha256(raw).hexdigest() + "@generated>"
+    return {
+        "message_id": message_id,
+        "sender": parseaddr(sender)[1] or sender,
+        "subject": subject,
+        "body": body,
+        "timestamp": timestamp,
+        "category": "Uncategorized",
+        "action_items": {},
+        "is_read": False,
+        **fingerprint_columns(subject, body),
+    }
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_messages(raw_messages: Iterable[bytes], chunk_size: Optional[int] = None,
+                    ingest: bool = False, collect_ids: bool = False) -> Dict:
+    """
+    Inserts parsed messages in chunks, skipping Message-IDs already stored. With `ingest`
+    each chunk is also embedded into the vector store; `collect_ids` returns the new email ids
+    (e.g. to queue them for processing).
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    stats = {"parsed": 0, "inserted": 0, "duplicates": 0, "failed": 0}
+    new_ids: List[int] = []
+    started = time.perf_counter()
+    if ingest:
+        from .agent import ingest_emails  # loads the LLM and vector store; only needed here
+
+    for chunk in _chunks(iter(raw_messages), chunk_size):
+        rows = {}
+        for raw in chunk:
+            row = parse_message(raw)
+            if row is None:
+                stats["failed"] += 1
+                continue
+            stats["parsed"] += 1
+            if row["message_id"] in rows:
+                stats["duplicates"] += 1
+                continue
+            rows[row["message_id"]] = row
+
+        db = database.SessionLocal()
+        try:
+            existing = set(db.scalars(
+                select(models.Email.message_id).where(models.Email.message_id.in_(list(rows)))
+            ))
+            fresh = [row for message_id, row in rows.items() if message_id not in existing]
+            stats["duplicates"] += len(rows) - len(fresh)
+            if fresh:
+                # Core executemany; ON CONFLICT covers a concurrent import of the same export.
+                db.execute(database.dialect_insert(models.Email, db.get_bind()).on_conflict_do_nothing(index_elements=["message_id"]), fresh)
+                db.commit()
+                just_inserted = models.Email.message_id.in_([row["message_id"] for row in fresh])
+                if ingest:
+                    emails = db.scalars(select(models.Email).where(just_inserted)).all()
+                    ingest_emails(emails)
+                    ids = [email.id for email in emails]
+                else:
+                    ids = db.scalars(select(models.Email.id).where(just_inserted)).all()
+                stats["inserted"] += len(ids)
+                if collect_ids:
+                    new_ids.extend(ids)
+                index_generation.bump()
+        finally:
+            db.close()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["messages_per_second"] = round(stats["parsed"] / elapsed, 1) if elapsed > 0 else 0.0
+    if collect_ids:
+        stats["new_ids"] = new_ids
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="An mbox file, an .eml file, or a directory of them.")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="Rows per executemany insert.")
+    parser.add_argument("--ingest", action="store_true", help="Embed new emails into the vector store.")
+    parser.add_argument("--process", action="store_true", help="Run the triage agent on new emails.")
+    parser.add_argument("--user", help="Import into this user's mailbox (the X-User-Id of the api).")
+    args = parser.parse_args()
+
+    with tenants.use(tenants.tenant_key(args.user)):
+        _import(args)
+
+
+def _import(args):
+    migrations.upgrade(database.engine)
+
+    stats = import_messages(iter_path(args.path), args.chunk_size, ingest=args.ingest, collect_ids=args.process)
+    new_ids = stats.pop("new_ids", [])
+    print(f"Imported {stats['inserted']} emails ({stats['duplicates']} duplicates, {stats['failed']} unparsable) "
+          f"in {stats['elapsed_seconds']}s")
+    if args.process and new_ids:
+        from .batch import process_emails_concurrently
+
+        result = process_emails_concurrently(new_ids)
+        print(f"Processed {result['processed']} emails ({result['failed']} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import itertools
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from . import models, database, tenants
+from .agent import ingestion_buffer, PipelineMode
+from .batch import process_email_by_id
+from .prompt_registry import prompt_registry, PromptSnapshot
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", os.getenv("PROCESS_MAX_WORKERS", "4")))
+INTERACTIVE_PRIORITY = 0
+BULK_PRIORITY = 10
+
+
+class JobManager:
+    """
+    Persistent background processing. A job is a row in `jobs` with one `job_items` row per
+    email; workers pull individual emails from a priority queue, so an interactive job
+    (priority 0) is served before the remaining emails of a bulk backfill. Unfinished items
+    are re-queued on startup, or when their tenant is opened. Queued items keep their tenant
+    open, and are processed as that tenant.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()  # FIFO order within a priority
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        # Striped per-email locks: the same email queued by two jobs is processed once, and the
+        # second worker then finds it up to date.
+        self._email_locks = [threading.Lock() for _ in range(64)]
+        # Prompt snapshot per (tenant, job), taken at submission, so a job runs on one prompt
+        # version. Jobs resumed after a restart take the snapshot current at that point.
+        self._prompts: Dict[Tuple[str, int], PromptSnapshot] = {}
+        self._resumed = set()  # tenants whose unfinished jobs are queued
+        self._hooked = False
+
+    # --- lifecycle ---
+
+    def start(self):
+        """Starts the workers and re-queues the pending items of unfinished jobs."""
+        self._stop.clear()
+        if not self._hooked:
+            tenants.registry.on_open(lambda tenant: self.resume())
+            tenants.registry.on_close(self._resumed.discard)
+            self._hooked = True
+        with tenants.activate(tenants.DEFAULT_TENANT):
+            self.resume()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def resume(self) -> int:
+        """Re-queues the current tenant's unfinished jobs, once per opening of the tenant."""
+        tenant = tenants.current_tenant.get()
+        with self._lock:
+            if tenant in self._resumed:
+                return 0
+            self._resumed.add(tenant)
+        db = database.SessionLocal()
+        try:
+            jobs = db.query(models.Job).filter(models.Job.status.in_(["queued", "running"])).all()
+            for job in jobs:
+                pending = db.query(models.JobItem.email_id).filter(
+                    models.JobItem.job_id == job.id, models.JobItem.status == "pending"
+                )
+                for (email_id,) in pending:
+                    self._enqueue(job, email_id)
+                print(f"Resuming job {job.id} ({job.kind})")
+            return len(jobs)
+        finally:
+            db.close()
+
+    def _enqueue(self, job: models.Job, email_id: int):
+        tenant = tenants.current_tenant.get()
+        tenants.registry.acquire(tenant)  # released once the item is done or dropped
+        self._queue.put((job.priority, next(self._seq), tenant, job.id, job.mode, email_id))
+
+    # --- submission / control ---
+
+    def submit(self, kind: str, email_ids: List[int], mode: PipelineMode = "graph",
+               priority: int = BULK_PRIORITY, prompts: Optional[PromptSnapshot] = None) -> models.Job:
+        db = database.SessionLocal()
+        try:
+            job = models.Job(kind=kind, mode=mode, priority=priority, total=len(email_ids),
+                             status="queued" if email_ids else "completed",
+                             finished_at=None if email_ids else datetime.utcnow())
+            db.add(job)
+            db.flush()
+            db.add_all(models.JobItem(job_id=job.id, email_id=email_id) for email_id in email_ids)
+            db.commit()
+            db.refresh(job)
+            db.expunge(job)
+        finally:
+            db.close()
+        if email_ids:
+            with self._lock:
+                self._prompts[(tenants.current_tenant.get(), job.id)] = prompts or prompt_registry.snapshot()
+        for email_id in email_ids:
+            self._enqueue(job, email_id)
+        return job
+
+    def _job_prompts(self, job_id: int) -> PromptSnapshot:
+        key = (tenants.current_tenant.get(), job_id)
+        with self._lock:
+            prompts = self._prompts.get(key)
+        if prompts is None:
+            prompts = prompt_registry.snapshot()
+            with self._lock:
+                prompts = self._prompts.setdefault(key, prompts)
+        return prompts
+
+    def cancel(self, job_id: int) -> bool:
+        db = database.SessionLocal()
+        try:
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            if not job or job.status in ("completed", "cancelled"):
+                return False
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+        key = (tenants.current_tenant.get(), job_id)
+        with self._lock:
+            self._cancelled.add(key)
+            self._prompts.pop(key, None)
+        return True
+
+    def clear(self):
+        """Drops the current tenant's queued items (used before its jobs table is wiped by a reset)."""
+        tenant = tenants.current_tenant.get()
+        kept = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[2] == tenant:
+                tenants.registry.release(tenant)
+            else:
+                kept.append(item)
+        for item in kept:
+            self._queue.put(item)
+        with self._lock:
+            self._cancelled = {key for key in self._cancelled if key[0] != tenant}
+            self._prompts = {key: value for key, value in self._prompts.items() if key[0] != tenant}
+
+    # --- workers ---
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                _, _, tenant, job_id, mode, email_id = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                with self._lock:
+                    if (tenant, job_id) in self._cancelled:
+                        continue
+                with tenants.activate(tenant):
+                    self._run_item(job_id, mode, email_id)
+            finally:
+                tenants.registry.release(tenant)
+
+    def _run_item(self, job_id: int, mode: PipelineMode, email_id: int):
+        db = database.SessionLocal()
+        try:
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            if not job or job.status == "cancelled":
+                return
+            if job.status == "queued":
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+        status, error = "processed", None
+        try:
+            stripe = hash((tenants.current_tenant.get(), email_id)) % len(self._email_locks)
+            with self._email_locks[stripe]:
+                if not process_email_by_id(email_id, mode, self._job_prompts(job_id)):
+                    status = "skipped"
+        except Exception as e:
+            print(f"Job {job_id}: error processing {email_id}: {e}")
+            status, error = "failed", str(e)
+
+        db = database.SessionLocal()
+        try:
+            db.query(models.JobItem).filter(
+                models.JobItem.job_id == job_id, models.JobItem.email_id == email_id
+            ).update({"status": status, "error": error})
+            remaining = db.query(models.JobItem).filter(
+                models.JobItem.job_id == job_id, models.JobItem.status == "pending"
+            ).count()
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            finished = remaining == 0 and job is not None and job.status == "running"
+            if finished:
+                job.status = "completed"
+                job.finished_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+        if finished:
+            with self._lock:
+                self._prompts.pop((tenants.current_tenant.get(), job_id), None)
+            ingestion_buffer.flush()
+
+    # --- reporting ---
+
+    def progress(self, job_id: int) -> Optional[dict]:
+        db = database.SessionLocal()
+        try:
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            if not job:
+                return None
+            counts = dict(
+                db.query(models.JobItem.status, func.count(models.JobItem.id))
+                .filter(models.JobItem.job_id == job_id)
+                .group_by(models.JobItem.status)
+            )
+            errors = [
+                {"email_id": email_id, "error": error}
+                for email_id, error in db.query(models.JobItem.email_id, models.JobItem.error)
+                .filter(models.JobItem.job_id == job_id, models.JobItem.status == "failed")
+            ]
+        finally:
+            db.close()
+
+        done = counts.get("processed", 0) + counts.get("skipped", 0) + counts.get("failed", 0)
+        elapsed = None
+        if job.started_at:
+            elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "mode": job.mode,
+            "priority": job.priority,
+            "status": job.status,
+            "total": job.total,
+            "done": done,
+            "processed": counts.get("processed", 0),
+            "skipped": counts.get("skipped", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "progress": round(done / job.total, 4) if job.total else 1.0,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "emails_per_second": round(done / elapsed, 3) if elapsed else None,
+            "errors": errors,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+job_manager = JobManager()
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import select
+
+from . import models, database
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    """
+    Content-addressed cache of LLM node results.
+    An in-memory LRU sits in front of the `llm_cache` table in cache.db; the table is trimmed
+    back to `max_entries` (least recently used first) every `evict_every` writes.
+    """
+
+    def __init__(
+        self, memory_size: int = 1024, max_entries: int = 50000, evict_every: int = 64, enabled: bool = True
+    ):
+        self.enabled = enabled
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        database.CacheBase.metadata.create_all(bind=database.cache_engine)
+
+    @staticmethod
+    def make_key(node: str, model: str, prompt: str, payload: str) -> str:
+        """Key = hash of node name, model, prompt content hash and email content hash."""
+        return _sha256(f"{node}|{model}|{_sha256(prompt)}|{_sha256(payload)}")
+
+    def _remember(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        db = database.CacheSessionLocal()
+        try:
+            entry = db.query(models.LLMCacheEntry).filter(models.LLMCacheEntry.key == key).first()
+            if entry is None:
+                with self._lock:
+                    self.stats["misses"] += 1
+                return None
+            entry.last_accessed = datetime.utcnow()
+            value = entry.value
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            self.stats["db_hits"] += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, node: str, model: str, value: Any):
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        db = database.CacheSessionLocal()
+        try:
+            # Upsert: two workers may finish the same prompt/email concurrently.
+            statement = database.dialect_insert(models.LLMCacheEntry, database.cache_engine).values(
+                key=key, node=node, model=model, value=value, created_at=now, last_accessed=now
+            ).on_conflict_do_update(index_elements=["key"], set_={"value": value, "last_accessed": now})
+            db.execute(statement)
+            db.commit()
+        except Exception as e:
+            # A cache write must never fail the triage run.
+            print(f"LLM cache write failed: {e}")
+            return
+        finally:
+            db.close()
+
+        with self._lock:
+            self.stats["writes"] += 1
+            self._remember(key, value)
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= self.evict_every
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self._evict()
+
+    def _evict(self):
+        db = database.CacheSessionLocal()
+        try:
+            overflow = db.query(models.LLMCacheEntry).count() - self.max_entries
+            if overflow <= 0:
+                return
+            stale = (
+                select(models.LLMCacheEntry.key)
+                .order_by(models.LLMCacheEntry.last_accessed.asc())
+                .limit(overflow)
+            )
+            removed = (
+                db.query(models.LLMCacheEntry)
+                .filter(models.LLMCacheEntry.key.in_(stale))
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            self.stats["evictions"] += removed
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["db_hits"] + self.stats["misses"]
+            hits = self.stats["memory_hits"] + self.stats["db_hits"]
+            return {
+                "enabled": self.enabled,
+                **self.stats,
+                "memory_entries": len(self._memory),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+llm_cache = LLMResultCache(
+    memory_size=int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024")),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000")),
+    enabled=os.getenv("LLM_CACHE_ENABLED", "1") == "1",
+)
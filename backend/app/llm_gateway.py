@@ -0,0 +1,621 @@
+"""
+LLM gateway: every triage node, chat and compose call goes through one pool of providers.
+
+Providers are tried in LLM_PROVIDERS order (Groq, then OpenAI or a local OpenAI-compatible
+server when configured). Each has its own quota, concurrency cap, timeout and circuit breaker.
+A rate-limited, timed-out or failing call moves on to the next healthy provider, and once every
+provider has failed the round is retried with exponential backoff. A provider whose own rpm/tpm
+quota is used up counts as rate-limited without a request being sent; when every provider is
+only throttled that way, the call waits for the first quota to free up instead of failing.
+With LLM_HEDGE=1 a call that is slower than its provider's p95 gets a second, backup request;
+the first answer wins.
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from . import metrics
+from .metrics import span
+from .rate_limit import RateLimiter
+
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "groq,openai")
+LLM_TEMPERATURE = 0.6
+# Per attempt; streams apply it to the wait for each chunk.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Consecutive failures that take a provider out of rotation, and for how long.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+# Fixed hedging delay; 0 = the provider's observed p95, once it has enough samples.
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Completion tokens reserved against every provider's tpm quota, settled from the actual usage.
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", os.getenv("GROQ_COMPLETION_TOKEN_ESTIMATE", "512")))
+
+RETRYABLE = ("rate_limit", "timeout", "unavailable")
+
+
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (~4 chars per token) plus the reserved completion."""
+    return sum(len(m.content) for m in messages) // 4 + LLM_COMPLETION_TOKEN_ESTIMATE
+
+
+def classify(error: BaseException) -> str:
+    """
+    'rate_limit', 'timeout' and 'unavailable' (5xx, connection errors) are worth retrying;
+    anything else ('error': bad request, auth, a bug) fails over without retrying the provider.
+    """
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "timeout"
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return "rate_limit"
+    if (status is not None and (status >= 500 or status == 408)) or "Connection" in type(error).__name__:
+        return "unavailable"
+    return "error"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The provider's Retry-After hint, in seconds, if the error carries one."""
+    if isinstance(error, QuotaExhausted):
+        return error.wait
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+
+class QuotaExhausted(Exception):
+    """The provider's local rpm/tpm quota has no room: treated like a 429, but nothing was sent."""
+    status_code = 429
+
+    def __init__(self, provider: str, wait: float):
+        super().__init__(f"{provider} quota exhausted for {wait:.1f}s")
+        self.wait = wait
+
+
+class AttemptFailed(Exception):
+    """Every request of one attempt failed: the primary's, and the hedge's if one was sent."""
+
+    def __init__(self, failures: List[Tuple["Provider", Exception]]):
+        super().__init__("; ".join(f"{provider.name}: {error}" for provider, error in failures))
+        self.failures = failures
+
+
+class Provider:
+    """
+    One chat model behind the gateway, with its own quota (rpm/tpm), concurrency cap
+    (0 = unlimited), timeout, circuit breaker and latency window.
+    """
+
+    def __init__(self, name: str, model: Any, max_concurrency: int = 0, rpm: int = 0, tpm: int = 0,
+                 timeout: float = LLM_TIMEOUT_SECONDS, window: int = 256):
+        self.name = name
+        self.model = model
+        self.model_name = getattr(model, "model_name", None) or name
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self.timeout = timeout
+        self._slots = threading.Condition()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._failures = 0  # consecutive
+        self._open_until = 0.0
+        self.last_error: Optional[str] = None
+        self.stats = {"requests": 0, "ok": 0, "rate_limit": 0, "timeout": 0, "unavailable": 0, "error": 0,
+                      "cancelled": 0, "hedges": 0, "hedges_won": 0, "throttled": 0}
+
+    # --- concurrency ---
+
+    def _try_enter(self) -> bool:
+        with self._slots:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _enter(self):
+        with self._slots:
+            while self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self._slots.wait()
+            self._in_flight += 1
+
+    async def _aenter(self):
+        delay = 0.005
+        while not self._try_enter():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def _leave(self):
+        with self._slots:
+            self._in_flight -= 1
+            self._slots.notify()
+
+    # --- quota ---
+
+    def _take_quota(self, messages):
+        """A rate limiter ticket, or QuotaExhausted so the gateway can route elsewhere."""
+        ticket, wait = self.rate_limiter.try_acquire(estimate_tokens(messages))
+        if ticket is None:
+            with self._lock:
+                self.stats["throttled"] += 1
+            raise QuotaExhausted(self.name, wait)
+        return ticket
+
+    # --- health ---
+
+    def available(self) -> bool:
+        """False while the breaker is open; after the cooldown one call is let through to probe."""
+        return time.monotonic() >= self._open_until
+
+    def state(self) -> str:
+        if not self.available():
+            return "open"
+        return "degraded" if self._failures else "healthy"
+
+    def hedge_delay(self) -> Optional[float]:
+        if LLM_HEDGE_AFTER_MS > 0:
+            return LLM_HEDGE_AFTER_MS / 1000
+        with self._lock:
+            if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            return _percentile(self._latencies, 0.95)
+
+    def _requested(self):
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def _succeeded(self, started: float, ticket, usage: Dict[str, int]):
+        elapsed = time.perf_counter() - started
+        if usage.get("total_tokens"):
+            self.rate_limiter.settle(ticket, usage["total_tokens"])
+        with self._lock:
+            self.stats["ok"] += 1
+            self._failures = 0
+            self._latencies.append(elapsed)
+        metrics.LLM_PROVIDER_SECONDS.observe(elapsed, provider=self.name, outcome="ok")
+
+    def _failed(self, started: float, error: BaseException):
+        elapsed = time.perf_counter() - started
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # A hedge that lost, or a client that went away: says nothing about the provider.
+            with self._lock:
+                self.stats["cancelled"] += 1
+            metrics.LLM_PROVIDER_SECONDS.observe(elapsed, provider=self.name, outcome="cancelled")
+            return
+        kind = classify(error)
+        with self._lock:
+            self.stats[kind] += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:300]
+            self._failures += 1
+            if self._failures >= LLM_BREAKER_FAILURES:
+                self._open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+        metrics.LLM_PROVIDER_SECONDS.observe(elapsed, provider=self.name, outcome=kind)
+
+    # --- calls: one attempt each ---
+
+    def invoke(self, messages):
+        """Blocking call; the timeout is the client's own (set when the provider is built)."""
+        ticket = self._take_quota(messages)
+        self._requested()
+        self._enter()
+        started = time.perf_counter()
+        try:
+            response = self.model.invoke(messages)
+        except BaseException as e:
+            self._failed(started, e)
+            raise
+        finally:
+            self._leave()
+        self._succeeded(started, ticket, getattr(response, "usage_metadata", None) or {})
+        return response
+
+    async def ainvoke(self, messages):
+        ticket = self._take_quota(messages)
+        self._requested()
+        await self._aenter()
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self.model.ainvoke(messages), self.timeout)
+        except BaseException as e:
+            self._failed(started, e)
+            raise
+        finally:
+            self._leave()
+        self._succeeded(started, ticket, getattr(response, "usage_metadata", None) or {})
+        return response
+
+    async def astream(self, messages):
+        """Yields the model's chunks; fails with a timeout if any chunk takes longer than `timeout`."""
+        ticket = self._take_quota(messages)
+        self._requested()
+        await self._aenter()
+        started = time.perf_counter()
+        stream = self.model.astream(messages)
+        usage = {}
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    break
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                yield chunk
+        except BaseException as e:
+            self._failed(started, e)
+            raise
+        finally:
+            self._leave()
+            await stream.aclose()
+        self._succeeded(started, ticket, usage)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = dict(self.stats)
+            failures = self._failures
+            open_for = max(0.0, self._open_until - time.monotonic())
+        with self._slots:
+            in_flight = self._in_flight
+        p50, p95, p99 = (_percentile(latencies, pct) for pct in (0.50, 0.95, 0.99))
+        return {
+            "name": self.name,
+            "model": self.model_name,
+            "state": self.state(),
+            "consecutive_failures": failures,
+            "open_for_seconds": round(open_for, 1),
+            "last_error": self.last_error,
+            "in_flight": in_flight,
+            "max_concurrency": self.max_concurrency,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "latency_p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            **stats,
+        }
+
+
+class LLMGateway:
+    """
+    Routes calls over `providers` (first = primary) with failover, backoff and optional hedging.
+    `on_usage(provider, usage, node)` is called for every completed request, including hedges
+    that lost but still finished (their tokens are billed too).
+    """
+
+    def __init__(self, providers: List[Provider], max_retries: int = LLM_MAX_RETRIES,
+                 hedge: bool = LLM_HEDGE, on_usage: Optional[Callable[[Provider, Dict, str], None]] = None):
+        self.providers = providers
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.on_usage = on_usage
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "failovers": 0, "hedged": 0, "failed": 0}
+
+    @property
+    def model_name(self) -> str:
+        """The primary's model; part of the LLM result cache key."""
+        return self.providers[0].model_name
+
+    def use_model(self, model: Any, name: str = "stub"):
+        """Routes every call to `model` alone, without limits (benchmarks, offline runs)."""
+        self.providers = [Provider(name, model)]
+
+    # --- routing ---
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _candidates(self, excluded: Set[Provider]) -> List[Provider]:
+        usable = [provider for provider in self.providers if provider not in excluded]
+        # Every breaker open: still probe the first rather than fail without trying.
+        return [provider for provider in usable if provider.available()] or usable[:1]
+
+    def _report(self, provider: Provider, response, node: str):
+        if self.on_usage is not None:
+            self.on_usage(provider, getattr(response, "usage_metadata", None) or {}, node)
+
+    def _backup(self, provider: Provider) -> Provider:
+        """Where a hedge goes: the next healthy provider, or the same one when it is alone."""
+        others = [other for other in self._candidates(set()) if other is not provider]
+        backup = others[0] if others else provider
+        self._count("hedged")
+        with backup._lock:
+            backup.stats["hedges"] += 1
+        return backup
+
+    def _won(self, backup: Provider):
+        with backup._lock:
+            backup.stats["hedges_won"] += 1
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-hedge")
+            return self._pool
+
+    # --- blocking ---
+
+    def _hedged(self, provider: Provider, messages, node: str):
+        """One attempt, hedged when slow. Raises AttemptFailed with every request that failed."""
+        delay = provider.hedge_delay() if self.hedge else None
+        if delay is None:
+            try:
+                return provider, provider.invoke(messages)
+            except Exception as e:
+                raise AttemptFailed([(provider, e)]) from e
+        pool = self._executor()
+        # Workers get a copy of this context (tenant, trace, node labels).
+        primary = pool.submit(contextvars.copy_context().run, provider.invoke, messages)
+        pending = {primary: provider}
+        done, _ = wait([primary], timeout=delay)
+        if not done:
+            backup_provider = self._backup(provider)
+            pending[pool.submit(contextvars.copy_context().run, backup_provider.invoke, messages)] = backup_provider
+        failures = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is None:
+                    if future is not primary:
+                        self._won(winner)
+                    for loser, loser_provider in pending.items():
+                        # Can't cancel a blocking call: count its tokens when it finishes.
+                        loser.add_done_callback(partial(self._late_usage, loser_provider, node))
+                    return winner, future.result()
+                failures.append((winner, future.exception()))
+        raise AttemptFailed(failures)
+
+    def _late_usage(self, provider: Provider, node: str, future):
+        if not future.cancelled() and future.exception() is None:
+            self._report(provider, future.result(), node)
+
+    def invoke(self, messages, node: str) -> Tuple[Provider, Any]:
+        """The response, and the provider that gave it (a fallback after a failover or hedge)."""
+        route = _Route(self, node)
+        while True:
+            provider, delay = route.next()
+            with route.waiting():
+                time.sleep(delay)
+            try:
+                provider, response = self._hedged(provider, messages, node)
+            except AttemptFailed as e:
+                route.failed(e.failures)
+                continue
+            self._report(provider, response, node)
+            return provider, response
+
+    # --- async ---
+
+    async def _ahedged(self, provider: Provider, messages):
+        delay = provider.hedge_delay() if self.hedge else None
+        if delay is None:
+            try:
+                return provider, await provider.ainvoke(messages)
+            except Exception as e:
+                raise AttemptFailed([(provider, e)]) from e
+        primary = asyncio.ensure_future(provider.ainvoke(messages))
+        tasks = {primary: provider}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                backup_provider = self._backup(provider)
+                tasks[asyncio.ensure_future(backup_provider.ainvoke(messages))] = backup_provider
+            failures = []
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._won(tasks[task])
+                        return tasks[task], task.result()
+                    failures.append((tasks[task], task.exception()))
+            raise AttemptFailed(failures)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, messages, node: str) -> Tuple[Provider, Any]:
+        route = _Route(self, node)
+        while True:
+            provider, delay = route.next()
+            with route.waiting():
+                await asyncio.sleep(delay)
+            try:
+                provider, response = await self._ahedged(provider, messages)
+            except AttemptFailed as e:
+                route.failed(e.failures)
+                continue
+            self._report(provider, response, node)
+            return provider, response
+
+    async def astream(self, messages, node: str, answered: Optional[Dict[str, Provider]] = None):
+        """
+        Yields content tokens. Failover and retries apply until the first token has been
+        yielded; a stream that breaks after that raises. Streams are not hedged. Once the
+        stream completes, `answered["provider"]` is the provider that produced it.
+        """
+        route = _Route(self, node)
+        while True:
+            provider, delay = route.next()
+            with route.waiting():
+                await asyncio.sleep(delay)
+            usage, emitted = {}, False
+            stream = provider.astream(messages)
+            try:
+                async for chunk in stream:
+                    if chunk.usage_metadata:
+                        usage = chunk.usage_metadata
+                    if chunk.content:
+                        emitted = True
+                        yield chunk.content
+            except Exception as e:
+                if emitted:
+                    raise
+                route.failed([(provider, e)])
+                continue
+            finally:
+                await stream.aclose()
+            if self.on_usage is not None:
+                self.on_usage(provider, usage, node)
+            if answered is not None:
+                answered["provider"] = provider
+            return
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            **stats,
+            "primary": self.providers[0].name,
+            "hedging": self.hedge,
+            "max_retries": self.max_retries,
+            "providers": [provider.snapshot() for provider in self.providers],
+        }
+
+
+class _Route:
+    """Failover and retry state of one gateway call."""
+
+    def __init__(self, gateway: LLMGateway, node: str):
+        self.gateway = gateway
+        self.node = node
+        self.failed_this_round: Set[Provider] = set()
+        self.dead: Set[Provider] = set()  # failed with a non-retryable error
+        self.last: Optional[Tuple[Provider, Exception]] = None
+        self.rounds = 0
+        # Waits reported by QuotaExhausted this round, and whether anything else failed in it.
+        self.quota_waits: Dict[Provider, float] = {}
+        self.other_failure = False
+        self.throttled = False  # the pending delay is a quota wait, not a backoff
+        gateway._count("calls")
+
+    def waiting(self):
+        """Span for the delay before the next attempt; quota waits count as rate limit wait."""
+        if self.throttled:
+            return span("llm.rate_limit", metrics.RATE_LIMIT_WAIT_SECONDS)
+        return contextlib.nullcontext()
+
+    def next(self) -> Tuple[Provider, float]:
+        """
+        The provider for the next attempt and how long to back off first. Raises the last
+        error once every provider is dead or the retries are used up.
+        """
+        gateway = self.gateway
+        candidates = gateway._candidates(self.failed_this_round | self.dead)
+        delay = 0.0
+        self.throttled = False
+        if not candidates and self.quota_waits and not self.other_failure:
+            # Only local quotas stood in the way: wait for the first one instead of spending a retry.
+            provider = min(self.quota_waits, key=self.quota_waits.get)
+            delay, self.throttled = self.quota_waits[provider], True
+            self.failed_this_round.clear()
+            self.quota_waits = {}
+            return provider, delay
+        if not candidates:
+            # Every provider failed this round: back off, then start over from the primary.
+            if self.rounds >= gateway.max_retries or not gateway._candidates(self.dead):
+                gateway._count("failed")
+                raise self.last[1]
+            self.rounds += 1
+            self.failed_this_round.clear()
+            self.quota_waits, self.other_failure = {}, False
+            candidates = gateway._candidates(self.dead)
+            backoff = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (self.rounds - 1))
+            delay = min(LLM_BACKOFF_MAX, max(random.uniform(backoff / 2, backoff), retry_after(self.last[1]) or 0.0))
+        provider = candidates[0]
+        if self.last is not None:
+            gateway._count("retries")
+            if provider is not self.last[0]:
+                gateway._count("failovers")
+            metrics.LLM_RETRIES.inc(node=self.node, reason=classify(self.last[1]))
+        return provider, delay
+
+    def failed(self, failures: List[Tuple[Provider, Exception]]):
+        """Records every request of an attempt, so a failed hedge provider isn't picked next."""
+        for provider, error in failures:
+            (self.failed_this_round if classify(error) in RETRYABLE else self.dead).add(provider)
+            if isinstance(error, QuotaExhausted):
+                self.quota_waits[provider] = error.wait
+            else:
+                self.other_failure = True
+        self.last = failures[0]
+
+
+def _limits(prefix: str) -> Dict[str, Any]:
+    return {
+        "max_concurrency": int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "16")),
+        "rpm": int(os.getenv(f"{prefix}_RPM", "0")),
+        "tpm": int(os.getenv(f"{prefix}_TPM", "0")),
+    }
+
+
+def build_providers() -> List[Provider]:
+    """
+    Providers named in LLM_PROVIDERS, in failover order: groq, openai, and local (any
+    OpenAI-compatible server at LOCAL_LLM_BASE_URL, e.g. Ollama or vLLM). Fallbacks without
+    credentials are skipped.
+    """
+    names = [name.strip() for name in LLM_PROVIDERS.split(",") if name.strip()]
+    providers = []
+    for name in names:
+        if name == "groq" and (os.getenv("GROQ_API_KEY") or name == names[0]):
+            from langchain_groq import ChatGroq
+
+            model = ChatGroq(
+                temperature=LLM_TEMPERATURE,
+                model_name=os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
+                api_key=os.getenv("GROQ_API_KEY"),
+                request_timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=0,  # retried by the gateway
+            )
+            providers.append(Provider("groq", model, **_limits("GROQ")))
+        elif name == "openai" and os.getenv("OPENAI_API_KEY"):
+            from langchain_openai import ChatOpenAI
+
+            model = ChatOpenAI(
+                temperature=LLM_TEMPERATURE,
+                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=0,
+            )
+            providers.append(Provider("openai", model, **_limits("OPENAI")))
+        elif name == "local" and os.getenv("LOCAL_LLM_BASE_URL"):
+            from langchain_openai import ChatOpenAI
+
+            model = ChatOpenAI(
+                temperature=LLM_TEMPERATURE,
+                model=os.getenv("LOCAL_LLM_MODEL", "llama3.1"),
+                base_url=os.getenv("LOCAL_LLM_BASE_URL"),
+                api_key=os.getenv("LOCAL_LLM_API_KEY", "local"),
+                timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=0,
+            )
+            providers.append(Provider("local", model, **_limits("LOCAL_LLM")))
+    if not providers:
+        raise RuntimeError(f"No LLM provider available in LLM_PROVIDERS={LLM_PROVIDERS!r}")
+    return providers
@@ -1,19 +1,66 @@
+import asyncio
 import hashlib
+import tempfile
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from . import models, schemas, database
-from .agent import process_single_email, chat_with_single_email, generate_new_email
-from .mock_data import get_mock_emails 
+from . import models, schemas, database, metrics, migrations, seed, tenants
+from . import agent
+from .agent import (
+    achat_with_single_email, agenerate_new_email, PipelineMode,
+    stale_emails_filter, STAGE_PROMPTS, clear_vector_db, remove_email_from_vector_db,
+    astream_chat_with_single_email, astream_new_email, get_style_content, search_emails
+)
+from .batch import process_emails_concurrently
+from .jobs import job_manager, INTERACTIVE_PRIORITY
+from .llm_cache import llm_cache
+from .retrieval_cache import retrieval_result_cache, query_embedding_cache, index_generation
+from .prompt_registry import prompt_registry
+from .preclassifier import preclassifier
+from .dedup import near_duplicates
+from .streaming import sse_token_stream, ttft_stats
+from .pagination import encode_cursor, after_cursor
+from .search import SearchFilters, RetrievalMode
+from .importer import import_messages, iter_mbox
+from .embedding_cache import CachedEmbeddings
+
+migrations.upgrade()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background job workers; jobs left unfinished by a previous run are resumed here.
+    job_manager.start()
+    sweeper = asyncio.create_task(tenants.registry.sweep_forever())
+    yield
+    sweeper.cancel()
+    job_manager.stop()
 
-models.Base.metadata.create_all(bind=database.engine)
+async def bind_tenant(x_user_id: Optional[str] = Header(default=None)):
+    """
+    Runs the request as the mailbox of X-User-Id (none: the default mailbox). The tenant stays
+    open until the response is sent; opening one may close the least recently used others.
+    """
+    tenant = tenants.tenant_key(x_user_id)
+    tenants.current_tenant.set(tenant)
+    # Opening a tenant can migrate its database and resume its jobs: keep that off the event loop.
+    await asyncio.to_thread(tenants.registry.acquire, tenant)
+    try:
+        await tenants.registry.evict()
+        yield tenant
+    finally:
+        tenants.registry.release(tenant)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(bind_tenant)])
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,13 +68,58 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-def get_db():
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Request latency per route template; every span logged while serving shares one trace id."""
+    trace_id = metrics.new_trace()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status,
+        )
+
+cache_stat_sources = {
+    "llm": llm_cache.snapshot,
+    "retrieval": retrieval_result_cache.snapshot,
+    "query_embeddings": query_embedding_cache.snapshot,
+}
+if isinstance(getattr(agent.embeddings, "underlying", None), CachedEmbeddings):
+    cache_stat_sources["embeddings"] = agent.embeddings.underlying.snapshot
+metrics.register_cache_stats(cache_stat_sources)
+
+def get_db(tenant: str = Depends(bind_tenant)):
     db = database.SessionLocal()
     try: yield db
     finally: db.close()
 
+async def get_async_db(tenant: str = Depends(bind_tenant)):
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_email_or_404(email_id: int, db: AsyncSession) -> models.Email:
+    email = await db.get(models.Email, email_id)
+    if not email: raise HTTPException(status_code=404, detail="Email not found")
+    return email
+
+async def current_style_content() -> str:
+    # Served from the prompt registry; only a cold registry has to query the DB.
+    if prompt_registry.peek() is None:
+        return await asyncio.to_thread(get_style_content)
+    return get_style_content()
+
 class Message(BaseModel):
     role: str
     content: str
@@ -39,119 +131,315 @@ class ChatRequest(BaseModel):
 class SaveDraftRequest(BaseModel):
     content: str
 
-@app.get("/emails/", response_model=List[schemas.EmailResponse])
-def read_emails(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    emails = db.query(models.Email).order_by(models.Email.timestamp.desc()).offset(skip).limit(limit).all()
-    return emails
+# Request handlers are async: LLM calls are awaited, retrieval runs in worker threads and
+# the DB goes through an async driver (aiosqlite/asyncpg), so short reads never queue behind in-flight chats.
+# Batch processing and reset stay sync (they run in the threadpool with their own workers).
+
+EMAIL_SUMMARY_COLUMNS = [getattr(models.Email, field) for field in schemas.EmailSummary.model_fields]
+
+@app.get("/emails/", response_model=List[schemas.EmailSummary])
+async def read_emails(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    sender: Optional[str] = None,
+    is_read: Optional[bool] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Inbox list, newest first, headers only (GET /emails/{id} has the full email).
+    Pages by keyset on (timestamp, id): pass the X-Next-Cursor header of one page as ?cursor= for the next.
+    """
+    query = select(*EMAIL_SUMMARY_COLUMNS)
+    if category is not None: query = query.filter(models.Email.category == category)
+    if sender is not None: query = query.filter(models.Email.sender == sender)
+    if is_read is not None: query = query.filter(models.Email.is_read == is_read)
+    if cursor:
+        try:
+            query = query.filter(after_cursor(cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    query = query.order_by(models.Email.timestamp.desc(), models.Email.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(query)).mappings().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return rows
+
+@app.get("/search", response_model=List[schemas.SearchHit])
+async def search_inbox(
+    q: str,
+    k: int = Query(10, ge=1, le=100),
+    mode: Optional[RetrievalMode] = None,
+    sender: Optional[str] = None,
+    category: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    exclude_email_id: Optional[int] = None,
+):
+    """Inbox search: BM25 over the FTS index, vector similarity, or both fused (default: RETRIEVAL_MODE)."""
+    filters = SearchFilters(sender=sender, category=category, date_from=date_from, date_to=date_to,
+                            exclude_email_id=exclude_email_id)
+    results = await asyncio.to_thread(search_emails, q, k, filters, mode)
+    return [
+        schemas.SearchHit(
+            email_id=doc.metadata["email_id"], sender=doc.metadata.get("sender"),
+            category=doc.metadata.get("category"), timestamp=doc.metadata.get("timestamp"),
+            snippet=doc.page_content[:200], score=score,
+        )
+        for doc, score in results
+    ]
+
+@app.get("/emails/{email_id}", response_model=schemas.EmailResponse)
+async def read_email(email_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await get_email_or_404(email_id, db)
 
 @app.get("/prompts/", response_model=List[schemas.PromptResponse])
-def read_prompts(db: Session = Depends(get_db)):
-    prompts = db.query(models.Prompt).all()
-    return prompts
+async def read_prompts(db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.Prompt))
+    return result.scalars().all()
 
 @app.put("/prompts/{prompt_id}", response_model=schemas.PromptResponse)
-def update_prompt(prompt_id: int, prompt_data: schemas.PromptCreate, db: Session = Depends(get_db)):
-    db_prompt = db.query(models.Prompt).filter(models.Prompt.id == prompt_id).first()
+async def update_prompt(prompt_id: int, prompt_data: schemas.PromptCreate, db: AsyncSession = Depends(get_async_db)):
+    db_prompt = await db.get(models.Prompt, prompt_id)
     if not db_prompt: raise HTTPException(status_code=404, detail="Prompt not found")
-    db_prompt.content = prompt_data.content
-    db.commit()
-    db.refresh(db_prompt)
+    if db_prompt.content != prompt_data.content:
+        # A new version marks every result produced by this prompt as stale.
+        db_prompt.content = prompt_data.content
+        db_prompt.version = (db_prompt.version or 1) + 1
+        db_prompt.last_updated = datetime.utcnow()
+    await db.commit()
+    prompt_registry.invalidate()
     return db_prompt
 
+def require_prompts(db: Optional[Session] = None):
+    """Current prompt snapshot; 409 while a triage prompt is missing, since every job item would fail."""
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        prompts = prompt_registry.snapshot(db)
+    finally:
+        if own_session:
+            db.close()
+    if any(prompt_type not in prompts for prompt_type in STAGE_PROMPTS.values()):
+        raise HTTPException(status_code=409, detail="Prompts missing. Reset the database first.")
+    return prompts
+
 @app.post("/process-emails/")
-def process_all_emails(db: Session = Depends(get_db)):
-    """Trigger the categorization/extraction agent."""
-    emails = db.query(models.Email).all()
-    count = 0
-    for email in emails:
-        try:
-            if email.category == "Uncategorized":
-                process_single_email(email, db)
-                count += 1
-        except Exception as e:
-            print(f"Error processing {email.id}: {e}")
-            continue
-    return {"message": f"Processed {count} emails."}
+def process_all_emails(
+    mode: PipelineMode = "graph", max_workers: Optional[int] = None, background: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Trigger the categorization/extraction agent on new emails and on emails whose
+    results came from an older prompt version. Only the invalidated stages are rerun.
+    With ?background=true the work is queued as a job and its id returned immediately.
+    """
+    prompts = require_prompts(db)
+    email_ids = [
+        row.id for row in db.query(models.Email.id).filter(stale_emails_filter(prompts))
+    ]
+    if background:
+        job = job_manager.submit("process_emails", email_ids, mode=mode, prompts=prompts)
+        return {"message": f"Queued {len(email_ids)} emails.", "job_id": job.id}
+    result = process_emails_concurrently(email_ids, max_workers, mode, prompts=prompts)
+    result["message"] = f"Processed {result['processed']} emails."
+    return result
 
-@app.post("/emails/{email_id}/chat")
-def chat_email(email_id: int, chat_req: ChatRequest, db: Session = Depends(get_db)):
+def _finish_import(stats: dict, process: bool) -> dict:
+    new_ids = stats.pop("new_ids", [])
+    if process and new_ids:
+        stats["job_id"] = job_manager.submit("import", new_ids).id
+    return stats
+
+@app.post("/import/upload")
+async def import_mailbox_upload(request: Request, chunk_size: Optional[int] = None,
+                                ingest: bool = False, process: bool = False):
+    """
+    Imports an mbox (or single message) sent as the raw request body, e.g. curl --data-binary
+    @inbox.mbox, deduplicated by Message-ID. With process=true the new emails are queued as a
+    background job. Files on the server's disk are imported with the CLI (python -m app.importer).
+    """
+    if process:
+        await asyncio.to_thread(require_prompts)
+    with tempfile.TemporaryFile() as spool:
+        # Spooled to disk as it arrives; the import then streams from the file.
+        async for block in request.stream():
+            spool.write(block)
+        spool.seek(0)
+        stats = await asyncio.to_thread(import_messages, iter_mbox(spool), chunk_size, ingest, process)
+    return _finish_import(stats, process)
+
+@app.post("/emails/{email_id}/reprocess")
+def reprocess_email(email_id: int, mode: PipelineMode = "graph", db: Session = Depends(get_db)):
+    """Queues one email at interactive priority, ahead of any bulk job still running."""
     email = db.query(models.Email).filter(models.Email.id == email_id).first()
     if not email: raise HTTPException(status_code=404, detail="Email not found")
-    response_text = chat_with_single_email(email.body, chat_req.query, email.sender, chat_req.history)
-    return {"response": response_text}
+    require_prompts(db)
+    job = job_manager.submit("reprocess_email", [email_id], mode=mode, priority=INTERACTIVE_PRIORITY)
+    return {"job_id": job.id}
+
+@app.get("/jobs/")
+def read_jobs(limit: int = 20, db: Session = Depends(get_db)):
+    job_ids = [row.id for row in db.query(models.Job.id).order_by(models.Job.id.desc()).limit(limit)]
+    return [job_manager.progress(job_id) for job_id in job_ids]
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: int):
+    """Progress, throughput and per-email errors of a background job."""
+    progress = job_manager.progress(job_id)
+    if not progress: raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job not found or already finished")
+    return {"message": "Job cancelled"}
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    """Hit/miss counters of the LLM result cache, the in-memory retrieval caches and triage reuse."""
+    return {
+        **llm_cache.snapshot(),
+        "retrieval": {**retrieval_result_cache.snapshot(), "index_generation": index_generation.value},
+        "query_embeddings": query_embedding_cache.snapshot(),
+        "near_duplicates": near_duplicates.snapshot(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Prometheus text exposition: request, node, LLM, embedding, vector store, DB and cache metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/emails/{email_id}/chat")
+async def chat_email(email_id: int, chat_req: ChatRequest, retrieval: Optional[RetrievalMode] = None,
+                     db: AsyncSession = Depends(get_async_db)):
+    email = await get_email_or_404(email_id, db)
+    await db.close()  # release the pooled connection before the slow LLM call
+    response_text, context = await achat_with_single_email(email.body, chat_req.query, email.sender,
+                                                           chat_req.history, email_id=email.id, retrieval=retrieval)
+    return {"response": response_text, "context": context.as_dict()}
+
+@app.post("/emails/{email_id}/chat/stream")
+async def chat_email_stream(email_id: int, chat_req: ChatRequest, retrieval: Optional[RetrievalMode] = None,
+                            db: AsyncSession = Depends(get_async_db)):
+    """Same as /chat, streamed as Server-Sent Events."""
+    started = time.perf_counter()
+    email = await get_email_or_404(email_id, db)
+    await db.close()  # release the pooled connection before the slow LLM call
+    tokens, context = await astream_chat_with_single_email(email.body, chat_req.query, email.sender,
+                                                           chat_req.history, email_id=email.id, retrieval=retrieval)
+    return StreamingResponse(sse_token_stream("chat", tokens, started, extra={"context": context.as_dict()}),
+                             media_type="text/event-stream")
 
 @app.delete("/emails/{email_id}")
-def delete_email(email_id: int, db: Session = Depends(get_db)):
-    email = db.query(models.Email).filter(models.Email.id == email_id).first()
-    if not email: raise HTTPException(status_code=404, detail="Email not found")
-    db.delete(email)
-    db.commit()
+async def delete_email(email_id: int, db: AsyncSession = Depends(get_async_db)):
+    email = await get_email_or_404(email_id, db)
+    await db.delete(email)
+    await db.commit()
+    await asyncio.to_thread(remove_email_from_vector_db, email_id)
+    index_generation.bump()
     return {"message": "Email deleted successfully"}
 
 @app.put("/emails/{email_id}/draft")
-def save_reply_draft(email_id: int, draft: SaveDraftRequest, db: Session = Depends(get_db)):
-    email = db.query(models.Email).filter(models.Email.id == email_id).first()
-    if not email: raise HTTPException(status_code=404, detail="Email not found")
+async def save_reply_draft(email_id: int, draft: SaveDraftRequest, db: AsyncSession = Depends(get_async_db)):
+    email = await get_email_or_404(email_id, db)
     email.suggested_reply = draft.content
-    db.commit()
+    await db.commit()
     return {"message": "Draft saved"}
 
 @app.post("/drafts/generate")
-def generate_email_endpoint(req: schemas.GenerateRequest, db: Session = Depends(get_db)):
-    body = generate_new_email(req.recipient, req.subject, req.instructions, db)
-    return {"body": body}
+async def generate_email_endpoint(req: schemas.GenerateRequest, retrieval: Optional[RetrievalMode] = None):
+    style_content = await current_style_content()
+    body, context = await agenerate_new_email(req.recipient, req.subject, req.instructions, style_content, retrieval)
+    return {"body": body, "context": context.as_dict()}
+
+@app.post("/drafts/generate/stream")
+async def generate_email_stream(req: schemas.GenerateRequest, save: bool = False,
+                                retrieval: Optional[RetrievalMode] = None):
+    """
+    Same as /drafts/generate, streamed as Server-Sent Events.
+    With ?save=true the finished text is stored as a draft and its id sent in the final event.
+    """
+    started = time.perf_counter()
+    style_content = await current_style_content()
+    tokens, context = await astream_new_email(req.recipient, req.subject, req.instructions, style_content, retrieval)
+
+    async def save_draft(text: str):
+        if not save:
+            return {}
+        # The request session may already be closed once the body streams.
+        async with database.AsyncSessionLocal() as draft_db:
+            db_draft = models.Draft(recipient=req.recipient, subject=req.subject, body=text)
+            draft_db.add(db_draft)
+            await draft_db.commit()
+            return {"draft_id": db_draft.id}
+
+    return StreamingResponse(
+        sse_token_stream("generate", tokens, started, on_complete=save_draft, extra={"context": context.as_dict()}),
+        media_type="text/event-stream"
+    )
+
+@app.get("/tenants/stats")
+async def read_tenant_stats(tenant: str = Depends(bind_tenant)):
+    """Open mailboxes and evictions; `tenant` is the caller's own mailbox key."""
+    return {"tenant": tenant, **tenants.registry.snapshot()}
+
+@app.get("/llm/stats")
+async def read_llm_stats():
+    """Health, latency percentiles and retry/failover/hedge counts of each LLM provider."""
+    return agent.llm_gateway.snapshot()
+
+@app.get("/preclassifier/stats")
+async def read_preclassifier_stats():
+    """Hit rate of the local category classifier and its agreement with the LLM."""
+    return preclassifier.snapshot()
+
+@app.get("/streaming/stats")
+async def read_streaming_stats():
+    """Time-to-first-token and total duration percentiles of the streaming endpoints."""
+    return ttft_stats.snapshot()
 
 @app.post("/drafts/", response_model=schemas.DraftResponse)
-def save_new_draft(draft: schemas.DraftCreate, db: Session = Depends(get_db)):
+async def save_new_draft(draft: schemas.DraftCreate, db: AsyncSession = Depends(get_async_db)):
     db_draft = models.Draft(**draft.dict())
     db.add(db_draft)
-    db.commit()
-    db.refresh(db_draft)
+    await db.commit()
+    await db.refresh(db_draft)
     return db_draft
 
 @app.get("/drafts/", response_model=List[schemas.DraftResponse])
-def get_all_drafts(db: Session = Depends(get_db)):
+async def get_all_drafts(db: AsyncSession = Depends(get_async_db)):
     try:
-        return db.query(models.Draft).order_by(models.Draft.timestamp.desc()).all()
+        result = await db.execute(select(models.Draft).order_by(models.Draft.timestamp.desc()))
+        return result.scalars().all()
     except Exception as e:
         return []
 
 @app.post("/reset-db")
-def reset_database(db: Session = Depends(get_db)):
-    """Resets the DB with Mock Data and Default Prompts."""
+def reset_database(background: bool = False, db: Session = Depends(get_db)):
+    """
+    Resets the DB with Mock Data and Default Prompts.
+    Restores the seed snapshot when it is current; otherwise rebuilds (and re-snapshots) it.
+    With ?background=true a rebuild queues the top emails as a job instead of processing them here.
+    """
     try:
-        models.Base.metadata.drop_all(bind=database.engine)
-        models.Base.metadata.create_all(bind=database.engine)
-
-        default_prompts = [
-            {"prompt_type": "categorize", "content": "Categorize the following email into: 'Work', 'Personal', 'Spam', 'Newsletter', 'Urgent'. Return only the single category name."},
-            {"prompt_type": "extract_actions", "content": "Extract specific action items (tasks) and soft suggestions (follow-ups) from the email."},
-            {"prompt_type": "auto_reply", "content": "You are a professional assistant. Draft a concise, polite reply."}
-        ]
-        for p in default_prompts:
-            db.add(models.Prompt(prompt_type=p["prompt_type"], content=p["content"]))
-        db.commit()
-
-        mock_emails = get_mock_emails()
-        created_emails = []
-        for e in mock_emails:
-            email_obj = models.Email(
-                sender=e["sender"], subject=e["subject"], body=e["body"], 
-                timestamp=e["timestamp"], category="Uncategorized"
-            )
-            db.add(email_obj)
-            created_emails.append(email_obj)
-        db.commit()
-
-        print(f"Processing {len(created_emails)} mock emails...")
-        for email in created_emails[:3]: 
-            db.refresh(email)
-            try:
-                process_single_email(email, db)
-            except Exception as e:
-                print(f"Failed to process email {email.id}: {e}")
-
-        return {"message": "Reset complete. Top 3 emails processed."}
+        job_manager.clear()
+        if seed.restore():
+            return {"message": "Reset complete. Restored from the seed snapshot.", "snapshot": "restored"}
+
+        if not background:
+            seed.rebuild()
+            return {"message": f"Reset complete. Top {seed.SEED_TOP_EMAILS} emails processed.", "snapshot": "rebuilt"}
+
+        migrations.reset()
+        clear_vector_db()
+        top_ids = seed.populate(db)
+        job = job_manager.submit("process_emails", top_ids, priority=INTERACTIVE_PRIORITY)
+        return {"message": f"Reset complete. Top {seed.SEED_TOP_EMAILS} emails queued.", "job_id": job.id}
     except Exception as e:
         print(f"Reset Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
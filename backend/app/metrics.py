@@ -0,0 +1,240 @@
+"""
+Process-wide metrics in the Prometheus text format, plus optional trace spans in the logs.
+
+Kept dependency-free: counters and histograms with labels, and callback metrics that read
+existing stats (e.g. cache counters) at scrape time. Set TRACE_SPANS=1 to print one line per span.
+"""
+import functools
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+TRACE_SPANS = os.getenv("TRACE_SPANS", "0") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Request trace id and the triage node an LLM call belongs to.
+current_trace: ContextVar[Optional[str]] = ContextVar("current_trace", default=None)
+current_node: ContextVar[str] = ContextVar("current_node", default="other")
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = self.header()
+        for key, values in series.items():
+            cumulative = 0
+            labels = _format_labels(self.labelnames, key)
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {values[-1]}")
+            lines.append(f"{self.name}_sum{labels} {values[-2]}")
+            lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose values are read from `collect()` at scrape time: {label values: value}."""
+
+    def __init__(self, name, documentation, kind: str, labelnames, collect: Callable[[], Dict[Tuple, float]]):
+        self.kind = kind
+        self.collect = collect
+        super().__init__(name, documentation, labelnames)
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metrics: collecting {self.name} failed: {e}")
+            values = {}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()
+        ]
+
+
+registry: List[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+# --- application metrics ---
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency.", ["method", "route", "status"])
+TRIAGE_NODE_SECONDS = Histogram("triage_node_duration_seconds", "Latency of each triage node, LLM call included.", ["node"])
+LLM_REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "LLM call latency, quota waits and retries included.", ["node", "operation"])
+LLM_PROVIDER_SECONDS = Histogram("llm_provider_request_duration_seconds", "One attempt against one LLM provider.", ["provider", "outcome"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM calls that raised after every retry and fallback.", ["node"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM work redone: unusable answers, and calls retried after a rate limit, timeout or provider error.", ["node", "reason"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the provider.", ["node", "kind"])
+LLM_COST_USD = Counter("llm_cost_usd_total", "Estimated LLM spend from token counts and configured prices.", ["model"])
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups_total", "LLM result cache lookups per node.", ["node", "result"])
+CONTEXT_TOKENS = Counter("context_tokens_total", "Chat/compose prompt tokens sent, and saved by the token budget.", ["prompt", "kind"])
+PRECLASSIFIER_DECISIONS = Counter("preclassifier_decisions_total", "Local category predictions by outcome.", ["result"])
+NEAR_DUPLICATE_LOOKUPS = Counter("near_duplicate_lookups_total", "SimHash lookups for a reusable triage.", ["result"])
+RATE_LIMIT_WAIT_SECONDS = Histogram("rate_limit_wait_seconds", "Time spent waiting for LLM quota.")
+EMBEDDING_SECONDS = Histogram("embedding_duration_seconds", "Embedding model latency.", ["operation"])
+EMBEDDING_TEXTS = Counter("embedding_texts_total", "Texts sent to the embedding model.", ["operation"])
+VECTOR_STORE_SECONDS = Histogram("vector_store_duration_seconds", "Vector store latency.", ["operation"])
+LEXICAL_SEARCH_SECONDS = Histogram("lexical_search_duration_seconds", "FTS5 BM25 query latency.")
+DB_COMMIT_SECONDS = Histogram("db_commit_duration_seconds", "Session commit latency (flush included).")
+TENANT_EVICTIONS = Counter("tenant_evictions_total", "Tenants closed to bound open stores.", ["reason"])
+
+
+def register_cache_stats(sources: Dict[str, Callable[[], Dict]]):
+    """
+    Exports hit/miss counters and hit ratios of caches that keep their own stats. Each source
+    returns a dict with "hits" (or memory_hits + db_hits) and "misses".
+    """
+    def counts() -> Dict[str, Tuple[float, float]]:
+        result = {}
+        for cache, snapshot in sources.items():
+            stats = snapshot()
+            hits = stats.get("hits", stats.get("memory_hits", 0) + stats.get("db_hits", 0))
+            result[cache] = (hits, stats.get("misses", 0))
+        return result
+
+    CallbackMetric("cache_hits_total", "Cache hits.", "counter", ["cache"],
+                   lambda: {(cache,): hits for cache, (hits, _) in counts().items()})
+    CallbackMetric("cache_misses_total", "Cache misses.", "counter", ["cache"],
+                   lambda: {(cache,): misses for cache, (_, misses) in counts().items()})
+    CallbackMetric("cache_hit_ratio", "Hits / lookups since start.", "gauge", ["cache"],
+                   lambda: {(cache,): round(hits / (hits + misses), 4) if hits + misses else 0.0
+                            for cache, (hits, misses) in counts().items()})
+
+
+# --- spans ---
+
+def new_trace() -> str:
+    trace_id = uuid.uuid4().hex[:16]
+    current_trace.set(trace_id)
+    return trace_id
+
+
+@contextmanager
+def span(name: str, histogram: Optional[Histogram] = None, **labels):
+    """Times a block into `histogram` and, with TRACE_SPANS=1, logs it under the current trace id."""
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        if TRACE_SPANS:
+            attributes = " ".join(f"{key}={value}" for key, value in labels.items())
+            print(f"[trace {current_trace.get() or '-'}] {name} {elapsed * 1000:.1f}ms {status} {attributes}".rstrip())
+
+
+def traced_node(node: str):
+    """Decorator for triage nodes: node latency, and LLM calls inside attributed to the node."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = current_node.set(node)
+            try:
+                with span(f"node.{node}", TRIAGE_NODE_SECONDS, node=node):
+                    return fn(*args, **kwargs)
+            finally:
+                current_node.reset(token)
+        return wrapper
+    return decorator
+
+
+# --- DB commits (every Session, sync or behind AsyncSession) ---
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        DB_COMMIT_SECONDS.observe(elapsed)
+        if TRACE_SPANS:
+            print(f"[trace {current_trace.get() or '-'}] db.commit {elapsed * 1000:.1f}ms ok")
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("commit_started", None)
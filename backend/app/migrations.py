@@ -0,0 +1,154 @@
+"""
+Versioned schema migrations for the app database (SQLite or Postgres).
+
+Each migration runs once, in order, and is recorded in `schema_migrations`; the app and the
+importer call `upgrade()` at startup instead of `create_all`. Migrations are written to be
+idempotent, so a database created by `create_all` before this module existed is brought
+forward without errors.
+
+    python -m app.migrations upgrade | status | reset
+"""
+import argparse
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import database, models
+from .search import create_fts_index, drop_fts_index
+
+# Kept out of Base.metadata so drop_all/create_all elsewhere never touch it.
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+ADVISORY_LOCK_ID = 0x656D6169  # serializes concurrent upgrades across Postgres clients
+
+
+def _add_column(connection: Connection, table: str, column: str, ddl_type: str) -> bool:
+    """Adds the column if missing; True when it was added."""
+    if column in {c["name"] for c in inspect(connection).get_columns(table)}:
+        return False
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    return True
+
+
+def _create_indexes(connection: Connection, table: Table, columns: List[str]):
+    """Creates the model's indexes covering any of `columns` that the database lacks."""
+    for index in table.indexes:
+        if {column.name for column in index.columns} & set(columns):
+            index.create(connection, checkfirst=True)
+
+
+def _initial(connection: Connection):
+    models.Base.metadata.create_all(connection, checkfirst=True)
+
+
+def _prompt_versions(connection: Connection):
+    _add_column(connection, "prompts", "version", "INTEGER DEFAULT 1")
+    for stage in ("categorize", "extract_actions", "auto_reply"):
+        _add_column(connection, "emails", f"{stage}_prompt_version", "INTEGER")
+
+
+def _message_id(connection: Connection):
+    # Tables from create_all already carry the UNIQUE constraint.
+    if _add_column(connection, "emails", "message_id", "VARCHAR"):
+        connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_emails_message_id ON emails (message_id)"))
+
+
+def _keyset_indexes(connection: Connection):
+    _create_indexes(connection, models.Email.__table__, ["timestamp"])
+
+
+def _simhash(connection: Connection):
+    _add_column(connection, "emails", "simhash", "BIGINT")
+    bands = [f"simhash_band_{band}" for band in range(4)]
+    for column in bands:
+        _add_column(connection, "emails", column, "INTEGER")
+    _create_indexes(connection, models.Email.__table__, bands)
+
+
+def _full_text(connection: Connection):
+    create_fts_index(connection)
+
+
+def _category_source(connection: Connection):
+    # Older rows stay NULL: whether the LLM categorized them is unknown, so nothing trains on them.
+    _add_column(connection, "emails", "category_source", "VARCHAR")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "initial schema", _initial),
+    (2, "prompt versions on prompts and emails", _prompt_versions),
+    (3, "emails.message_id for imported mail", _message_id),
+    (4, "keyset pagination indexes", _keyset_indexes),
+    (5, "simhash fingerprint and LSH bands", _simhash),
+    (6, "full-text index", _full_text),
+    (7, "emails.category_source", _category_source),
+]
+
+
+def applied_versions(connection: Connection) -> set:
+    if not inspect(connection).has_table("schema_migrations"):
+        return set()
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def upgrade(engine: Engine = None) -> List[int]:
+    """Applies pending migrations in one transaction; returns the versions applied."""
+    engine = engine or database.engine
+    applied = []
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        schema_migrations.create(connection, checkfirst=True)
+        done = applied_versions(connection)
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+            applied.append(version)
+    if applied:
+        print(f"Applied migrations {applied} to {engine.url.render_as_string(hide_password=True)}")
+    return applied
+
+
+def reset(engine: Engine = None):
+    """Drops every app table (the caches live elsewhere) and migrates from scratch."""
+    engine = engine or database.engine
+    with engine.begin() as connection:
+        drop_fts_index(connection)
+        models.Base.metadata.drop_all(connection)
+        schema_migrations.drop(connection, checkfirst=True)
+    upgrade(engine)
+
+
+def status(engine: Engine = None) -> List[dict]:
+    engine = engine or database.engine
+    with engine.connect() as connection:
+        done = applied_versions(connection)
+    return [{"version": version, "description": description, "applied": version in done}
+            for version, description, _ in MIGRATIONS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["upgrade", "status", "reset"])
+    args = parser.parse_args()
+    if args.command == "upgrade":
+        upgrade()
+    elif args.command == "reset":
+        reset()
+    for row in status():
+        print(f"{row['version']:>3}  {'applied' if row['applied'] else 'pending':8} {row['description']}")
+
+
+if __name__ == "__main__":
+    main()
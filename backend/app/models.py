@@ -1,12 +1,13 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, JSON, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Index, Integer, String, Text, JSON, DateTime, LargeBinary
 from sqlalchemy.orm import relationship
-from .database import Base
+from .database import Base, CacheBase
 from datetime import datetime
 
 class Email(Base):
     __tablename__ = "emails"
 
     id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(String, unique=True, nullable=True)  # RFC 5322 Message-ID of imported mail
     sender = Column(String, index=True)
     subject = Column(String)
     body = Column(Text)
@@ -14,8 +15,31 @@ class Email(Base):
     is_read = Column(Boolean, default=False)
     
     category = Column(String, default="Uncategorized") 
+    # Who assigned the category: "llm", "preclassifier" or "near_duplicate" (NULL = not recorded)
+    category_source = Column(String, nullable=True)
     action_items = Column(JSON, default={})            
     suggested_reply = Column(Text, nullable=True)      
+
+    # Version of the prompt that produced each result (NULL = never processed)
+    categorize_prompt_version = Column(Integer, nullable=True)
+    extract_actions_prompt_version = Column(Integer, nullable=True)
+    auto_reply_prompt_version = Column(Integer, nullable=True)
+
+    # 64-bit SimHash of subject + body (signed) and its four 16-bit bands, the LSH buckets
+    # near-duplicate lookups query. NULL until the email is imported or processed.
+    simhash = Column(BigInteger, nullable=True)
+    simhash_band_0 = Column(Integer, nullable=True, index=True)
+    simhash_band_1 = Column(Integer, nullable=True, index=True)
+    simhash_band_2 = Column(Integer, nullable=True, index=True)
+    simhash_band_3 = Column(Integer, nullable=True, index=True)
+
+    # Keyset pagination walks (timestamp, id) newest first, optionally within one filter value.
+    __table_args__ = (
+        Index("ix_emails_timestamp_id", "timestamp", "id"),
+        Index("ix_emails_category_timestamp_id", "category", "timestamp", "id"),
+        Index("ix_emails_sender_timestamp_id", "sender", "timestamp", "id"),
+        Index("ix_emails_is_read_timestamp_id", "is_read", "timestamp", "id"),
+    )
     
 class Prompt(Base):
     __tablename__ = "prompts"
@@ -23,6 +47,7 @@ class Prompt(Base):
     id = Column(Integer, primary_key=True, index=True)
     prompt_type = Column(String, unique=True) 
     content = Column(Text)                   
+    version = Column(Integer, default=1)
     last_updated = Column(DateTime, default=datetime.utcnow)
 
 class Draft(Base):
@@ -32,4 +57,44 @@ class Draft(Base):
     recipient = Column(String)
     subject = Column(String)
     body = Column(Text)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String)                       # e.g. "process_emails", "reprocess_email"
+    mode = Column(String, default="graph")      # pipeline mode passed to process_single_email
+    priority = Column(Integer, default=10)      # lower runs first; interactive work uses 0
+    status = Column(String, default="queued", index=True)  # queued, running, completed, cancelled
+    total = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class JobItem(Base):
+    __tablename__ = "job_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True)
+    email_id = Column(Integer)
+    status = Column(String, default="pending")  # pending, processed, skipped, failed
+    error = Column(Text, nullable=True)
+
+class LLMCacheEntry(CacheBase):
+    __tablename__ = "llm_cache"
+
+    key = Column(String, primary_key=True)  # sha256 of (node, model, prompt hash, input hash)
+    node = Column(String, index=True)
+    model = Column(String)
+    value = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed = Column(DateTime, default=datetime.utcnow, index=True)
+
+class EmbeddingCacheEntry(CacheBase):
+    __tablename__ = "embedding_cache"
+
+    key = Column(String, primary_key=True)  # sha256 of (embedding model, text)
+    model = Column(String)
+    vector = Column(LargeBinary)  # float32 array bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
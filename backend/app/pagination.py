@@ -0,0 +1,29 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import tuple_
+
+from . import models
+
+
+def encode_cursor(timestamp: datetime, email_id: int) -> str:
+    """Opaque cursor pointing just after (timestamp, id) in newest-first order."""
+    raw = f"{timestamp.isoformat()}|{email_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, email_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(email_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def after_cursor(cursor: str):
+    """WHERE clause for the rows after `cursor`; a row-value comparison the (timestamp, id) indexes can seek on."""
+    timestamp, email_id = decode_cursor(cursor)
+    return tuple_(models.Email.timestamp, models.Email.id) < (timestamp, email_id)
@@ -0,0 +1,189 @@
+"""
+Local naive Bayes pre-classifier for the categorize stage.
+
+Learns from the categories the LLM assigned (sender address, sender domain, subject and body
+tokens) and answers on its own when it is confident, so bulk newsletters, phishing alerts and
+regular senders don't cost LLM calls. A model belongs to one categorize prompt version: a new
+prompt starts a new model, bootstrapped from the emails the LLM already categorized with it.
+"""
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from email.utils import parseaddr
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, tenants
+
+PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_ENABLED", "1") == "1"
+# Posterior probability above which the LLM is skipped.
+PRECLASSIFIER_THRESHOLD = float(os.getenv("PRECLASSIFIER_THRESHOLD", "0.98"))
+# LLM-labeled emails needed before the model answers at all.
+PRECLASSIFIER_MIN_EXAMPLES = int(os.getenv("PRECLASSIFIER_MIN_EXAMPLES", "50"))
+# Share of confident predictions still sent to the LLM, to keep measuring agreement.
+PRECLASSIFIER_AUDIT_RATE = float(os.getenv("PRECLASSIFIER_AUDIT_RATE", "0.05"))
+PRECLASSIFIER_BOOTSTRAP_LIMIT = int(os.getenv("PRECLASSIFIER_BOOTSTRAP_LIMIT", "5000"))
+
+SENDER_WEIGHT = 3  # sender features count like this many body tokens
+MAX_BODY_CHARS = 2000  # the opening of an email carries most of its category
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'_-]{1,30}")
+
+
+def features(sender: str, subject: str, body: str) -> Counter:
+    """Binarized bag of features: each distinct token once, sender address and domain weighted up."""
+    address = (parseaddr(sender or "")[1] or sender or "").lower()
+    domain = address.rpartition("@")[2]
+    counts = Counter({f"from:{address}": SENDER_WEIGHT, f"domain:{domain}": SENDER_WEIGHT})
+    counts.update({f"subject:{token}": 1 for token in set(_TOKEN.findall((subject or "").lower()))})
+    counts.update({token: 1 for token in set(_TOKEN.findall((body or "")[:MAX_BODY_CHARS].lower()))})
+    return counts
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes with Laplace smoothing, updated one example at a time."""
+
+    def __init__(self):
+        self.documents: Counter = Counter()                       # category -> examples
+        self.feature_counts: Dict[str, Counter] = defaultdict(Counter)  # category -> feature -> count
+        self.feature_totals: Counter = Counter()                  # category -> sum of feature counts
+        self.vocabulary = set()
+
+    @property
+    def examples(self) -> int:
+        return sum(self.documents.values())
+
+    def learn(self, feats: Counter, category: str):
+        self.documents[category] += 1
+        self.feature_counts[category].update(feats)
+        self.feature_totals[category] += sum(feats.values())
+        self.vocabulary.update(feats)
+
+    def predict(self, feats: Counter) -> Tuple[Optional[str], float]:
+        """Most likely category and its posterior probability."""
+        total = self.examples
+        if not total:
+            return None, 0.0
+        vocabulary = len(self.vocabulary) + 1
+        scores = {}
+        for category, documents in self.documents.items():
+            counts = self.feature_counts[category]
+            denominator = math.log(self.feature_totals[category] + vocabulary)
+            score = math.log(documents / total)
+            for feature, weight in feats.items():
+                score += weight * (math.log(counts.get(feature, 0) + 1) - denominator)
+            scores[category] = score
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+
+@dataclass(frozen=True)
+class Prediction:
+    category: str
+    confidence: float
+    confident: bool  # above the threshold: the category is used without an LLM call
+    audit: bool      # confident, but sent to the LLM anyway to measure agreement
+
+
+class PreClassifier:
+    """Thread-safe wrapper: one model per categorize prompt version, plus hit rate and agreement stats."""
+
+    def __init__(self, threshold: float = PRECLASSIFIER_THRESHOLD, min_examples: int = PRECLASSIFIER_MIN_EXAMPLES,
+                 audit_rate: float = PRECLASSIFIER_AUDIT_RATE, enabled: bool = PRECLASSIFIER_ENABLED):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.audit_rate = audit_rate
+        self._model = NaiveBayes()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.stats = {"lookups": 0, "hits": 0, "audits": 0, "learned": 0,
+                      "compared": 0, "agreed": 0, "audit_agreed": 0}
+
+    def _ensure_version(self, version: int, db: Session):
+        """Starts a fresh model for a new prompt version, trained on emails the LLM categorized with it."""
+        if self._version == version:
+            return
+        model = NaiveBayes()
+        rows = db.execute(
+            select(models.Email.sender, models.Email.subject, models.Email.body, models.Email.category)
+            .where(models.Email.categorize_prompt_version == version, models.Email.category_source == "llm")
+            .order_by(models.Email.id.desc())
+            .limit(PRECLASSIFIER_BOOTSTRAP_LIMIT)
+        ).all()
+        for sender, subject, body, category in rows:
+            if category:
+                model.learn(features(sender, subject, body), category)
+        self._model, self._version = model, version
+
+    def predict(self, email: models.Email, version: int, db: Session) -> Optional[Prediction]:
+        """None while disabled or still learning; otherwise the model's best guess."""
+        if not self.enabled:
+            return None
+        feats = features(email.sender, email.subject, email.body)
+        with self._lock:
+            self._ensure_version(version, db)
+            if self._model.examples < self.min_examples:
+                return None
+            category, confidence = self._model.predict(feats)
+            confident = confidence >= self.threshold
+            audit = confident and self._random.random() < self.audit_rate
+            self.stats["lookups"] += 1
+            if audit:
+                self.stats["audits"] += 1
+            elif confident:
+                self.stats["hits"] += 1
+        return Prediction(category, confidence, confident, audit)
+
+    def learn(self, email: models.Email, category: str, version: int, prediction: Optional[Prediction] = None):
+        """Adds an LLM-assigned category; `prediction` is what the model said before the LLM answered."""
+        if not self.enabled or not category:
+            return
+        feats = features(email.sender, email.subject, email.body)
+        with self._lock:
+            if self._version != version:
+                return  # the model moved to another prompt version meanwhile
+            self._model.learn(feats, category)
+            self.stats["learned"] += 1
+            if prediction is not None:
+                agreed = prediction.category == category
+                self.stats["compared"] += 1
+                self.stats["agreed"] += agreed
+                if prediction.audit:
+                    self.stats["audit_agreed"] += agreed
+
+    def reset(self):
+        with self._lock:
+            self._model, self._version = NaiveBayes(), None
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            categories = dict(self._model.documents)
+            version = self._version
+        answered = stats["hits"] + stats["audits"]
+        return {
+            **stats,
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "prompt_version": version,
+            "training_examples": categories,
+            # Share of lookups answered without the LLM.
+            "hit_rate": round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0,
+            # Agreement with the LLM over every prediction it could be checked against...
+            "agreement": round(stats["agreed"] / stats["compared"], 4) if stats["compared"] else None,
+            # ...and over audited confident predictions only, i.e. the precision of the shortcut.
+            "confident_agreement": round(stats["audit_agreed"] / stats["audits"], 4) if stats["audits"] else None,
+            "confident_share": round(answered / stats["lookups"], 4) if stats["lookups"] else 0.0,
+        }
+
+
+# One per tenant: each mailbox learns from its own categories.
+preclassifier = tenants.TenantLocal(lambda tenant: PreClassifier())
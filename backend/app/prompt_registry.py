@@ -0,0 +1,82 @@
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, database, tenants
+
+
+@dataclass(frozen=True)
+class PromptEntry:
+    prompt_type: str
+    content: str
+    version: int
+
+
+@dataclass(frozen=True)
+class PromptSnapshot:
+    """Immutable view of the prompts table. `generation` changes on every invalidation."""
+    generation: int
+    prompts: Mapping[str, PromptEntry]
+
+    def __getitem__(self, prompt_type: str) -> PromptEntry:
+        return self.prompts[prompt_type]
+
+    def __contains__(self, prompt_type: str) -> bool:
+        return prompt_type in self.prompts
+
+    def get(self, prompt_type: str) -> Optional[PromptEntry]:
+        return self.prompts.get(prompt_type)
+
+
+class PromptRegistry:
+    """
+    Cache of a mailbox's prompts table. Readers share one snapshot until a write
+    invalidates it; a batch that holds on to its snapshot sees one prompt version throughout.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[PromptSnapshot] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def peek(self) -> Optional[PromptSnapshot]:
+        """The current snapshot if one is loaded, without touching the database."""
+        return self._snapshot
+
+    def snapshot(self, db: Optional[Session] = None) -> PromptSnapshot:
+        current = self._snapshot
+        if current is not None:
+            return current
+
+        with self._lock:
+            generation = self._generation
+        own_session = db is None
+        db = db or database.SessionLocal()
+        try:
+            rows = db.query(models.Prompt).all()
+        finally:
+            if own_session:
+                db.close()
+        snapshot = PromptSnapshot(
+            generation=generation,
+            prompts=MappingProxyType({
+                row.prompt_type: PromptEntry(row.prompt_type, row.content, row.version or 1) for row in rows
+            }),
+        )
+        with self._lock:
+            # An invalidation while we were loading means these rows may be stale: don't publish them.
+            if self._generation == generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+# One per tenant: each mailbox has its own prompts table.
+prompt_registry = tenants.TenantLocal(lambda tenant: PromptRegistry())
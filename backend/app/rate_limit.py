@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests-per-minute and tokens-per-minute.
+    A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, window: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._events = deque()  # [timestamp, tokens]
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def try_acquire(self, tokens: int):
+        """Returns (ticket, None) when the request fits, else (None, seconds to wait)."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            requests_ok = not self.rpm or len(self._events) < self.rpm
+            # A single request larger than the whole budget is let through on an empty window.
+            tokens_ok = (
+                not self.tpm
+                or not self._events
+                or self._tokens_in_window + tokens <= self.tpm
+            )
+            if requests_ok and tokens_ok:
+                ticket = [now, tokens]
+                self._events.append(ticket)
+                self._tokens_in_window += tokens
+                return ticket, None
+            return None, max(self._events[0][0] + self.window - now, 0.05)
+
+    def acquire(self, tokens: int = 0):
+        """Blocks until a request of `tokens` fits in the window. Returns a ticket for settle()."""
+        while True:
+            ticket, wait = self.try_acquire(tokens)
+            if ticket is not None:
+                return ticket
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0):
+        """acquire() for the event loop: waits with asyncio.sleep instead of blocking a thread."""
+        while True:
+            ticket, wait = self.try_acquire(tokens)
+            if ticket is not None:
+                return ticket
+            await asyncio.sleep(wait)
+
+    def settle(self, ticket, actual_tokens: int):
+        """Replaces the estimated token count of a ticket with the real usage."""
+        with self._lock:
+            if any(event is ticket for event in self._events):
+                self._tokens_in_window += actual_tokens - ticket[1]
+            ticket[1] = actual_tokens
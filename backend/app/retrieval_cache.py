@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from . import tenants
+
+
+def normalize_query(text: str) -> str:
+    """Whitespace variants of a query share one cache entry; case is kept, embeddings see it."""
+    return " ".join(text.split())
+
+
+class TTLCache:
+    """In-memory LRU whose entries also expire `ttl` seconds after they were stored."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at < now:
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Keeps recent query embeddings in memory, so a repeated chat or compose query skips the
+    embedding call. Query vectors depend only on the model, not on the index. Documents pass through.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: TTLCache):
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            # Embed the key itself, so the cached vector is exactly the one for every query it serves.
+            vector = self.underlying.embed_query(key)
+            self.cache.put(key, vector)
+        return vector
+
+
+class IndexGeneration:
+    """
+    Counter bumped whenever searchable content changes (vector writes, resets, deleted emails).
+    Result cache keys include it, so older entries simply stop matching and age out.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+
+
+query_embedding_cache = TTLCache(
+    max_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600")),
+)
+retrieval_result_cache = TTLCache(
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+)
+# Per tenant, like the index it describes; result cache keys carry the tenant as well.
+index_generation = tenants.TenantLocal(lambda tenant: IndexGeneration())
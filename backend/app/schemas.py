@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -11,6 +11,7 @@ class PromptCreate(PromptBase):
 
 class PromptResponse(PromptBase):
     id: int
+    version: int = 1
     class Config:
         from_attributes = True
 
@@ -19,16 +20,37 @@ class EmailBase(BaseModel):
     subject: str
     body: str
 
+class EmailSummary(BaseModel):
+    """Inbox list row: headers only, no body or agent output."""
+    id: int
+    sender: str
+    subject: str
+    timestamp: datetime
+    category: str
+    is_read: bool = False
+
+    class Config:
+        from_attributes = True
+
 class EmailResponse(EmailBase):
     id: int
     timestamp: datetime
     category: str
+    is_read: bool = False
     action_items: Optional[Dict[str, Any]] = {} 
     suggested_reply: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+class SearchHit(BaseModel):
+    email_id: int
+    sender: Optional[str] = None
+    category: Optional[str] = None
+    timestamp: Optional[str] = None
+    snippet: str
+    score: float
+
 class DraftBase(BaseModel):
     recipient: str
     subject: str
@@ -46,4 +68,11 @@ class DraftResponse(DraftBase):
 class GenerateRequest(BaseModel):
     recipient: str
     subject: str
-    instructions: str
\ No newline at end of file
+    instructions: str
+
+class TriageResult(BaseModel):
+    """Structured reply expected from the fused (single-call) triage mode."""
+    category: str = Field(min_length=1)
+    tasks: List[str] = []
+    suggestions: List[str] = []
+    draft: str
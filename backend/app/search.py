@@ -0,0 +1,225 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Literal, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from . import database
+
+RetrievalMode = Literal["hybrid", "vector", "lexical"]
+RRF_K = 60  # standard Reciprocal Rank Fusion damping constant
+# bm25() column weights, in FTS column order: sender, subject, body
+BM25_WEIGHTS = (2.0, 3.0, 1.0)
+# How SQLAlchemy stores DateTime in SQLite; raw SQL comparisons must use the same text form.
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# External-content FTS5 table over `emails`: the index stores only tokens, rows come from `emails`.
+# Triggers keep it in step with every insert, update and delete.
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+        sender, subject, body, content='emails', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_ai AFTER INSERT ON emails BEGIN
+        INSERT INTO emails_fts(rowid, sender, subject, body) VALUES (new.id, new.sender, new.subject, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_ad AFTER DELETE ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, sender, subject, body) VALUES ('delete', old.id, old.sender, old.subject, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_au AFTER UPDATE OF sender, subject, body ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, sender, subject, body) VALUES ('delete', old.id, old.sender, old.subject, old.body);
+        INSERT INTO emails_fts(rowid, sender, subject, body) VALUES (new.id, new.sender, new.subject, new.body);
+    END""",
+]
+
+# Postgres: a GIN expression index over a weighted tsvector (subject A, sender B, body D),
+# mirroring BM25_WEIGHTS. Queries must repeat the exact expression to use the index.
+PG_TSVECTOR = (
+    "setweight(to_tsvector('english', coalesce(subject, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(sender, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(body, '')), 'D')"
+)
+PG_FTS_DDL = f"CREATE INDEX IF NOT EXISTS ix_emails_fts ON emails USING GIN (({PG_TSVECTOR}))"
+
+
+def create_fts_index(connection: Connection):
+    """Creates the full-text index if missing; a new SQLite FTS table is filled from `emails`."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(PG_FTS_DDL))
+        return
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails_fts'")
+    ).first()
+    for statement in FTS_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text("INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')"))
+
+
+def drop_fts_index(connection: Connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("DROP INDEX IF EXISTS ix_emails_fts"))
+    else:
+        connection.execute(text("DROP TABLE IF EXISTS emails_fts"))
+
+
+@dataclass
+class SearchFilters:
+    sender: Optional[str] = None
+    category: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    exclude_email_id: Optional[int] = None
+
+    def vector_where(self) -> Optional[Dict]:
+        """Chroma-style metadata filter (dates compare on the numeric `ts` metadata field)."""
+        conditions = []
+        if self.sender is not None:
+            conditions.append({"sender": self.sender})
+        if self.category is not None:
+            conditions.append({"category": self.category})
+        if self.date_from is not None:
+            conditions.append({"ts": {"$gte": self.date_from.timestamp()}})
+        if self.date_to is not None:
+            conditions.append({"ts": {"$lte": self.date_to.timestamp()}})
+        if self.exclude_email_id is not None:
+            conditions.append({"email_id": {"$ne": self.exclude_email_id}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _terms(query: str) -> List[str]:
+    return list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+
+
+def fts_query(query: str) -> str:
+    """Free text to an FTS5 OR-query of quoted terms, so user input never hits the FTS syntax."""
+    return " OR ".join(f'"{term}"' for term in _terms(query))
+
+
+def tsquery(query: str) -> str:
+    """Free text to a Postgres to_tsquery OR-expression; \\w+ terms carry no tsquery operators."""
+    return " | ".join(_terms(query))
+
+
+def lexical_search(query: str, k: int = 5, filters: Optional[SearchFilters] = None,
+                   db=None) -> List[Tuple[Document, float]]:
+    """
+    Full-text search over sender, subject and body. Returns (document, score) pairs, best first,
+    where higher is better: the negated bm25() value on SQLite, ts_rank on Postgres.
+    """
+    filters = filters or SearchFilters()
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        postgres = db.get_bind().dialect.name == "postgresql"
+        match = tsquery(query) if postgres else fts_query(query)
+        if not match:
+            return []
+        clauses = []
+        params = {"match": match, "k": k}
+        if filters.sender is not None:
+            clauses.append("e.sender = :sender")
+            params["sender"] = filters.sender
+        if filters.category is not None:
+            clauses.append("e.category = :category")
+            params["category"] = filters.category
+        # Postgres compares real timestamps; SQLite compares the text SQLAlchemy stored.
+        if filters.date_from is not None:
+            clauses.append("e.timestamp >= :date_from")
+            params["date_from"] = filters.date_from if postgres else filters.date_from.strftime(SQLITE_DATETIME_FORMAT)
+        if filters.date_to is not None:
+            clauses.append("e.timestamp <= :date_to")
+            params["date_to"] = filters.date_to if postgres else filters.date_to.strftime(SQLITE_DATETIME_FORMAT)
+        if filters.exclude_email_id is not None:
+            clauses.append("e.id != :exclude_email_id")
+            params["exclude_email_id"] = filters.exclude_email_id
+
+        columns = "e.id, e.sender, e.subject, e.body, e.category, e.timestamp"
+        if postgres:
+            where = " AND ".join([f"({PG_TSVECTOR}) @@ to_tsquery('english', :match)"] + clauses)
+            sql = text(
+                f"SELECT {columns}, ts_rank(({PG_TSVECTOR}), to_tsquery('english', :match)) AS score "
+                f"FROM emails e WHERE {where} ORDER BY score DESC LIMIT :k"
+            )
+        else:
+            weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+            where = " AND ".join(["emails_fts MATCH :match"] + clauses)
+            sql = text(
+                f"SELECT {columns}, -bm25(emails_fts, {weights}) AS score "
+                f"FROM emails_fts JOIN emails e ON e.id = emails_fts.rowid "
+                f"WHERE {where} ORDER BY score DESC LIMIT :k"
+            )
+        rows = db.execute(sql, params).all()
+    finally:
+        if own_session:
+            db.close()
+
+    return [
+        (Document(
+            page_content=f"From: {row.sender}\nSubject: {row.subject}\nBody: {row.body}",
+            metadata={"email_id": row.id, "category": row.category, "sender": row.sender,
+                      "timestamp": str(row.timestamp)},
+        ), row.score)
+        for row in rows
+    ]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Document]], k: int) -> List[Tuple[Document, float]]:
+    """
+    Fuses ranked lists by email_id: score = sum of 1 / (RRF_K + rank) over the lists.
+    Each email is represented by its document from the first list that has it.
+    """
+    scores: Dict[int, float] = {}
+    docs: Dict[int, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            email_id = doc.metadata.get("email_id")
+            scores[email_id] = scores.get(email_id, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(email_id, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [(docs[email_id], scores[email_id]) for email_id in best]
+
+
+def chunk_text(text: str, size: int, overlap: int) -> List[str]:
+    """
+    Splits `text` into pieces of at most `size` characters, each starting about `overlap`
+    characters before the previous one ended. Cuts prefer paragraph, then sentence, then word breaks.
+    """
+    if len(text) <= size:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            for separator in ("\n\n", ". ", "\n", " "):
+                cut = text.rfind(separator, start + size // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return [chunk for chunk in chunks if chunk]
+
+
+def collapse_by_email(results: Sequence[Tuple[Document, float]], k: int) -> List[Tuple[Document, float]]:
+    """Keeps the best chunk of each email from best-first (document, score) pairs, up to `k` emails."""
+    seen = set()
+    collapsed = []
+    for doc, score in results:
+        email_id = doc.metadata.get("email_id")
+        if email_id in seen:
+            continue
+        seen.add(email_id)
+        collapsed.append((doc, score))
+        if len(collapsed) == k:
+            break
+    return collapsed
@@ -0,0 +1,255 @@
+"""
+Seed snapshot for /reset-db: the mock inbox with its top emails already triaged.
+
+Building it costs a full reset (mock inserts, embeddings, LLM calls for the top emails).
+Restoring copies the saved database over the live one with the SQLite backup API and writes
+the saved vectors back into the index, so the two always come from the same build, in
+milliseconds and without API calls. The snapshot is keyed by a fingerprint of what shapes it
+(mock data, default prompts, schema version, models, chunking) and rebuilt only when that
+changes. Timestamps are shifted on restore, so the inbox looks as fresh as a rebuilt one.
+
+    python -m app.seed build | status
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from filelock import FileLock
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from . import agent, database, migrations, models
+from .batch import process_emails_concurrently
+from .mock_data import get_mock_emails
+from .preclassifier import preclassifier
+from .prompt_registry import prompt_registry
+from .retrieval_cache import index_generation
+from .vectorstore import EMBEDDING_BACKEND, HASHING_EMBEDDING_DIM, export_vectors, import_vectors
+
+SEED_SNAPSHOT_ENABLED = os.getenv("SEED_SNAPSHOT_ENABLED", "1") == "1"
+SEED_SNAPSHOT_DIR = os.getenv("SEED_SNAPSHOT_DIR", "./seed_snapshot")
+SEED_TOP_EMAILS = 3  # emails triaged during a reset
+
+DEFAULT_PROMPTS = [
+    {"prompt_type": "categorize", "content": "Categorize the following email into: 'Work', 'Personal', 'Spam', 'Newsletter', 'Urgent'. Return only the single category name."},
+    {"prompt_type": "extract_actions", "content": "Extract specific action items (tasks) and soft suggestions (follow-ups) from the email."},
+    {"prompt_type": "auto_reply", "content": "You are a professional assistant. Draft a concise, polite reply."}
+]
+
+
+_lock = threading.Lock()
+
+
+def _path(name: str) -> str:
+    return os.path.join(SEED_SNAPSHOT_DIR, name)
+
+
+@contextmanager
+def _locked():
+    """
+    The snapshot is shared by every tenant, api worker and the CLI: swapping a new one in and
+    reading it back are serialized by a thread lock plus a lock file next to the directory.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(SEED_SNAPSHOT_DIR)), exist_ok=True)
+    with _lock, FileLock(os.path.abspath(SEED_SNAPSHOT_DIR) + ".lock"):
+        yield
+
+
+def fingerprint() -> str:
+    """Hash of every input the snapshot depends on. Mock timestamps count as offsets from the newest."""
+    emails = get_mock_emails()
+    newest = max(e["timestamp"] for e in emails)
+    payload = {
+        "emails": [[e["sender"], e["subject"], e["body"], (newest - e["timestamp"]).total_seconds()] for e in emails],
+        "prompts": DEFAULT_PROMPTS,
+        "top_emails": SEED_TOP_EMAILS,
+        "schema": migrations.MIGRATIONS[-1][0],
+        "llm": agent.llm_gateway.model_name,
+        "embeddings": [EMBEDDING_BACKEND, HASHING_EMBEDDING_DIM],
+        "chunks": [agent.RAG_CHUNK_CHARS, agent.RAG_CHUNK_OVERLAP],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def manifest() -> Optional[Dict]:
+    try:
+        with open(_path("manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _available() -> bool:
+    # The backup API is SQLite's; Postgres deployments always rebuild.
+    return SEED_SNAPSHOT_ENABLED and database.is_sqlite(database.engine)
+
+
+def populate(db: Session) -> List[int]:
+    """Inserts the default prompts and the mock inbox and indexes it; returns the ids to triage."""
+    for p in DEFAULT_PROMPTS:
+        db.add(models.Prompt(prompt_type=p["prompt_type"], content=p["content"]))
+    db.commit()
+    prompt_registry.invalidate()
+    preclassifier.reset()
+
+    created_emails = [
+        models.Email(sender=e["sender"], subject=e["subject"], body=e["body"],
+                     timestamp=e["timestamp"], category="Uncategorized")
+        for e in get_mock_emails()
+    ]
+    db.add_all(created_emails)
+    db.commit()
+
+    agent.ingest_emails(created_emails)
+    return [email.id for email in created_emails[:SEED_TOP_EMAILS]]
+
+
+def save() -> bool:
+    """
+    Snapshots the live database and vector index into a private directory next to the
+    snapshot, then swaps it in under the lock.
+    """
+    if not _available():
+        return False
+    started = time.perf_counter()
+    agent.ingestion_buffer.flush()
+    parent = os.path.dirname(os.path.abspath(SEED_SNAPSHOT_DIR))
+    os.makedirs(parent, exist_ok=True)
+    building = tempfile.mkdtemp(dir=parent, prefix=".seed_snapshot-")
+    try:
+        _write(building)
+        with _locked():
+            saved = manifest()
+            if saved is not None and saved.get("fingerprint") == fingerprint():
+                print("Seed snapshot already current (saved by a concurrent reset)")
+                return True
+            previous = None
+            if os.path.exists(SEED_SNAPSHOT_DIR):
+                previous = tempfile.mkdtemp(dir=parent, prefix=".seed_snapshot-old-")
+                os.replace(SEED_SNAPSHOT_DIR, os.path.join(previous, "snapshot"))
+            os.replace(building, SEED_SNAPSHOT_DIR)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    print(f"Seed snapshot saved in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return True
+
+
+def _write(building: str):
+    """Writes the snapshot files into `building`; the manifest goes last."""
+    target = sqlite3.connect(os.path.join(building, "app.db"))
+    source = database.engine.raw_connection()
+    try:
+        source.driver_connection.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+    ids, vectors, texts, metadatas = export_vectors(agent.vector_store)
+    np.save(os.path.join(building, "vectors.npy"), vectors)
+    with open(os.path.join(building, "vectors.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f)
+    with open(os.path.join(building, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint(), "built_at": datetime.utcnow().isoformat(),
+                   "vectors": len(ids)}, f)
+
+
+def _shift_timestamps(db: Session, built_at: datetime) -> Dict[int, datetime]:
+    """Moves every email forward by the snapshot's age; returns the new timestamps by id."""
+    delta = datetime.utcnow() - built_at
+    shifted = {row.id: row.timestamp + delta for row in db.execute(select(models.Email.id, models.Email.timestamp))
+               if row.timestamp is not None}
+    if shifted:
+        db.execute(update(models.Email), [{"id": email_id, "timestamp": ts} for email_id, ts in shifted.items()])
+        db.commit()
+    return shifted
+
+
+def restore() -> bool:
+    """Restores the snapshot if it matches the current fingerprint; False means a rebuild is needed."""
+    if not _available():
+        return False
+    started = time.perf_counter()
+    # Everything read from the snapshot is read under the lock, so a concurrent save can't
+    # swap the files out halfway.
+    with _locked():
+        saved = manifest()
+        if saved is None or saved.get("fingerprint") != fingerprint():
+            return False
+        source = sqlite3.connect(_path("app.db"))
+        target = database.engine.raw_connection()
+        try:
+            source.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        with open(_path("vectors.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        vectors = np.load(_path("vectors.npy"))
+
+    db = database.SessionLocal()
+    try:
+        shifted = _shift_timestamps(db, datetime.fromisoformat(saved["built_at"]))
+    finally:
+        db.close()
+
+    for metadata in records["metadatas"]:
+        ts = shifted.get(metadata.get("email_id"))
+        if ts is not None:
+            metadata.update(timestamp=str(ts), ts=ts.timestamp())
+    agent.clear_vector_db()
+    import_vectors(agent.vector_store, records["ids"], vectors, records["texts"], records["metadatas"])
+    index_generation.bump()
+
+    prompt_registry.invalidate()
+    preclassifier.reset()
+    print(f"Seed snapshot restored in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return True
+
+
+def rebuild():
+    """Full reset: fresh schema and index, mock inbox, top emails triaged, then a new snapshot."""
+    migrations.reset()
+    agent.clear_vector_db()
+    db = database.SessionLocal()
+    try:
+        top_ids = populate(db)
+    finally:
+        db.close()
+    print(f"Processing {len(top_ids)} mock emails...")
+    result = process_emails_concurrently(top_ids)
+    # Never snapshot a half-triaged inbox (e.g. LLM errors): the next reset retries instead.
+    if result["failed"]:
+        print(f"Seed snapshot skipped: {result['failed']} emails failed to process")
+        return
+    save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "status"])
+    args = parser.parse_args()
+    if args.command == "build":
+        rebuild()
+    saved = manifest()
+    current = fingerprint()
+    if saved is None:
+        print("No seed snapshot")
+    else:
+        state = "current" if saved["fingerprint"] == current else "stale"
+        print(f"Seed snapshot built {saved['built_at']} ({saved['vectors']} vectors): {state}")
+
+
+if __name__ == "__main__":
+    main()
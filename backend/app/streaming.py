@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import AsyncIterable, Awaitable, Callable, Optional
+
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+class TTFTStats:
+    """Rolling window of time-to-first-token and total stream durations, per endpoint."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, ttft_ms: Optional[float], total_ms: float):
+        with self._lock:
+            samples = self._samples.setdefault(endpoint, {"ttft_ms": deque(maxlen=self.window),
+                                                          "total_ms": deque(maxlen=self.window),
+                                                          "count": 0})
+            samples["count"] += 1
+            if ttft_ms is not None:
+                samples["ttft_ms"].append(ttft_ms)
+            samples["total_ms"].append(total_ms)
+
+    @staticmethod
+    def _percentile(values, pct: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(pct * len(ordered)))], 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": samples["count"],
+                    "ttft_p50_ms": self._percentile(samples["ttft_ms"], 0.50),
+                    "ttft_p95_ms": self._percentile(samples["ttft_ms"], 0.95),
+                    "total_p50_ms": self._percentile(samples["total_ms"], 0.50),
+                    "total_p95_ms": self._percentile(samples["total_ms"], 0.95),
+                }
+                for endpoint, samples in self._samples.items()
+            }
+
+
+ttft_stats = TTFTStats()
+
+
+async def sse_token_stream(endpoint: str, tokens: AsyncIterable[str], started: float,
+                           on_complete: Optional[Callable[[str], Awaitable[dict]]] = None,
+                           extra: Optional[dict] = None):
+    """
+    Wraps a token generator as Server-Sent Events: one `{"token": ...}` event per chunk, then a
+    final `{"done": true, ...}` event with timings. `started` is the request start, so TTFT
+    includes retrieval. `on_complete` receives the full text and may add fields to the final event,
+    as does `extra` (e.g. the context token report).
+    """
+    ttft_ms = None
+    parts = []
+    try:
+        async for token in tokens:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            parts.append(token)
+            yield sse_event({"token": token})
+    except Exception as e:
+        print(f"Streaming error on {endpoint}: {e}")
+        yield sse_event({"error": str(e)})
+        return
+
+    text = "".join(parts).strip()
+    final = {"done": True, **(extra or {})}
+    if on_complete:
+        final.update(await on_complete(text))
+    total_ms = (time.perf_counter() - started) * 1000
+    ttft_stats.record(endpoint, ttft_ms, total_ms)
+    final["ttft_ms"] = round(ttft_ms, 1) if ttft_ms is not None else None
+    final["total_ms"] = round(total_ms, 1)
+    yield sse_event(final)
@@ -0,0 +1,214 @@
+"""
+Per-user mailboxes: each tenant gets its own database, vector collection and in-memory state.
+
+The tenant of a request comes from the X-User-Id header (no header: the "default" mailbox,
+i.e. the original single-user files) and is carried in a context variable, so module-level
+singletons such as `database.SessionLocal` or `agent.vector_store` resolve to the current
+tenant's instance. Open tenants are kept in a bounded LRU: the least recently used and idle
+ones are closed (engines disposed, pending vectors flushed, memory released) and reopened
+transparently on their next request.
+"""
+import asyncio
+import hashlib
+import inspect
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from . import metrics
+
+DEFAULT_TENANT = "default"
+# Open tenants kept before the least recently used idle one is closed.
+TENANT_MAX_OPEN = int(os.getenv("TENANT_MAX_OPEN", "64"))
+# Tenants unused for this long are closed by the periodic sweep.
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "900"))
+TENANT_SWEEP_SECONDS = float(os.getenv("TENANT_SWEEP_SECONDS", "60"))
+
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+_SLUG = re.compile(r"[^a-z0-9]+")
+
+
+def tenant_key(user_id: Optional[str]) -> str:
+    """
+    Stable, filesystem- and collection-safe key for a user id: a readable slug plus a hash
+    of the exact id, so distinct users never share a mailbox.
+    """
+    exact = (user_id or "").strip()
+    if not exact:
+        return DEFAULT_TENANT
+    # Ids are case-sensitive: only the slug is lowercased, "Alice" and "alice" hash apart.
+    slug = _SLUG.sub("-", exact.lower()).strip("-")[:40]
+    digest = hashlib.sha256(exact.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}" if slug else digest
+
+
+class TenantLocal:
+    """
+    One `factory(tenant)` instance per tenant, created on first use. Unknown attributes are
+    forwarded to the current tenant's instance, so a module-level singleton keeps its call
+    sites. `close(instance)` runs when the tenant is evicted; it may return an awaitable.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], close: Optional[Callable[[Any], Any]] = None):
+        self._factory = factory
+        self._close = close
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        _locals.append(self)
+
+    def current(self) -> Any:
+        tenant = current_tenant.get()
+        instance = self._instances.get(tenant)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(tenant)
+                if instance is None:
+                    instance = self._factory(tenant)
+                    self._instances[tenant] = instance
+        return instance
+
+    def forget(self):
+        """Drops the current tenant's instance without closing it; the next access builds a new one."""
+        self._instances.pop(current_tenant.get(), None)
+
+    def discard(self, tenant: str) -> Any:
+        instance = self._instances.pop(tenant, None)
+        if instance is not None and self._close is not None:
+            return self._close(instance)
+        return None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.current(), name)
+
+
+# In creation order; eviction closes them in reverse, so e.g. the vector buffer is flushed
+# while the tenant's vector store and database are still open.
+_locals: List[TenantLocal] = []
+
+
+@contextmanager
+def activate(tenant: str):
+    """Runs a block as `tenant` (no LRU bookkeeping)."""
+    token = current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        current_tenant.reset(token)
+
+
+@contextmanager
+def use(tenant: str):
+    """Runs a block as `tenant`, keeping it open (never evicted) until the block ends."""
+    registry.acquire(tenant)
+    try:
+        with activate(tenant):
+            yield tenant
+    finally:
+        registry.release(tenant)
+
+
+class TenantRegistry:
+    """LRU of open tenants with in-use counts; only idle, unused tenants are evicted."""
+
+    def __init__(self, max_open: int = TENANT_MAX_OPEN, idle_seconds: float = TENANT_IDLE_SECONDS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._open: "OrderedDict[str, float]" = OrderedDict()  # tenant -> last used, oldest first
+        self._users: Counter = Counter()
+        self._lock = threading.Lock()
+        self._on_open: List[Callable[[str], None]] = []
+        self._on_close: List[Callable[[str], None]] = []
+        self.stats = {"opened": 0, "evicted_idle": 0, "evicted_lru": 0}
+
+    def on_open(self, callback: Callable[[str], None]):
+        """`callback(tenant)` runs, as that tenant, when it is opened (again)."""
+        self._on_open.append(callback)
+
+    def on_close(self, callback: Callable[[str], None]):
+        self._on_close.append(callback)
+
+    def acquire(self, tenant: str):
+        with self._lock:
+            opened = tenant not in self._open
+            self._open[tenant] = time.monotonic()
+            self._open.move_to_end(tenant)
+            self._users[tenant] += 1
+            if opened:
+                self.stats["opened"] += 1
+        if opened:
+            with activate(tenant):
+                for callback in self._on_open:
+                    callback(tenant)
+
+    def release(self, tenant: str):
+        with self._lock:
+            self._users[tenant] -= 1
+            if self._users[tenant] <= 0:
+                del self._users[tenant]
+            if tenant in self._open:
+                self._open[tenant] = time.monotonic()
+
+    def _victims(self, idle_only: bool) -> List[str]:
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            excess = 0 if idle_only else len(self._open) - self.max_open
+            for tenant, last_used in list(self._open.items()):
+                if tenant == DEFAULT_TENANT or self._users[tenant] > 0:
+                    continue
+                idle = now - last_used >= self.idle_seconds
+                if not idle and excess <= 0:
+                    continue
+                del self._open[tenant]
+                victims.append(tenant)
+                excess -= 1
+                self.stats["evicted_idle" if idle else "evicted_lru"] += 1
+                metrics.TENANT_EVICTIONS.inc(reason="idle" if idle else "lru")
+        return victims
+
+    def _close(self, tenant: str) -> List[Any]:
+        pending = []
+        with activate(tenant):
+            for callback in self._on_close:
+                callback(tenant)
+            for local in reversed(_locals):
+                try:
+                    result = local.discard(tenant)
+                except Exception as e:
+                    print(f"Closing tenant {tenant}: {e}")
+                    continue
+                if inspect.isawaitable(result):
+                    pending.append(result)
+        return pending
+
+    async def evict(self, idle_only: bool = False) -> List[str]:
+        """Closes idle tenants, and unused ones beyond `max_open` unless `idle_only`."""
+        victims = self._victims(idle_only)
+        for tenant in victims:
+            for awaitable in await asyncio.to_thread(self._close, tenant):
+                await awaitable
+        return victims
+
+    async def sweep_forever(self, interval: float = TENANT_SWEEP_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict(idle_only=True)
+            except Exception as e:
+                print(f"Tenant sweep failed: {e}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "open": len(self._open), "in_use": len(self._users),
+                    "max_open": self.max_open, "idle_seconds": self.idle_seconds}
+
+
+registry = TenantRegistry()
+metrics.CallbackMetric("tenants_open", "Tenants with open databases and vector stores.", "gauge", [],
+                       lambda: {(): registry.snapshot()["open"]})
@@ -0,0 +1,337 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from . import metrics, tenants
+from .embedding_cache import CachedEmbeddings
+from .retrieval_cache import CachedQueryEmbeddings, query_embedding_cache
+
+# "openai" (remote, cached in cache.db) or "hashing" (deterministic, in-process, offline)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+# "chroma" or "local" (memory-mapped NumPy matrix)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "512"))
+VECTOR_DB_PATH = "./chroma_db"
+LOCAL_INDEX_PATH = "./vector_index"
+COLLECTION_NAME = "email_inbox"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._@'-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic feature-hashing embedder: unigrams and bigrams hashed into `dim` signed
+    buckets with sublinear term frequency, L2-normalised. No model, no network.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, (1.0 if (value >> 63) & 1 else -1.0)
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = tokenize(text)
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in features.items():
+            index, sign = self._bucket(feature)
+            vector[index] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+_COMPARISONS = {
+    "$ne": lambda value, operand: value != operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+}
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Chroma-style metadata filter: equality, $ne/$gte/$lte/$in per key, and $and of sub-filters."""
+    if not where:
+        return True
+    for key, expected in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, condition) for condition in expected):
+                return False
+        elif isinstance(expected, dict):
+            if not all(_COMPARISONS[op](metadata.get(key), operand) for op, operand in expected.items()):
+                return False
+        elif metadata.get(key) != expected:
+            return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector index: a float32 matrix in a memory-mapped `vectors.npy` plus an
+    `ids.json` sidecar (id, text and metadata per row). Rows are preallocated and grown by
+    doubling, so appends and upserts write in place. Vectors are normalised on write and
+    search is a single matrix-vector product.
+    """
+
+    def __init__(self, embedding_function: Embeddings, persist_directory: str, collection_name: str,
+                 initial_capacity: int = 1024):
+        self._embedding = embedding_function
+        self.path = os.path.join(persist_directory, collection_name)
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.path, "vectors.npy")
+
+    @property
+    def _ids_path(self) -> str:
+        return os.path.join(self.path, "ids.json")
+
+    def _load(self):
+        self._matrix = None
+        self._records: List[Dict[str, Any]] = []
+        if os.path.exists(self._ids_path) and os.path.exists(self._matrix_path):
+            with open(self._ids_path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+            self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+        self._rows = {record["id"]: row for row, record in enumerate(self._records)}
+
+    def _save_ids(self):
+        tmp_path = self._ids_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._records, f)
+        os.replace(tmp_path, self._ids_path)
+
+    def _ensure_capacity(self, rows: int, dim: int):
+        if self._matrix is not None and self._matrix.shape[0] >= rows:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        capacity = max(rows, self.initial_capacity)
+        if self._matrix is not None:
+            capacity = max(capacity, self._matrix.shape[0] * 2)
+        tmp_path = self._matrix_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self._matrix is not None:
+            count = len(self._records)
+            grown[:count] = self._matrix[:count]
+        grown.flush()
+        del grown
+        self._matrix = None
+        os.replace(tmp_path, self._matrix_path)
+        self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        return self.add_vectors(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def add_vectors(self, texts: List[str], vectors, metadatas: List[dict], ids: List[str]) -> List[str]:
+        """Stores precomputed embeddings (upsert by id)."""
+        vectors = np.array(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+
+        with self._lock:
+            new_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self._rows]
+            self._ensure_capacity(len(self._records) + len(new_ids), vectors.shape[1])
+            for text, metadata, doc_id, vector in zip(texts, metadatas, ids, vectors):
+                record = {"id": doc_id, "page_content": text, "metadata": metadata}
+                row = self._rows.get(doc_id)
+                if row is None:
+                    row = len(self._records)
+                    self._rows[doc_id] = row
+                    self._records.append(record)
+                else:
+                    self._records[row] = record
+                self._matrix[row] = vector
+            self._matrix.flush()
+            self._save_ids()
+        return ids
+
+    def export_vectors(self, where: Optional[Dict[str, Any]] = None
+                       ) -> Tuple[List[str], np.ndarray, List[str], List[dict]]:
+        """(ids, vectors, texts, metadatas) of every row, or of the rows matching `where`."""
+        with self._lock:
+            rows = [row for row, r in enumerate(self._records) if _matches(r["metadata"], where)]
+            vectors = np.array(self._matrix[rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+            records = [self._records[row] for row in rows]
+            return ([r["id"] for r in records], vectors,
+                    [r["page_content"] for r in records], [r["metadata"] for r in records])
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Swap-remove: the last row moves into the freed slot, so the matrix stays dense."""
+        with self._lock:
+            for doc_id in ids or []:
+                row = self._rows.pop(doc_id, None)
+                if row is None:
+                    continue
+                last = len(self._records) - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._records[row] = self._records[last]
+                    self._rows[self._records[row]["id"]] = row
+                self._records.pop()
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._save_ids()
+        return True
+
+    def delete_collection(self):
+        with self._lock:
+            self._matrix = None
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._load()
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            count = len(self._records)
+            if count == 0:
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+            scores = self._matrix[:count] @ query
+            if filter:
+                mask = np.fromiter((_matches(r["metadata"], filter) for r in self._records), dtype=bool, count=count)
+                scores = np.where(mask, scores, -np.inf)
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (Document(page_content=self._records[row]["page_content"], metadata=self._records[row]["metadata"]),
+                 float(scores[row]))
+                for row in top if np.isfinite(scores[row])
+            ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = LOCAL_INDEX_PATH,
+                   collection_name: str = COLLECTION_NAME, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding, persist_directory, collection_name)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+
+def export_vectors(store: VectorStore, where: Optional[Dict[str, Any]] = None
+                   ) -> Tuple[List[str], np.ndarray, List[str], List[dict]]:
+    """Stored (id, vector, text, metadata) rows, as columns, for either backend. `where` filters on metadata."""
+    if hasattr(store, "export_vectors"):
+        return store.export_vectors(where)
+    data = store._collection.get(where=where, include=["embeddings", "documents", "metadatas"])
+    return (list(data["ids"]), np.asarray(data["embeddings"], dtype=np.float32),
+            list(data["documents"]), list(data["metadatas"]))
+
+
+def import_vectors(store: VectorStore, ids: List[str], vectors, texts: List[str], metadatas: List[dict]):
+    """Writes exported rows back without calling the embedding model."""
+    if not ids:
+        return
+    if hasattr(store, "add_vectors"):
+        store.add_vectors(texts, vectors, metadatas, ids)
+    else:
+        store._collection.upsert(ids=ids, embeddings=np.asarray(vectors).tolist(), documents=texts,
+                                 metadatas=metadatas)
+
+
+def delete_vectors(store: VectorStore, where: Dict[str, Any]):
+    """Deletes every row whose metadata matches `where`, for either backend."""
+    if hasattr(store, "export_vectors"):
+        store.delete(store.export_vectors(where)[0])
+    else:
+        store._collection.delete(where=where)
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Records model latency and text counts; sits under the caches so only real calls are counted."""
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        metrics.EMBEDDING_TEXTS.inc(len(texts), operation="documents")
+        with metrics.span("embedding.documents", metrics.EMBEDDING_SECONDS, operation="documents"):
+            return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        metrics.EMBEDDING_TEXTS.inc(operation="query")
+        with metrics.span("embedding.query", metrics.EMBEDDING_SECONDS, operation="query"):
+            return self.underlying.embed_query(text)
+
+
+def build_embeddings() -> Embeddings:
+    """Embedding backend selected by EMBEDDING_BACKEND, with query embeddings cached in memory."""
+    if EMBEDDING_BACKEND == "hashing":
+        return CachedQueryEmbeddings(InstrumentedEmbeddings(HashingEmbeddings(HASHING_EMBEDDING_DIM)),
+                                     query_embedding_cache)
+    from langchain_openai import OpenAIEmbeddings
+
+    openai_embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+    return CachedQueryEmbeddings(
+        CachedEmbeddings(InstrumentedEmbeddings(openai_embeddings), model=openai_embeddings.model),
+        query_embedding_cache,
+    )
+
+
+def tenant_collection(tenant: str) -> str:
+    """Collection of a tenant's mailbox; the default tenant keeps the original collection."""
+    return COLLECTION_NAME if tenant == tenants.DEFAULT_TENANT else f"{COLLECTION_NAME}_{tenant}"
+
+
+def build_vector_store(embedding_function: Embeddings, collection_name: str = COLLECTION_NAME) -> VectorStore:
+    """Vector index selected by VECTOR_BACKEND."""
+    if VECTOR_BACKEND == "local":
+        return NumpyVectorStore(embedding_function, LOCAL_INDEX_PATH, collection_name)
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        persist_directory=VECTOR_DB_PATH
+    )
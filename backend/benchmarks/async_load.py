@@ -0,0 +1,113 @@
+"""
+Load test: inbox reads while many chat requests are in flight, sync vs async handlers.
+
+The "sync" scenario mounts copies of the old `def` handlers (threadpool-bound, blocking
+llm.invoke); the "async" scenario uses the real routes. The LLM is a fake with a fixed
+latency and retrieval runs on the offline local index, so no keys are needed. Run from
+the backend directory:
+
+    python -m benchmarks.async_load --chats 80 --latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+
+# The app uses relative paths (sql_app.db, cache.db, vector_index): keep them out of the tree.
+sys.path.insert(0, os.getcwd())
+os.chdir(tempfile.mkdtemp(prefix="async_load_"))
+
+import httpx  # noqa: E402
+from fastapi import Depends  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import agent, database, models  # noqa: E402
+from app.main import app, get_db, ChatRequest  # noqa: E402
+
+
+class FakeLLM:
+    model_name = "load-test-fake"
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def invoke(self, messages, **kwargs):
+        time.sleep(self.latency)
+        return AIMessage(content="Work")
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return AIMessage(content="Work")
+
+
+# Copies of the pre-async handlers, for the baseline.
+@app.get("/legacy/emails/")
+def legacy_read_emails(db: Session = Depends(get_db)):
+    return [e.id for e in db.query(models.Email).order_by(models.Email.timestamp.desc()).limit(100).all()]
+
+
+@app.post("/legacy/emails/{email_id}/chat")
+def legacy_chat_email(email_id: int, chat_req: ChatRequest, db: Session = Depends(get_db)):
+    email = db.query(models.Email).filter(models.Email.id == email_id).first()
+    response_text, _ = agent.chat_with_single_email(email.body, chat_req.query, email.sender, chat_req.history)
+    return {"response": response_text}
+
+
+async def run_scenario(client, chat_path: str, read_path: str, chats: int, reads: int):
+    chat_tasks = [
+        asyncio.create_task(client.post(chat_path, json={"query": f"question {i}", "history": []}))
+        for i in range(chats)
+    ]
+    await asyncio.sleep(0.2)  # let the chats occupy the server first
+
+    read_latencies = []
+    for _ in range(reads):
+        started = time.perf_counter()
+        response = await client.get(read_path)
+        response.raise_for_status()
+        read_latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*chat_tasks)
+    return {
+        "read_p50_ms": round(statistics.median(read_latencies), 1),
+        "read_max_ms": round(max(read_latencies), 1),
+        "chats_drained_after_s": round(time.perf_counter() - started, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=80, help="Concurrent chat requests in flight.")
+    parser.add_argument("--reads", type=int, default=10, help="GET /emails/ calls measured meanwhile.")
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake LLM latency in seconds.")
+    args = parser.parse_args()
+
+    agent.llm_gateway.use_model(FakeLLM(0.0))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        (await client.post("/reset-db")).raise_for_status()
+        email_id = (await client.get("/emails/")).json()[0]["id"]
+        agent.llm_gateway.use_model(FakeLLM(args.latency))
+        agent.llm_cache.enabled = False
+
+        sync = await run_scenario(client, f"/legacy/emails/{email_id}/chat", "/legacy/emails/", args.chats, args.reads)
+        async_ = await run_scenario(client, f"/emails/{email_id}/chat", "/emails/", args.chats, args.reads)
+    await database.async_engine.dispose()  # aiosqlite connection threads would keep the process alive
+
+    print(json.dumps({"chats_in_flight": args.chats, "llm_latency_s": args.latency,
+                      "sync": sync, "async": async_}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""
+Mixed read/write load on the app database: inbox readers vs. triage writers.
+
+Reader threads page through the inbox the way GET /emails does (keyset order, optional
+category filter); writer threads update and commit single emails the way triage does. Uses
+DATABASE_URL like the app (a fresh SQLite file in a temp dir by default). Run from the
+backend directory:
+
+    python -m benchmarks.db_concurrency --readers 8 --writers 2 --duration 10
+    python -m benchmarks.db_concurrency --journal-modes DELETE WAL
+
+With --journal-modes each SQLite journal mode runs in its own process (the pragmas are
+applied when connections open) and the results are printed side by side.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+ORIGINAL_CWD = os.getcwd()
+sys.path.insert(0, ORIGINAL_CWD)
+os.chdir(tempfile.mkdtemp(prefix="benchmark_db_"))
+
+from sqlalchemy import insert, select, text, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import database, migrations, models  # noqa: E402
+from benchmarks.synthetic import synthetic_inbox  # noqa: E402
+
+PAGE_SIZE = 50
+CATEGORIES = [None, "Work", "Personal", "Newsletter", "Urgent"]
+
+
+def summarize(samples_s: List[float], errors: int, elapsed: float) -> Dict:
+    ordered = sorted(samples_s) or [0.0]
+    ms = lambda value: round(value * 1000, 3)  # noqa: E731
+    return {
+        "ops": len(samples_s),
+        "ops_per_second": round(len(samples_s) / elapsed, 1),
+        "p50_ms": ms(ordered[len(ordered) // 2]),
+        "p95_ms": ms(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]),
+        "max_ms": ms(ordered[-1]),
+        "locked_errors": errors,
+    }
+
+
+def load(count: int) -> List[int]:
+    migrations.upgrade()
+    db = database.SessionLocal()
+    try:
+        rows = []
+        for i, row in enumerate(synthetic_inbox(count)):
+            row["category"] = CATEGORIES[1 + i % (len(CATEGORIES) - 1)]
+            rows.append(row)
+        db.execute(insert(models.Email), rows)
+        db.commit()
+        return list(db.scalars(select(models.Email.id)))
+    finally:
+        db.close()
+
+
+def read_page(db, rng: random.Random):
+    query = select(models.Email.id, models.Email.sender, models.Email.subject, models.Email.timestamp)
+    category = rng.choice(CATEGORIES)
+    if category is not None:
+        query = query.where(models.Email.category == category)
+    db.execute(query.order_by(models.Email.timestamp.desc(), models.Email.id.desc()).limit(PAGE_SIZE)).all()
+
+
+def write_email(db, rng: random.Random, ids: List[int]):
+    db.execute(update(models.Email).where(models.Email.id == rng.choice(ids)).values(
+        category=rng.choice(CATEGORIES[1:]), is_read=rng.random() < 0.5,
+        action_items={"tasks": [f"task {rng.randrange(1000)}"], "suggestions": []},
+    ))
+    db.commit()
+
+
+def worker(operation, ids: List[int], deadline: float, seed: int, samples: List[float], errors: List[int]):
+    rng = random.Random(seed)
+    db = database.SessionLocal()
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if operation == "write":
+                    write_email(db, rng, ids)
+                else:
+                    read_page(db, rng)
+                db.rollback()  # end the read transaction so WAL checkpoints can proceed
+                samples.append(time.perf_counter() - started)
+            except OperationalError as e:
+                db.rollback()
+                if "locked" not in str(e):
+                    raise
+                errors[0] += 1
+    finally:
+        db.close()
+
+
+def run(emails: int, readers: int, writers: int, duration: float) -> Dict:
+    ids = load(emails)
+    with database.engine.connect() as connection:
+        journal_mode = (connection.execute(text("PRAGMA journal_mode")).scalar()
+                        if database.is_sqlite(connection) else None)
+    results = {}
+    samples = {"read": [], "write": []}
+    errors = {"read": [0], "write": [0]}
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(operation, ids, deadline, seed, samples[operation], errors[operation]))
+        for seed, operation in enumerate(["read"] * readers + ["write"] * writers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for operation in ("read", "write"):
+        results[operation] = summarize(samples[operation], errors[operation][0], elapsed)
+    return {
+        "database": database.engine.dialect.name,
+        "journal_mode": journal_mode,
+        "emails": emails,
+        "readers": readers,
+        "writers": writers,
+        "duration_s": round(elapsed, 2),
+        **results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=5000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load.")
+    parser.add_argument("--journal-modes", nargs="+", help="Run once per SQLite journal mode, e.g. DELETE WAL.")
+    args = parser.parse_args()
+
+    if not args.journal_modes:
+        print(json.dumps(run(args.emails, args.readers, args.writers, args.duration), indent=2))
+        return
+
+    results = []
+    for mode in args.journal_modes:
+        command = [sys.executable, "-m", "benchmarks.db_concurrency", "--emails", str(args.emails),
+                   "--readers", str(args.readers), "--writers", str(args.writers), "--duration", str(args.duration)]
+        output = subprocess.run(command, cwd=ORIGINAL_CWD, env={**os.environ, "SQLITE_JOURNAL_MODE": mode},
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output[output.index("{"):]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Offline stand-ins for ChatGroq and OpenAIEmbeddings, with configurable latency.
+
+Outputs are deterministic per input, so cached and uncached runs see the same text.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+CATEGORIES = ["Work", "Personal", "Newsletter", "Urgent", "Spam"]
+
+
+def _pick(text: str, options: List[str]) -> str:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest()
+    return options[int.from_bytes(digest, "little") % len(options)]
+
+
+class FakeLLM:
+    """ChatGroq stand-in: sleeps `latency` seconds per call and answers in each node's format."""
+
+    model_name = "benchmark-fake"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def _answer(self, messages) -> str:
+        system = messages[0].content
+        email = messages[-1].content
+        if "ONE JSON OBJECT" in system:  # fused triage
+            return json.dumps({
+                "category": _pick(email, CATEGORIES),
+                "tasks": ["Reply by Friday"],
+                "suggestions": ["Add the meeting to the calendar"],
+                "draft": "Thanks for the update, I'll get back to you shortly.",
+            })
+        if "JSON OBJECT" in system:  # extract_actions
+            return json.dumps({"tasks": ["Reply by Friday"], "suggestions": ["Add the meeting to the calendar"]})
+        if system.startswith("Categorize"):
+            return _pick(email, CATEGORIES)
+        return "Thanks for the update, I'll get back to you shortly."
+
+    def _usage(self, messages, content: str):
+        prompt_tokens = sum(len(m.content) for m in messages) // 4
+        return {"input_tokens": prompt_tokens, "output_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4}
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        content = self._answer(messages)
+        return AIMessage(content=content, usage_metadata=self._usage(messages, content))
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self._answer(messages)
+        return AIMessage(content=content, usage_metadata=self._usage(messages, content))
+
+    async def astream(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self._answer(messages)
+        for word in content.split(" "):
+            yield AIMessageChunk(content=word + " ")
+        yield AIMessageChunk(content="", usage_metadata=self._usage(messages, content))
+
+
+class FakeEmbeddings(Embeddings):
+    """OpenAIEmbeddings stand-in: wraps a local embedder and adds a per-request round trip."""
+
+    def __init__(self, underlying: Embeddings, latency: float = 0.0):
+        self.underlying = underlying
+        self.latency = latency
+        self.requests = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.underlying.embed_query(text)
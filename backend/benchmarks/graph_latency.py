@@ -0,0 +1,83 @@
+"""
+Latency comparison: linear vs parallel triage graph.
+
+Replaces the Groq client with a fake that sleeps for a fixed round-trip time, so the
+numbers reflect graph scheduling only. Run from the backend directory:
+
+    python -m benchmarks.graph_latency --latency 0.8 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from app import agent  # noqa: E402
+
+
+class SleepingLLM:
+    """Stands in for ChatGroq: fixed latency, canned answers per node."""
+
+    model_name = "sleeping-fake"
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        system = messages[0].content
+        if "JSON OBJECT" in system:
+            return AIMessage(content=json.dumps({"tasks": ["Reply by Friday"], "suggestions": []}))
+        if system.startswith("Categorize"):
+            return AIMessage(content="Work")
+        return AIMessage(content="Thanks, I'll take a look.")
+
+
+def _initial_state():
+    return {
+        "email_body": "Can you send me the Q3 report before Friday's review?",
+        "sender": "boss@globex-corp.com",
+        "category": "",
+        "action_items": {"tasks": [], "suggestions": []},
+        "draft": "",
+        "categorize_prompt": "Categorize the following email into: 'Work', 'Personal', 'Spam', 'Newsletter', 'Urgent'.",
+        "action_prompt": "Extract specific action items (tasks) and soft suggestions (follow-ups) from the email.",
+        "reply_prompt": "You are a professional assistant. Draft a concise, polite reply.",
+    }
+
+
+def time_graph(graph, runs: int):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        graph.invoke(_initial_state())
+        samples.append(time.perf_counter() - started)
+    return {"mean_s": round(statistics.mean(samples), 4), "min_s": round(min(samples), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM round trip in seconds.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    agent.llm_gateway.use_model(SleepingLLM(args.latency))
+    agent.llm_cache.enabled = False  # every run must pay the full round trips
+    linear = time_graph(agent.build_graph(parallel=False), args.runs)
+    parallel = time_graph(agent.build_graph(parallel=True), args.runs)
+
+    print(json.dumps({
+        "llm_latency_s": args.latency,
+        "linear": linear,
+        "parallel": parallel,
+        "saved_s": round(linear["mean_s"] - parallel["mean_s"], 4),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
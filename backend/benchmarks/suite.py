@@ -0,0 +1,277 @@
+"""
+Offline benchmark suite: triage, batch processing, reset, inbox listing and RAG retrieval.
+
+The Groq client and the embedding model are replaced by fakes with configurable latency
+(benchmarks/fakes.py) and the inbox is synthetic (benchmarks/synthetic.py), so no keys or
+network are needed and runs are comparable between versions. The LLM, embedding and
+retrieval caches are disabled so every run pays for the work it measures. Run from the
+backend directory:
+
+    python -m benchmarks.suite --sizes 1000 10000 --output results/after.json
+    python -m benchmarks.suite --sizes 1000 --baseline results/before.json
+
+Results are JSON: per inbox size, per scenario latency percentiles in milliseconds (and
+throughput where it applies). With --baseline, p50s are compared and the exit code is 1
+when a scenario got slower than --threshold times the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.environ["GROQ_RPM"] = "0"
+os.environ["GROQ_TPM"] = "0"
+
+# The app uses relative paths (sql_app.db, cache.db, vector_index): keep them out of the tree.
+ORIGINAL_CWD = os.getcwd()
+sys.path.insert(0, ORIGINAL_CWD)
+os.chdir(tempfile.mkdtemp(prefix="benchmark_suite_"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import agent, database, models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.retrieval_cache import CachedQueryEmbeddings, query_embedding_cache, retrieval_result_cache  # noqa: E402
+from app.vectorstore import HashingEmbeddings, HASHING_EMBEDDING_DIM  # noqa: E402
+from benchmarks.fakes import FakeLLM, FakeEmbeddings, CATEGORIES  # noqa: E402
+from benchmarks.synthetic import synthetic_inbox, TOPICS  # noqa: E402
+
+INSERT_CHUNK = 2000
+
+
+def summarize(samples_s: List[float]) -> Dict:
+    ordered = sorted(samples_s)
+    ms = lambda value: round(value * 1000, 3)  # noqa: E731
+    return {
+        "count": len(ordered),
+        "mean_ms": ms(statistics.mean(ordered)),
+        "p50_ms": ms(ordered[len(ordered) // 2]),
+        "p95_ms": ms(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]),
+        "max_ms": ms(ordered[-1]),
+    }
+
+
+def time_calls(fn: Callable, runs: int) -> List[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def install_fakes(llm_latency: float, embed_latency: float):
+    agent.llm_gateway.use_model(FakeLLM(llm_latency))
+    agent.llm_cache.enabled = False
+    query_embedding_cache.max_entries = 0
+    retrieval_result_cache.max_entries = 0
+    agent.embeddings = CachedQueryEmbeddings(
+        FakeEmbeddings(HashingEmbeddings(HASHING_EMBEDDING_DIM), embed_latency), query_embedding_cache
+    )
+    agent.clear_vector_db()
+
+
+def load_inbox(size: int, stale: int) -> Dict:
+    """Bulk-loads `size` synthetic emails; all but the newest `stale` look already triaged."""
+    versions = {"categorize_prompt_version": 1, "extract_actions_prompt_version": 1, "auto_reply_prompt_version": 1}
+    insert_s = ingest_s = 0.0
+    chunk = []
+
+    def flush():
+        nonlocal insert_s, ingest_s, chunk
+        started = time.perf_counter()
+        db = database.SessionLocal()
+        try:
+            db.execute(insert(models.Email), chunk)
+            db.commit()
+            emails = db.query(models.Email).filter(
+                models.Email.message_id.in_([row["message_id"] for row in chunk])
+            ).all()
+            insert_s += time.perf_counter() - started
+            started = time.perf_counter()
+            agent.ingest_emails(emails)
+            ingest_s += time.perf_counter() - started
+        finally:
+            db.close()
+        chunk = []
+
+    for i, row in enumerate(synthetic_inbox(size)):
+        if i < stale:
+            row.update(category="Uncategorized", suggested_reply=None, action_items={},
+                       **{column: None for column in versions})
+        else:
+            row.update(category=CATEGORIES[i % len(CATEGORIES)], suggested_reply="Thanks!",
+                       action_items={"tasks": [], "suggestions": []}, **versions)
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            flush()
+    if chunk:
+        flush()
+    return {
+        "insert": {"total_s": round(insert_s, 3), "rows_per_second": round(size / insert_s, 1)},
+        "vector_ingest": {"total_s": round(ingest_s, 3), "emails_per_second": round(size / ingest_s, 1)},
+    }
+
+
+def bench_listing(client: TestClient, runs: int) -> Dict:
+    first_page = time_calls(lambda: client.get("/emails/", params={"limit": 50}).raise_for_status(), runs)
+    filtered = time_calls(lambda: client.get("/emails/", params={"limit": 50, "category": "Work"}).raise_for_status(), runs)
+
+    deep = []
+    cursor = None
+    for _ in range(max(runs, 20)):
+        started = time.perf_counter()
+        response = client.get("/emails/", params={"limit": 50, **({"cursor": cursor} if cursor else {})})
+        deep.append(time.perf_counter() - started)
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    return {"list_first_page": summarize(first_page), "list_filtered": summarize(filtered),
+            "list_cursor_walk": summarize(deep)}
+
+
+def bench_rag(runs: int) -> Dict:
+    rng = random.Random(11)
+    db = database.SessionLocal()
+    try:
+        email = db.query(models.Email).order_by(models.Email.id.desc()).first()
+        body, sender, email_id = email.body, email.sender, email.id
+    finally:
+        db.close()
+
+    results = {}
+    for mode in ("lexical", "vector", "hybrid"):
+        queries = [f"what is the status of the {rng.choice(TOPICS)}?" for _ in range(runs)]
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            agent.build_chat_messages(body, query, sender, [], email_id=email_id, retrieval=mode)
+            samples.append(time.perf_counter() - started)
+        results[f"chat_rag_{mode}"] = summarize(samples)
+    return results
+
+
+def bench_processing(client: TestClient, single: int) -> Dict:
+    db = database.SessionLocal()
+    try:
+        stale_ids = [row.id for row in db.query(models.Email.id).filter(models.Email.category == "Uncategorized")
+                     .order_by(models.Email.id).limit(single)]
+    finally:
+        db.close()
+
+    samples = []
+    for email_id in stale_ids:
+        db = database.SessionLocal()
+        try:
+            email = db.query(models.Email).filter(models.Email.id == email_id).first()
+            started = time.perf_counter()
+            agent.process_single_email(email, db)
+            samples.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    agent.ingestion_buffer.flush()
+
+    started = time.perf_counter()
+    response = client.post("/process-emails/")
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    body = response.json()
+    return {
+        "process_single_email": summarize(samples) if samples else None,
+        "process_emails_endpoint": {
+            "total_s": round(elapsed, 3), "processed": body["processed"],
+            "emails_per_second": round(body["processed"] / elapsed, 2) if elapsed else None,
+        },
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ORIGINAL_CWD,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Scenarios whose p50 grew by more than `threshold`x against the baseline."""
+    regressions = []
+    for size, scenarios in results["results"].items():
+        for name, stats in scenarios.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not (isinstance(stats, dict) and isinstance(before, dict) and "p50_ms" in stats and "p50_ms" in before):
+                continue
+            ratio = stats["p50_ms"] / before["p50_ms"] if before["p50_ms"] else 1.0
+            print(f"{size:>8} {name:<28} {before['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} ms  x{ratio:.2f}",
+                  file=sys.stderr)
+            if ratio > threshold:
+                regressions.append(f"{size}/{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Inbox sizes, e.g. 1000 10000 100000.")
+    parser.add_argument("--runs", type=int, default=30, help="Samples per latency scenario.")
+    parser.add_argument("--stale", type=int, default=200, help="Untriaged emails per inbox (processed by the scenarios).")
+    parser.add_argument("--single", type=int, default=30, help="Of those, how many go through process_single_email one by one.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Fake LLM round trip in seconds.")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Fake embedding round trip in seconds.")
+    parser.add_argument("--output", help="Write the JSON results here (relative to the current directory).")
+    parser.add_argument("--baseline", help="Earlier results to compare p50 latencies against.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression.")
+    args = parser.parse_args()
+
+    install_fakes(args.llm_latency, args.embed_latency)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+
+    with TestClient(app) as client:
+        for size in args.sizes:
+            print(f"Inbox of {size} emails...", file=sys.stderr)
+            scenarios = {"reset_db": summarize(time_calls(lambda: client.post("/reset-db").raise_for_status(), 3))}
+            scenarios.update(load_inbox(size, min(args.stale, size)))
+            scenarios.update(bench_listing(client, args.runs))
+            scenarios.update(bench_rag(args.runs))
+            scenarios.update(bench_processing(client, min(args.single, args.stale, size)))
+            results["results"][str(size)] = scenarios
+
+    output = json.dumps(results, indent=2, default=str)
+    print(output)
+    if args.output:
+        path = os.path.join(ORIGINAL_CWD, args.output)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(os.path.join(ORIGINAL_CWD, args.baseline), "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Synthetic inbox: the mock emails of app.mock_data, varied into any number of distinct messages.
+
+Each message gets its own sender, subject, reference number, names and timestamp, so FTS,
+vector search, dedupe and pagination see realistic cardinalities instead of 15 repeated texts.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator
+
+from app.mock_data import get_mock_emails
+
+FIRST_NAMES = ["Alice", "Bob", "Carla", "Deepak", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas", "Kemi", "Luca"]
+TOPICS = ["Q3 report", "budget review", "onboarding", "release 2.4", "vendor contract", "offsite",
+          "security audit", "hiring plan", "customer escalation", "roadmap", "invoice", "migration"]
+
+
+def synthetic_inbox(count: int, seed: int = 7, start: datetime = None) -> Iterator[Dict]:
+    """Yields `count` email dicts (sender, subject, body, timestamp, message_id), newest first."""
+    rng = random.Random(seed)
+    templates = get_mock_emails()
+    start = start or datetime.utcnow()
+    timestamp = start
+    for i in range(count):
+        template = templates[i % len(templates)]
+        name = rng.choice(FIRST_NAMES)
+        topic = rng.choice(TOPICS)
+        reference = f"REF-{seed}-{i:07d}"
+        local, _, domain = template["sender"].partition("@")
+        timestamp -= timedelta(seconds=rng.randint(30, 3600))
+        yield {
+            "message_id": f"<synthetic-{seed}-{i}@benchmark.local>",
+            "sender": f"{local}{i % 997}@{domain}",
+            "subject": f"{template['subject']} [{topic}]",
+            "body": (
+                f"Hi {name},\n\n{template['body'].strip()}\n\n"
+                f"Regarding the {topic}: please quote {reference} in any reply.\n"
+            ),
+            "timestamp": timestamp,
+        }
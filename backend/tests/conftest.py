@@ -0,0 +1,19 @@
+"""
+Offline test setup: hashing embeddings, the local vector store and fake API keys, with the
+databases and indexes the app creates at import time kept in a throwaway directory.
+
+Run from the backend directory:
+
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.chdir(tempfile.mkdtemp(prefix="email-agent-tests-"))
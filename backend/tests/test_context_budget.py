@@ -0,0 +1,69 @@
+import pytest
+
+from app import context_budget
+from app.context_budget import count_tokens, fit_history, message_tokens
+
+TURNS = [("user" if i % 2 == 0 else "assistant", f"message {i}: " + "word " * (5 + i % 4)) for i in range(14)]
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(context_budget, "HISTORY_SUMMARY_BLOCK", 4)
+    monkeypatch.setattr(context_budget, "HISTORY_SUMMARY_RESERVE", 30)
+    monkeypatch.setattr(context_budget, "HISTORY_SUMMARY_TOKENS", 10)
+
+
+class Summarizer:
+    def __init__(self):
+        self.blocks = []
+
+    def __call__(self, turns):
+        self.blocks.append(list(turns))
+        return "summary of earlier turns"
+
+
+def sent_tokens(summaries, kept):
+    return sum(count_tokens(summary) + 2 for summary in summaries) + sum(message_tokens(content) for _, content in kept)
+
+
+def test_history_that_fits_is_kept_whole():
+    summarize = Summarizer()
+    assert fit_history(TURNS, 10_000, summarize) == ([], TURNS, 0, 0)
+    assert summarize.blocks == []
+
+
+@pytest.mark.parametrize("budget", range(20, 200, 7))
+def test_fitted_history_is_a_contiguous_tail_within_budget(budget):
+    summarize = Summarizer()
+    summaries, kept, summarized, dropped = fit_history(TURNS, budget, summarize)
+
+    assert sent_tokens(summaries, kept) <= budget
+    assert dropped + summarized + len(kept) == len(TURNS)
+    assert kept == TURNS[len(TURNS) - len(kept):]
+    # Summaries are of complete blocks that end right where the kept turns begin.
+    block = context_budget.HISTORY_SUMMARY_BLOCK
+    start = len(TURNS) - len(kept)
+    if summarized:
+        assert start % block == 0 and summarized % block == 0
+    expected = [TURNS[first:first + block] for first in range(start - summarized, start, block)]
+    assert summarize.blocks[:len(summaries)] == expected[::-1]  # newest block first
+
+
+def test_budget_is_reserved_for_summaries():
+    summaries, kept, summarized, _ = fit_history(TURNS, 120, Summarizer())
+    assert summaries and summarized
+    assert sum(message_tokens(content) for _, content in kept) <= 120 - context_budget.HISTORY_SUMMARY_RESERVE
+
+
+def test_summarize_is_not_called_without_room(monkeypatch):
+    monkeypatch.setattr(context_budget, "HISTORY_SUMMARY_TOKENS", 1_000)
+    summarize = Summarizer()
+    summaries, kept, summarized, dropped = fit_history(TURNS, 120, summarize)
+    assert summarize.blocks == [] and summaries == [] and summarized == 0
+    assert dropped + len(kept) == len(TURNS)
+
+
+def test_without_summarizer_oldest_turns_are_dropped():
+    summaries, kept, summarized, dropped = fit_history(TURNS, 60)
+    assert summaries == [] and summarized == 0
+    assert kept == TURNS[dropped:] and sent_tokens([], kept) <= 60
@@ -0,0 +1,97 @@
+import random
+from types import MappingProxyType
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import dedup, models
+from app.prompt_registry import PromptEntry, PromptSnapshot
+
+BODY = ("Your monthly statement for account ending 4821 is ready. The balance of 120 dollars is due "
+        "on March 14. Log in to the customer portal to review recent transactions and download a copy "
+        "of the statement for your records.")
+PROMPTS = PromptSnapshot(0, MappingProxyType({
+    prompt_type: PromptEntry(prompt_type, prompt_type, 1) for prompt_type in ("categorize", "extract_actions", "auto_reply")
+}))
+
+
+def bands(value: int):
+    return [(value >> (band * dedup.BAND_BITS)) & ((1 << dedup.BAND_BITS) - 1) for band in range(dedup.BANDS)]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def triaged(db, subject, body, category="Newsletter"):
+    email = models.Email(subject=subject, body=body, category=category, action_items={"tasks": ["Pay"]},
+                         suggested_reply="Thanks", categorize_prompt_version=1,
+                         extract_actions_prompt_version=1, auto_reply_prompt_version=1,
+                         **dedup.fingerprint_columns(subject, body))
+    db.add(email)
+    db.commit()
+    return email
+
+
+def test_short_text_gets_no_fingerprint():
+    assert dedup.simhash("Lunch tomorrow?") is None
+    assert set(dedup.fingerprint_columns("Hi", "Lunch tomorrow?").values()) == {None}
+
+
+def test_digits_are_folded():
+    assert dedup.simhash(BODY) == dedup.simhash(BODY.replace("4821", "9307").replace("14", "28"))
+
+
+def test_close_hashes_always_share_a_band():
+    rng = random.Random(7)
+    for _ in range(500):
+        value = rng.getrandbits(dedup.BITS)
+        near = value
+        for bit in rng.sample(range(dedup.BITS), dedup.BANDS - 1):
+            near ^= 1 << bit
+        assert any(a == b for a, b in zip(bands(value), bands(near)))
+
+
+def test_fingerprint_bands_match_the_hash():
+    columns = dedup.fingerprint_columns("Statement", BODY)
+    value = columns["simhash"] % (1 << dedup.BITS)
+    assert [columns[f"simhash_band_{band}"] for band in range(dedup.BANDS)] == bands(value)
+
+
+def test_same_numbers_reuse_the_whole_triage(db):
+    original = triaged(db, "Statement", BODY)
+    repeat = models.Email(subject="Statement", body=BODY)
+    db.add(repeat)
+    db.flush()
+    duplicate = dedup.NearDuplicateFinder(enabled=True).find(repeat, PROMPTS, db)
+    assert duplicate is not None and duplicate.email_id == original.id
+    assert duplicate.category == "Newsletter"
+    assert duplicate.action_items == {"tasks": ["Pay"]}
+
+
+def test_different_numbers_reuse_only_the_category(db):
+    triaged(db, "Statement", BODY)
+    repeat = models.Email(subject="Statement", body=BODY.replace("March 14", "March 21"))
+    db.add(repeat)
+    db.flush()
+    finder = dedup.NearDuplicateFinder(enabled=True, reuse_draft=True)
+    duplicate = finder.find(repeat, PROMPTS, db)
+    assert duplicate is not None and duplicate.category == "Newsletter"
+    assert duplicate.action_items is None and duplicate.draft is None
+    assert finder.snapshot()["category_only"] == 1
+
+
+def test_unrelated_email_is_not_a_duplicate(db):
+    triaged(db, "Statement", BODY)
+    other = models.Email(subject="Offsite", body=("The team offsite moves to the lake house this year. Bring "
+                                                  "hiking shoes, a rain jacket and ideas for the roadmap session "
+                                                  "we will hold on the second morning."))
+    db.add(other)
+    db.flush()
+    assert dedup.NearDuplicateFinder(enabled=True).find(other, PROMPTS, db) is None
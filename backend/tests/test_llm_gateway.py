@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app import llm_gateway
+from app.llm_gateway import LLMGateway, Provider
+from app.rate_limit import RateLimiter
+from benchmarks.fakes import FakeLLM
+
+MESSAGES = [SystemMessage(content="Reply politely."), HumanMessage(content="Can we meet on Friday?")]
+
+
+class Status(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class Failing(FakeLLM):
+    """FakeLLM that raises `error` for its first `times` calls."""
+
+    def __init__(self, error, times=1_000, latency=0.0):
+        super().__init__(latency)
+        self.error = error
+        self.times = times
+
+    def invoke(self, messages, **kwargs):
+        if self.calls < self.times:
+            self.calls += 1
+            raise self.error
+        return super().invoke(messages, **kwargs)
+
+    async def ainvoke(self, messages, **kwargs):
+        if self.calls < self.times:
+            self.calls += 1
+            raise self.error
+        return await super().ainvoke(messages, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(llm_gateway, "LLM_BACKOFF_MAX", 0.05)
+
+
+def test_rate_limited_primary_fails_over():
+    primary, fallback = Provider("primary", Failing(Status(429))), Provider("fallback", FakeLLM())
+    gateway = LLMGateway([primary, fallback], hedge=False)
+    provider, response = gateway.invoke(MESSAGES, "draft_reply")
+    assert provider is fallback and response.content
+    assert gateway.stats["failovers"] == 1 and primary.stats["rate_limit"] == 1
+
+
+def test_round_is_retried_after_every_provider_failed():
+    primary = Provider("primary", Failing(Status(503), times=1))
+    fallback = Provider("fallback", Failing(Status(503), times=1))
+    gateway = LLMGateway([primary, fallback], hedge=False, max_retries=1)
+    provider, _ = gateway.invoke(MESSAGES, "draft_reply")
+    assert provider is primary
+    assert gateway.stats["retries"] == 2
+
+
+def test_non_retryable_error_is_raised_once_providers_are_exhausted():
+    only = Provider("only", Failing(Status(400)))
+    gateway = LLMGateway([only], hedge=False, max_retries=3)
+    with pytest.raises(Status):
+        gateway.invoke(MESSAGES, "draft_reply")
+    assert only.model.calls == 1 and gateway.stats["failed"] == 1
+
+
+def test_exhausted_local_quota_fails_over_without_a_request():
+    primary, fallback = Provider("primary", FakeLLM(), rpm=1), Provider("fallback", FakeLLM())
+    gateway = LLMGateway([primary, fallback], hedge=False)
+    started = time.perf_counter()
+    answered = [gateway.invoke(MESSAGES, "draft_reply")[0] for _ in range(3)]
+    assert answered == [primary, fallback, fallback]
+    assert time.perf_counter() - started < 1
+    assert primary.stats["requests"] == 1 and primary.stats["throttled"] == 2
+    assert primary.state() == "healthy"
+
+
+def test_single_provider_waits_for_its_quota():
+    only = Provider("only", FakeLLM())
+    only.rate_limiter = RateLimiter(rpm=1, window=0.2)
+    gateway = LLMGateway([only], hedge=False, max_retries=0)
+    started = time.perf_counter()
+    for _ in range(2):
+        assert gateway.invoke(MESSAGES, "draft_reply")[0] is only
+    assert time.perf_counter() - started >= 0.15
+    assert gateway.stats["failed"] == 0
+
+
+def test_async_quota_failover():
+    primary, fallback = Provider("primary", FakeLLM(), rpm=1), Provider("fallback", FakeLLM())
+    gateway = LLMGateway([primary, fallback], hedge=False)
+
+    async def run():
+        return [(await gateway.ainvoke(MESSAGES, "chat"))[0] for _ in range(2)]
+
+    assert asyncio.run(run()) == [primary, fallback]
+
+
+def test_slow_primary_is_hedged(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE_AFTER_MS", 20)
+    primary, fallback = Provider("primary", FakeLLM(latency=0.5)), Provider("fallback", FakeLLM())
+    gateway = LLMGateway([primary, fallback], hedge=True)
+    started = time.perf_counter()
+    provider, _ = gateway.invoke(MESSAGES, "draft_reply")
+    assert provider is fallback and time.perf_counter() - started < 0.4
+    assert fallback.stats["hedges_won"] == 1
@@ -0,0 +1,49 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations
+
+# The schema create_all produced before migrations existed.
+BASELINE_SCHEMA = [
+    """CREATE TABLE emails (id INTEGER PRIMARY KEY, sender VARCHAR, subject VARCHAR, body TEXT,
+       timestamp DATETIME, is_read BOOLEAN, category VARCHAR, action_items JSON, suggested_reply TEXT)""",
+    "CREATE TABLE prompts (id INTEGER PRIMARY KEY, prompt_type VARCHAR UNIQUE, content TEXT, last_updated DATETIME)",
+    "CREATE TABLE drafts (id INTEGER PRIMARY KEY, recipient VARCHAR, subject VARCHAR, body TEXT, timestamp DATETIME)",
+    "CREATE INDEX ix_emails_id ON emails (id)",
+    "CREATE INDEX ix_emails_sender ON emails (sender)",
+    "CREATE INDEX ix_prompts_id ON prompts (id)",
+    "CREATE INDEX ix_drafts_id ON drafts (id)",
+]
+
+
+def shape(engine):
+    inspector = inspect(engine)
+    return {table: sorted(column["name"] for column in inspector.get_columns(table))
+            for table in ("emails", "prompts", "drafts")}
+
+
+def test_fresh_database_gets_every_migration_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(engine) == []
+    assert all(entry["applied"] for entry in migrations.status(engine))
+
+
+def test_baseline_database_is_brought_forward(tmp_path):
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migrations.upgrade(fresh)
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO emails (sender, subject, body, category, is_read) "
+                                "VALUES ('a@example.com', 'Budget', 'quarterly budget review', 'Work', 0)"))
+
+    migrations.upgrade(old)
+
+    assert shape(old) == shape(fresh)
+    indexes = {index["name"] for index in inspect(old).get_indexes("emails")}
+    assert indexes >= {index["name"] for index in inspect(fresh).get_indexes("emails")}
+    with old.connect() as connection:
+        assert connection.execute(text("SELECT subject, category FROM emails")).all() == [("Budget", "Work")]
+        # The full-text index is backfilled with rows that predate it.
+        assert connection.execute(text("SELECT count(*) FROM emails_fts WHERE emails_fts MATCH 'budget'")).scalar() == 1
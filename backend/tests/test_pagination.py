@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.pagination import after_cursor, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, 9, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "MjAyNA=="])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_keyset_pages_cover_every_email_once_in_order(db):
+    start = datetime(2024, 1, 1)
+    # Several emails per timestamp: the id breaks ties, so none is skipped or repeated.
+    db.add_all(models.Email(sender="a@example.com", subject=f"s{i}", body="b",
+                            timestamp=start + timedelta(minutes=i // 3)) for i in range(20))
+    db.commit()
+    order = (models.Email.timestamp.desc(), models.Email.id.desc())
+    expected = list(db.scalars(select(models.Email.id).order_by(*order)))
+
+    seen, cursor = [], None
+    while True:
+        query = select(models.Email.id, models.Email.timestamp).order_by(*order).limit(7)
+        if cursor:
+            query = query.where(after_cursor(cursor))
+        rows = db.execute(query).all()
+        if not rows:
+            break
+        seen.extend(row.id for row in rows)
+        cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    assert seen == expected
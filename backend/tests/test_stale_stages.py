@@ -0,0 +1,42 @@
+from types import MappingProxyType
+
+from app import models
+from app.agent import stale_stages
+from app.prompt_registry import PromptEntry, PromptSnapshot
+
+
+def prompts(categorize=1, extract_actions=1, auto_reply=1):
+    versions = {"categorize": categorize, "extract_actions": extract_actions, "auto_reply": auto_reply}
+    return PromptSnapshot(0, MappingProxyType({
+        prompt_type: PromptEntry(prompt_type, prompt_type, version) for prompt_type, version in versions.items()
+    }))
+
+
+def email(category="Work", categorize=1, extract_actions=1, auto_reply=1):
+    return models.Email(category=category, categorize_prompt_version=categorize,
+                        extract_actions_prompt_version=extract_actions, auto_reply_prompt_version=auto_reply)
+
+
+def test_current_email_has_no_stale_stages():
+    assert stale_stages(email(), prompts()) == []
+
+
+def test_unprocessed_email_is_stale_everywhere():
+    unprocessed = email("Uncategorized", None, None, None)
+    assert stale_stages(unprocessed, prompts()) == ["categorize", "extract_actions", "draft_reply"]
+
+
+def test_new_draft_prompt_only_redrafts():
+    assert stale_stages(email(), prompts(auto_reply=2)) == ["draft_reply"]
+
+
+def test_new_actions_prompt_only_reextracts():
+    assert stale_stages(email(), prompts(extract_actions=2)) == ["extract_actions"]
+
+
+def test_stale_category_also_redrafts():
+    assert stale_stages(email(), prompts(categorize=2)) == ["categorize", "draft_reply"]
+
+
+def test_uncategorized_email_is_recategorized_with_current_versions():
+    assert stale_stages(email("Uncategorized"), prompts()) == ["categorize", "draft_reply"]
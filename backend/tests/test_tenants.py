@@ -0,0 +1,44 @@
+from sqlalchemy import func, select
+
+from app import database, models, tenants
+
+
+def test_blank_user_id_is_the_default_tenant():
+    assert tenants.tenant_key(None) == tenants.DEFAULT_TENANT
+    assert tenants.tenant_key("   ") == tenants.DEFAULT_TENANT
+
+
+def test_tenant_key_is_stable_and_safe():
+    key = tenants.tenant_key("Alice.Smith@Example.com")
+    assert key == tenants.tenant_key("  Alice.Smith@Example.com ")
+    assert key.startswith("alice-smith-example-com-")
+    assert all(char.isalnum() or char == "-" for char in key)
+
+
+def test_ids_differing_in_case_or_punctuation_get_separate_keys():
+    assert tenants.tenant_key("Alice") != tenants.tenant_key("alice")
+    assert tenants.tenant_key("a.b") != tenants.tenant_key("a-b")
+
+
+def test_tenant_local_keeps_one_instance_per_tenant():
+    local = tenants.TenantLocal(lambda tenant: {"tenant": tenant})
+    with tenants.activate("one"):
+        first = local.current()
+        assert local.current() is first
+    with tenants.activate("two"):
+        assert local.current()["tenant"] == "two"
+    assert local.current()["tenant"] == tenants.DEFAULT_TENANT
+
+
+def test_tenant_databases_are_isolated():
+    one, two = tenants.tenant_key("isolation-one"), tenants.tenant_key("isolation-two")
+    with tenants.use(one):
+        with database.SessionLocal() as db:
+            db.add(models.Email(sender="a@example.com", subject="only in one", body="b"))
+            db.commit()
+    with tenants.use(two):
+        with database.SessionLocal() as db:
+            assert db.scalar(select(func.count()).select_from(models.Email)) == 0
+    with tenants.use(one):
+        with database.SessionLocal() as db:
+            assert db.scalars(select(models.Email.subject)).all() == ["only in one"]
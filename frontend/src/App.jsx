@@ -66,10 +66,32 @@ export default function App() {
       ? emails.find((e) => e.id === selectedEmailId)
       : drafts.find((d) => d.id === selectedEmailId);
 
+  // The inbox list only carries headers; load the full email when one is opened.
+  useEffect(() => {
+    if (viewMode !== "inbox" || !selectedItem || selectedItem.body !== undefined)
+      return;
+    axios
+      .get(`http://127.0.0.1:8000/emails/${selectedItem.id}`)
+      .then((res) =>
+        setEmails((prev) =>
+          prev.map((e) =>
+            e.id === res.data.id ? { ...res.data, isStarred: e.isStarred } : e
+          )
+        )
+      )
+      .catch((e) => console.error("Failed to load email", e));
+  }, [viewMode, selectedItem?.id, selectedItem?.body]);
+
   const handleLogin = async (e) => {
     e.preventDefault();
     setLoading(true);
     try {
+      // Every request from now on is served from this user's own mailbox.
+      if (loginCreds.username) {
+        axios.defaults.headers.common["X-User-Id"] = loginCreds.username;
+      } else {
+        delete axios.defaults.headers.common["X-User-Id"];
+      }
       await axios.post("http://127.0.0.1:8000/reset-db");
       await refreshData();
       setIsLoggedIn(true);